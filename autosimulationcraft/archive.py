@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - compressed, content-addressed report archive
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+import gzip
+import errno
+import shutil
+import threading
+from collections import namedtuple, OrderedDict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from artifacts import hash_file
+from lock import FileLock
+
+#: one archived simulation run; ``files`` maps a kind of file (i.e.
+#: ``'html'``) to the content hash it is stored under
+ArchivedRun = namedtuple('ArchivedRun', ['character', 'time', 'files'])
+
+
+class ReportArchive(object):
+
+    """
+    Archive of the files from each simulation run (simc input, HTML and JSON
+    reports, simc output), in ``path``. Files are stored gzip-compressed
+    under the SHA-256 of their content, so identical files are only stored
+    once. Only the last ``keep`` runs of each character are kept, and the
+    least-recently-used files (and the runs they belong to) are evicted once
+    the archive is bigger than ``max_size`` bytes. Safe to use from multiple
+    threads.
+    """
+
+    DEFAULT_KEEP = 10
+    DEFAULT_MAX_SIZE = 500 * 1024 * 1024
+
+    def __init__(self, path, keep=DEFAULT_KEEP, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param path: archive directory; created when the first run is added
+        :type path: string
+        :param keep: number of runs to keep per character
+        :type keep: int
+        :param max_size: maximum total (compressed) size of the files, in bytes
+        :type max_size: int
+        """
+        self.path = path
+        self.keep = keep
+        self.max_size = max_size
+        # character -> [ArchivedRun, ...], oldest first
+        self.runs = {}
+        # content hash -> compressed size, least recently used first
+        self.objects = OrderedDict()
+        self.lock = threading.Lock()
+        self.load()
+
+    def _index_path(self):
+        return os.path.join(self.path, 'index.pkl')
+
+    def object_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest + '.gz')
+
+    def load(self):
+        """ load the index from disk, if it exists """
+        if not os.path.exists(self._index_path()):
+            return
+        with open(self._index_path(), 'rb') as fh:
+            runs, objects = pickle.load(fh)
+        self.runs = dict((c, [ArchivedRun(*r) for r in v]) for c, v in runs.items())
+        self.objects = OrderedDict(objects)
+
+    def save(self):
+        """ write the index to disk """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        runs = dict((c, [tuple(r) for r in v]) for c, v in self.runs.items())
+        tmppath = self._index_path() + '.tmp'
+        with open(tmppath, 'wb') as fh:
+            pickle.dump((runs, list(self.objects.items())), fh, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmppath, self._index_path())
+
+    @property
+    def size(self):
+        """ total compressed size of the stored files, in bytes """
+        return sum(self.objects.values())
+
+    def _store(self, source):
+        """ store the content of path or file object ``source``; return its hash """
+        fh = source
+        if not hasattr(source, 'read'):
+            fh = open(source, 'rb')
+        try:
+            digest, _ = hash_file(fh)
+            if digest in self.objects:
+                self.objects[digest] = self.objects.pop(digest)
+                return digest
+            path = self.object_path(digest)
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+            fh.seek(0)
+            tmppath = path + '.tmp'
+            with open(tmppath, 'wb') as raw:
+                # no name or mtime, so that identical content compresses identically
+                gz = gzip.GzipFile('', 'wb', 6, raw, mtime=0)
+                shutil.copyfileobj(fh, gz)
+                gz.close()
+            os.rename(tmppath, path)
+            self.objects[digest] = os.path.getsize(path)
+            return digest
+        finally:
+            if fh is not source:
+                fh.close()
+
+    def add(self, character, time, files):
+        """
+        Archive the files from one run of ``character``, apply the retention
+        policy and save the index.
+
+        :param character: character name in name@realm format
+        :type character: string
+        :param time: when the run was started
+        :type time: datetime.datetime
+        :param files: kind of file to a path or file object to read it from
+        :type files: dict
+        :rtype: ArchivedRun
+        """
+        try:
+            os.makedirs(self.path)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        with self.lock, FileLock(os.path.join(self.path, 'index.lock')):
+            # pick up the runs archived by any other run since the index was loaded
+            self.load()
+            run = ArchivedRun(character, time,
+                              dict((kind, self._store(src)) for kind, src in files.items()))
+            runs = self.runs.setdefault(character, [])
+            runs.append(run)
+            del runs[:-self.keep]
+            self._evict(run)
+            self._collect()
+            self.save()
+        return run
+
+    def rename(self, old, new):
+        """
+        Move the archived runs of character ``old`` to ``new``, unless
+        ``new`` already has runs.
+
+        :returns: whether anything was moved
+        :rtype: bool
+        """
+        if not os.path.isdir(self.path):
+            return False
+        with self.lock, FileLock(os.path.join(self.path, 'index.lock')):
+            self.load()
+            if old not in self.runs or new in self.runs:
+                return False
+            self.runs[new] = [r._replace(character=new) for r in self.runs.pop(old)]
+            self.save()
+        return True
+
+    def _evict(self, current):
+        """ drop least-recently-used files, and their runs, until under max_size """
+        protected = set(current.files.values())
+        for digest in list(self.objects.keys()):
+            if self.size <= self.max_size:
+                return
+            if digest in protected:
+                continue
+            for character, runs in self.runs.items():
+                runs[:] = [r for r in runs if digest not in r.files.values()]
+            del self.objects[digest]
+
+    def _collect(self):
+        """ remove the files that no longer belong to any run """
+        used = set()
+        for character in list(self.runs.keys()):
+            if len(self.runs[character]) == 0:
+                del self.runs[character]
+                continue
+            for r in self.runs[character]:
+                used.update(r.files.values())
+        for digest in list(self.objects.keys()):
+            if digest not in used:
+                del self.objects[digest]
+        for digest in self._stored():
+            if digest not in used:
+                os.unlink(self.object_path(digest))
+
+    def _stored(self):
+        """ hashes of all files in the archive directory """
+        if not os.path.isdir(self.path):
+            return
+        for d in os.listdir(self.path):
+            subdir = os.path.join(self.path, d)
+            if len(d) != 2 or not os.path.isdir(subdir):
+                continue
+            for fname in os.listdir(subdir):
+                if fname.endswith('.gz'):
+                    yield fname[:-3]
+
+    def history(self, character):
+        """
+        Return the archived runs of ``character``, oldest first.
+
+        :rtype: list of :py:class:`ArchivedRun`
+        """
+        with self.lock:
+            return list(self.runs.get(character, []))
+
+    def open(self, digest):
+        """
+        Return a file object to read (uncompressed) archived content from.
+
+        :param digest: content hash, from :py:attr:`ArchivedRun.files`
+        :type digest: string
+        :rtype: file
+        """
+        with self.lock:
+            self.objects[digest] = self.objects.pop(digest)
+            self.save()
+        return gzip.open(self.object_path(digest), 'rb')
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - report artifact storage
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+import hmac
+import errno
+import Queue
+import socket
+import tempfile
+import urllib
+import hashlib
+import httplib
+import datetime
+import threading
+import urlparse
+
+#: bytes read at a time when hashing and copying artifacts
+CHUNK_SIZE = 64 * 1024
+
+#: hash of an empty request body, for signing HEAD requests
+EMPTY_SHA256 = hashlib.sha256('').hexdigest()
+
+
+class ArtifactError(Exception):
+    pass
+
+
+#: exceptions that mean an upload failed
+UPLOAD_ERRORS = (ArtifactError, IOError, OSError, socket.error, httplib.HTTPException)
+
+
+def artifact_key(digest, filename):
+    """
+    Return the storage key for an artifact; keyed by content hash, so that
+    identical artifacts are only stored once.
+
+    :param digest: hex SHA-256 of the artifact's content
+    :type digest: string
+    :param filename: the file name it should be downloaded as
+    :type filename: string
+    :rtype: string
+    """
+    return '{p}/{d}/{f}'.format(p=digest[:2], d=digest, f=filename)
+
+
+def hash_file(fh):
+    """
+    Return ``(hex SHA-256, size)`` of the content of file object ``fh``,
+    read from the beginning in chunks.
+    """
+    fh.seek(0)
+    h = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = fh.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        h.update(chunk)
+        size += len(chunk)
+    return h.hexdigest(), size
+
+
+class DirectoryBackend(object):
+
+    """
+    Stores artifacts in a local directory (i.e. one served by a web server
+    at ``base_url``).
+    """
+
+    def __init__(self, path, base_url=None):
+        """
+        :param path: directory to store artifacts in
+        :type path: string
+        :param base_url: URL that ``path`` is served at; if None, links are
+          ``file://`` URLs
+        :type base_url: string
+        """
+        self.path = path
+        self.base_url = base_url
+
+    def url(self, key):
+        if self.base_url is None:
+            return 'file://' + urllib.pathname2url(os.path.join(self.path, key))
+        return self.base_url.rstrip('/') + '/' + urllib.quote(key)
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.path, key))
+
+    def put(self, key, fh, size, content_type):
+        path = os.path.join(self.path, key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        # unique, as another upload thread may be storing the same content
+        tmpfd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                      dir=os.path.dirname(path))
+        with os.fdopen(tmpfd, 'wb') as out:
+            while True:
+                chunk = fh.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+        # mkstemp creates the file readable only by us
+        os.chmod(tmp, 0644)
+        os.rename(tmp, path)
+
+
+def _hmac(key, msg):
+    return hmac.new(key, msg, hashlib.sha256).digest()
+
+
+def sigv4_headers(method, url, headers, payload_hash, access_key, secret_key, region, now,
+                  service='s3'):
+    """
+    Return ``headers`` plus the ``x-amz-date``, ``x-amz-content-sha256``
+    and ``Authorization`` headers that sign the request with AWS Signature
+    Version 4. All of ``headers`` (and ``Host``) are signed.
+
+    :param method: HTTP method
+    :type method: string
+    :param url: full request URL (without a query string)
+    :type url: string
+    :param headers: other request headers
+    :type headers: dict
+    :param payload_hash: hex SHA-256 of the request body
+    :type payload_hash: string
+    :param now: request time, in UTC
+    :type now: datetime.datetime
+    :rtype: dict
+    """
+    parsed = urlparse.urlsplit(url)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    datestamp = now.strftime('%Y%m%d')
+    headers = dict(headers)
+    headers['Host'] = parsed.netloc
+    headers['x-amz-date'] = amz_date
+    headers['x-amz-content-sha256'] = payload_hash
+    canonical = sorted((k.lower(), ' '.join(str(v).split())) for k, v in headers.items())
+    signed = ';'.join(k for k, _ in canonical)
+    request = '\n'.join([method, urllib.quote(parsed.path or '/', safe='/~'), '',
+                         ''.join('{k}:{v}\n'.format(k=k, v=v) for k, v in canonical),
+                         signed, payload_hash])
+    scope = '{d}/{r}/{s}/aws4_request'.format(d=datestamp, r=region, s=service)
+    to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope,
+                         hashlib.sha256(request).hexdigest()])
+    key = _hmac(_hmac(_hmac(_hmac('AWS4' + secret_key, datestamp), region), service),
+                'aws4_request')
+    headers['Authorization'] = (
+        'AWS4-HMAC-SHA256 Credential={a}/{s}, SignedHeaders={h}, Signature={g}'.format(
+            a=access_key, s=scope, h=signed,
+            g=hmac.new(key, to_sign, hashlib.sha256).hexdigest()))
+    return headers
+
+
+class S3Backend(object):
+
+    """
+    Stores artifacts in a bucket of an S3-compatible object storage
+    service, addressed path-style (``<endpoint>/<bucket>/<key>``).
+    """
+
+    def __init__(self, endpoint, bucket, access_key, secret_key, region='us-east-1',
+                 base_url=None, timeout=60, clock=datetime.datetime.utcnow):
+        """
+        :param endpoint: service URL, i.e. ``https://s3.amazonaws.com``
+        :type endpoint: string
+        :param base_url: URL the bucket's objects are publicly readable at;
+          defaults to ``<endpoint>/<bucket>``
+        :type base_url: string
+        """
+        self.endpoint = endpoint.rstrip('/')
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.base_url = base_url
+        if base_url is None:
+            self.base_url = '{e}/{b}'.format(e=self.endpoint, b=bucket)
+        self.timeout = timeout
+        self.clock = clock
+
+    def url(self, key):
+        return self.base_url.rstrip('/') + '/' + urllib.quote(key)
+
+    def _object_url(self, key):
+        return '{e}/{b}/{k}'.format(e=self.endpoint, b=self.bucket, k=key)
+
+    def _request(self, method, key, headers, payload_hash, body=None):
+        url = self._object_url(key)
+        headers = sigv4_headers(method, url, headers, payload_hash, self.access_key,
+                                self.secret_key, self.region, self.clock())
+        parsed = urlparse.urlsplit(url)
+        cls = httplib.HTTPSConnection if parsed.scheme == 'https' else httplib.HTTPConnection
+        conn = cls(parsed.netloc, timeout=self.timeout)
+        try:
+            # httplib sends file objects in blocks, not all at once
+            conn.request(method, urllib.quote(parsed.path, safe='/~'), body, headers)
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status
+        finally:
+            conn.close()
+
+    def exists(self, key):
+        status = self._request('HEAD', key, {}, EMPTY_SHA256)
+        if status == 404:
+            return False
+        if status != 200:
+            raise ArtifactError('HEAD {k} returned HTTP {s}'.format(k=key, s=status))
+        return True
+
+    def put(self, key, fh, size, content_type):
+        digest, _ = hash_file(fh)
+        fh.seek(0)
+        status = self._request('PUT', key, {'Content-Length': str(size),
+                                            'Content-Type': content_type}, digest, body=fh)
+        if status not in (200, 201):
+            raise ArtifactError('PUT {k} returned HTTP {s}'.format(k=key, s=status))
+
+
+def backend_from_settings(conf):
+    """
+    Return the backend described by an ``ARTIFACT_BACKEND`` settings dict.
+
+    :raises: ArtifactError if the settings are invalid
+    """
+    if not isinstance(conf, dict) or 'type' not in conf:
+        raise ArtifactError("must be a dict with a 'type' key")
+    if conf['type'] == 'directory':
+        if 'path' not in conf:
+            raise ArtifactError("'directory' backend needs a 'path'")
+        return DirectoryBackend(conf['path'], base_url=conf.get('base_url', None))
+    if conf['type'] == 's3':
+        missing = [k for k in ('endpoint', 'bucket', 'access_key', 'secret_key')
+                   if k not in conf]
+        if len(missing) > 0:
+            raise ArtifactError("'s3' backend needs: {m}".format(m=', '.join(missing)))
+        return S3Backend(conf['endpoint'], conf['bucket'], conf['access_key'],
+                         conf['secret_key'], region=conf.get('region', 'us-east-1'),
+                         base_url=conf.get('base_url', None))
+    raise ArtifactError("unknown type '{t}'; must be 'directory' or 's3'".format(t=conf['type']))
+
+
+class ArtifactUploader(object):
+
+    """
+    Uploads artifacts to a backend in background threads, so that uploads
+    overlap with the following simulations. Artifacts are keyed by content
+    hash (see :py:func:`artifact_key`), and ones already stored aren't
+    uploaded again.
+    """
+
+    def __init__(self, backend, logger, workers=2):
+        self.backend = backend
+        self.logger = logger
+        self.workers = workers
+        self.queue = Queue.Queue()
+        self.threads = []
+        self.uploaded = set()
+        self.lock = threading.Lock()
+
+    def submit(self, files, callback):
+        """
+        Queue ``files`` for upload; when they're all uploaded, call
+        ``callback`` (in an upload thread) with a dict of filename to URL,
+        or with None if any of them failed.
+
+        :param files: ``(source, filename, content_type)`` tuples; source is
+          a path or a file object
+        :type files: list
+        :param callback: function to call when done
+        :type callback: callable
+        """
+        if len(self.threads) == 0:
+            for _ in range(self.workers):
+                t = threading.Thread(target=self._work)
+                t.daemon = True
+                t.start()
+                self.threads.append(t)
+        self.queue.put((files, callback))
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            files, callback = job
+            links = {}
+            try:
+                for source, filename, content_type in files:
+                    links[filename] = self.upload(source, filename, content_type)
+            except UPLOAD_ERRORS as ex:
+                self.logger.warning("Unable to upload {f}: {e}".format(f=filename, e=ex))
+                links = None
+            try:
+                callback(links)
+            except Exception:
+                self.logger.exception("Error handling uploaded {f}".format(
+                    f=', '.join(f[1] for f in files)))
+
+    def upload(self, source, filename, content_type):
+        """
+        Upload one artifact (unless it's already stored) and return its URL.
+        """
+        fh = source
+        if not hasattr(source, 'read'):
+            fh = open(source, 'rb')
+        try:
+            digest, size = hash_file(fh)
+            key = artifact_key(digest, filename)
+            with self.lock:
+                if key in self.uploaded:
+                    return self.backend.url(key)
+            if not self.backend.exists(key):
+                self.logger.debug("Uploading {f} as {k}".format(f=filename, k=key))
+                fh.seek(0)
+                self.backend.put(key, fh, size, content_type)
+            with self.lock:
+                self.uploaded.add(key)
+            return self.backend.url(key)
+        finally:
+            if fh is not source:
+                fh.close()
+
+    def wait(self):
+        """ wait for all queued uploads (and their callbacks) to finish """
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
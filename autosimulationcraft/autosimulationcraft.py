@@ -20,7 +20,6 @@ Requirements
 -------------
 
 * battlenet>=0.2.6
-* dictdiffer>=0.3.0
 
 You can install these like:
 
@@ -38,7 +37,8 @@ By default, this uses SimulationCraft's default settings for your character
 or GUI interfaces). If you need further customization.... TBD.
 
 The simc file used for each character, as well as the final output, will be
-cached on disk.
+cached on disk. The DPS results of every run are kept in an sqlite database,
+`results.db` (reading simc's JSON report is faster with `ijson` installed).
 
 If simc isn't installed at /usr/bin/simc on your system, set the path in the
 configuration file.
@@ -64,25 +64,49 @@ import os
 import logging
 import subprocess
 import datetime
+import hashlib
+import threading
+import heapq
+import sqlite3
+import tempfile
+import shutil
+import errno
 from textwrap import dedent
-from copy import deepcopy
+from StringIO import StringIO
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 import platform
 import getpass
 import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
 from email.utils import formatdate
 from email.utils import make_msgid
 from email.utils import formataddr
-from dictdiffer import diff
 import battlenet
 
-from config import DEFAULT_CONFDIR
+from config import DEFAULT_CONFDIR, CachedSettings
+from roster import iter_roster, has_email, RosterError
+from regions import REGIONS, DEFAULT_REGION, RegionPool
+from simcprofile import generate_profile, ProfileError
+from record import CharacterRecord
+from chardiff import CharacterDiff, diff_records
+from items import ItemStore
+from httpcache import HTTPCache, CachingConnection
+from results import ResultStore, read_results, PARSE_ERRORS, BASELINE
+from history import DPSHistory
+from digest import Digest, SimReport, summary_table, zip_bundle
+from spool import MailSpool, MailSender
+from mimestream import StreamingMessage, send_message
+from artifacts import ArtifactUploader, ArtifactError, backend_from_settings
+from archive import ReportArchive
+from journal import RunJournal
+from lock import FileLock, Claims, LOCK_POLICIES
+from text import to_bytes, to_text
 
 if sys.version_info[0] > 3 or (sys.version_info[0] == 3 and sys.version_info[1] >= 3):
     import importlib.machinery
@@ -109,6 +133,14 @@ class AutoSimulationCraft:
     ###############################################################
     # path to the simc executable
     SIMC_PATH = '/usr/bin/simc'
+    # by default, simc profiles are generated from the data already fetched
+    # from Battlenet. Set this to 'armory' to have simc do its own armory
+    # import of each character instead.
+    SIMC_PROFILE_SOURCE = 'battlenet'
+    # each simulation runs in its own temporary directory, under this one if
+    # set (i.e. a tmpfs such as /dev/shm); the simc input and reports are then
+    # moved into this directory.
+    # SIMC_WORK_DIR = '/dev/shm'
     # options to be added to every characters' simc configuration
     GLOBAL_OPTIONS = {'threads': 5}
     CHARACTERS = [
@@ -122,18 +154,139 @@ class AutoSimulationCraft:
         'realm': 'realname',
         'name': 'character_name',
         'email': ['you@domain.com', 'someone@domain.com'],
+        'region': 'eu',
+        'priority': 10,
       },
     ]
+    # region ('us', 'eu', 'kr' or 'tw') for characters/guilds that don't
+    # specify one
+    DEFAULT_REGION = 'us'
+    # optional per-region limit on Battlenet API requests per second. Each
+    # region is fetched in parallel with its own limit.
+    # API_RATE_LIMITS = {'us': 10, 'eu': 10}
+    # characters that need a new simulation are run highest-score first.
+    # The score is the sum of each factor times its weight: the character's
+    # 'priority' setting, the number of changes since the last run, days
+    # since it was last simulated, and (subtracted) the average duration
+    # in minutes of its previous simulations.
+    # SIM_PRIORITY_WEIGHTS = {'priority': 100, 'changes': 1, 'age': 1, 'duration': 1}
+    # characters can also (or instead) be read from data files, one
+    # character per row/entry with the same keys as above. Supported
+    # formats are .csv (multiple emails separated by ';', simc options in
+    # 'options.<name>' columns), .jsonl, .json and .yaml (needs PyYAML).
+    # CHARACTER_FILES = ['roster.csv']
+    # characters can also be discovered from guild rosters on each run.
+    # 'min_level' and 'ranks' (guild rank numbers, 0 is guild master) are
+    # optional filters. 'email' (required) and 'options' apply to every member
+    # found.
+    # Characters also listed in CHARACTERS use their CHARACTERS entry.
+    # GUILDS = [
+    #   {
+    #     'realm': 'realmname',
+    #     'name': 'guild name',
+    #     'email': 'officers@domain.com',
+    #     'min_level': 100,
+    #     'ranks': [0, 1, 2],
+    #   },
+    # ]
     # set these to strings to send email via GMail; otherwise
     # email will be sent via local SMTP.
     # It's highly recommended that you set an application-specific
     # password for this.
     GMAIL_USERNAME = None
     GMAIL_PASSWORD = None
+    # set to True to send each recipient a single email at the end of a run,
+    # with a summary of all of their characters' reports, instead of one
+    # email per character.
+    EMAIL_DIGEST = False
+    # with EMAIL_DIGEST, set to 'zip' to attach the reports as a single
+    # compressed zip file instead of separately
+    # EMAIL_DIGEST_BUNDLE = 'zip'
+    # emails are written to mail_spool/ and sent in the background, retrying
+    # failures after MAIL_RETRY_DELAY seconds (doubling each time) up to
+    # MAIL_MAX_ATTEMPTS times; at the end of a run, failed emails are retried
+    # for up to MAIL_SPOOL_WAIT seconds, then left for the next run. Set
+    # MAIL_SPOOL to False to send each email immediately instead.
+    # MAIL_SPOOL = True
+    # MAIL_RETRY_DELAY = 60
+    # MAIL_MAX_ATTEMPTS = 5
+    # MAIL_SPOOL_WAIT = 300
+    # what to do if another run (i.e. from cron) is still in progress: 'skip'
+    # this run, 'wait' for the other one to finish, or 'takeover' the
+    # characters the other run hasn't started simulating yet (emails are then
+    # sent directly, not spooled). Overridden by --lock-policy.
+    # LOCK_POLICY = 'skip'
+    # set this to upload each HTML report and simc output, and email links
+    # to them instead of attaching them. Either a directory (i.e. one served
+    # by a web server at 'base_url'):
+    # ARTIFACT_BACKEND = {'type': 'directory', 'path': '/var/www/simc',
+    #                     'base_url': 'https://example.com/simc'}
+    # or an S3-compatible object storage bucket ('base_url' defaults to
+    # <endpoint>/<bucket>; objects must be readable there):
+    # ARTIFACT_BACKEND = {'type': 's3', 'endpoint': 'https://s3.amazonaws.com',
+    #                     'bucket': 'my-bucket', 'region': 'us-east-1',
+    #                     'access_key': 'AKIA...', 'secret_key': '...'}
+    # the validated settings are cached in settings.pkl next to this file,
+    # and re-used until this file changes. Set this to False if this file
+    # computes its values from something other than its own contents.
+    CACHE_SETTINGS = True
+    # maximum number of items whose names/icons are kept in items.pkl (the
+    # least recently used are dropped first)
+    # ITEM_CACHE_SIZE = 10000
+    # how long (in seconds) each part of a character's data is re-used from
+    # the cache before being fetched again; 0 fetches it on every run. Name,
+    # level, class and race are always fetched. The defaults are:
+    # SUBRESOURCE_TTLS = {'appearance': 604800, 'items': 0, 'professions': 86400,
+    #                     'stats': 0, 'talents': 0}
+    # the simc input, reports and output of the last REPORT_ARCHIVE_KEEP runs
+    # of each character are kept (compressed, with identical files stored
+    # once) in archive/, which is limited to REPORT_ARCHIVE_MAX_SIZE bytes
+    # by removing the least recently used. Set REPORT_ARCHIVE_KEEP to 0 to
+    # disable it.
+    # REPORT_ARCHIVE_KEEP = 10
+    # REPORT_ARCHIVE_MAX_SIZE = 524288000
+    # API responses are cached in http_cache/ and re-validated with
+    # conditional requests; this is the maximum number kept (0 to disable).
+    # HTTP_CACHE_SIZE = 5000
     """
 
-    def __init__(self, confdir=DEFAULT_CONFDIR, logger=None, dry_run=False, verbose=0):
-        """ init method, run at class creation """
+    # bump this when the format of the cached (normalized) settings changes;
+    # 2: character names/realms are UTF-8 str, regions lower-case, and
+    # rows from CHARACTER_FILES are included
+    SETTINGS_CACHE_FORMAT = 2
+
+    # default weights for sim_priority(); overridden by SIM_PRIORITY_WEIGHTS
+    PRIORITY_WEIGHTS = {'priority': 100.0, 'changes': 1.0, 'age': 1.0, 'duration': 1.0}
+
+    # age (in days) used for sim_priority() of never-simulated characters
+    NEVER_SIMULATED_AGE = 30.0
+
+    # number of past simc durations kept per character
+    SIM_HISTORY_LENGTH = 5
+
+    # default maximum number of API responses kept in the HTTP cache
+    HTTP_CACHE_SIZE = 5000
+
+    # optional character API fields requested by get_battlenet()
+    CHARACTER_FIELDS = ['appearance', 'items', 'professions', 'stats', 'talents']
+
+    # default seconds each of CHARACTER_FIELDS is re-used from the cache
+    # before being fetched again; overridden by SUBRESOURCE_TTLS
+    SUBRESOURCE_TTLS = {'appearance': 7 * 86400, 'items': 0, 'professions': 86400,
+                        'stats': 0, 'talents': 0}
+
+    def __init__(self, confdir=DEFAULT_CONFDIR, logger=None, dry_run=False, verbose=0,
+                 offline=False, transport=None, lock_policy=None):
+        """
+        init method, run at class creation
+
+        If ``offline`` is True, no Battlenet API connection is made, and
+        :py:meth:`run` re-simulates characters from the cache. If
+        ``transport`` is given (i.e. a :py:class:`~.replay.Recorder` or
+        :py:class:`~.replay.ReplayTransport`), all API requests are sent
+        through it, bypassing the HTTP cache. ``lock_policy`` (one of
+        :py:data:`~.lock.LOCK_POLICIES`) overrides the LOCK_POLICY setting.
+        """
         # setup a logger; allow an existing one to be passed in to use
         self.logger = logger
         if logger is None:
@@ -143,25 +296,211 @@ class AutoSimulationCraft:
         elif verbose > 0:
             self.logger.setLevel(logging.INFO)
         self.dry_run = dry_run
+        self.offline = offline
+        self.transport = transport
+        self.lock_policy = lock_policy
+        self.run_lock = None
+        # True if running alongside another run; see lock_run()
+        self.takeover = False
+        self.claims = Claims(os.path.join(os.path.abspath(os.path.expanduser(confdir)), 'claims'))
         self.confdir = os.path.abspath(os.path.expanduser(confdir))
+        # extra files (besides settings.py) that the settings were read from
+        self.config_sources = []
         self.read_config(confdir)
-        self.logger.debug("connecting to BattleNet API")
-        self.bnet = battlenet.Connection()
-        self.logger.debug("connected")
+        self.http_cache = None
+        self.results = None
+        self.history = None
+        self.archive = None
+        # parsed results of this run's simulations, by character
+        self.sim_results = {}
+        self.digest = Digest()
+        self.spool = None
+        self.mail_sender = None
+        # the spool and sender are also used from the upload threads
+        self.mail_lock = threading.Lock()
+        self.uploader = None
+        # the journal of the current run; see resume_run()
+        self.journal = None
+        # fetched data of characters being simulated, cached once their
+        # reports have been sent (see cache_character())
+        self.pending_cache = {}
+        self.cache_lock = threading.Lock()
+        # characters whose cache entries / sim history were changed by this
+        # run, and the (mtime, size) of characters.pkl when last read
+        self.cache_updated = set()
+        self.cache_stamp = None
+        self.history_updated = set()
+        if offline:
+            self.logger.debug("offline mode; not connecting to BattleNet API")
+            self.bnet = None
+        else:
+            self.logger.debug("connecting to BattleNet API")
+            self.bnet = self.new_connection()
+            self.logger.debug("connected")
+        self.region_pools = {}
+        self.region_pools_lock = threading.Lock()
         self.logger.debug("loading character cache")
         self.character_cache = self.load_character_cache()
+        self.item_store = self.load_item_store()
+        self.sim_history = self.load_sim_history()
 
     def load_character_cache(self):
         pklpath = os.path.join(self.confdir, 'characters.pkl')
         if not os.path.exists(pklpath):
             return {}
+        self.cache_stamp = self.file_stamp(pklpath)
         data = pickle.load(open(pklpath, 'rb'))
+        for k in data:
+            # caches written by older versions hold the full battlenet dict
+            if isinstance(data[k], dict):
+                data[k] = CharacterRecord.from_bnet(data[k])
         return data
 
     def write_character_cache(self):
+        """
+        Write the character cache; the entries changed by this run are merged
+        into the current file, in case another run has changed it too.
+        """
         pklpath = os.path.join(self.confdir, 'characters.pkl')
-        with open(pklpath, 'wb') as fh:
-            pickle.dump(self.character_cache, fh)
+        with FileLock(pklpath + '.lock'):
+            data = self.load_character_cache()
+            self.merge_updated(data, self.character_cache, self.cache_updated)
+            tmppath = pklpath + '.tmp'
+            with open(tmppath, 'wb') as fh:
+                pickle.dump(data, fh, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmppath, pklpath)
+            self.cache_stamp = self.file_stamp(pklpath)
+        self.character_cache = data
+
+    def cache_character(self, c_name):
+        """
+        Save the data fetched for ``c_name`` in this run to the character
+        cache, so that it is only simulated again when it changes.
+        """
+        if self.cache_characters([c_name]):
+            self.journal_stage(c_name, 'cached')
+
+    def cache_characters(self, c_names):
+        """
+        Save the data fetched for all of ``c_names`` in this run to the
+        character cache, with a single write; for the (possibly many)
+        characters without changes, which aren't in the run journal.
+
+        :returns: whether any of the characters had data to save
+        :rtype: bool
+        """
+        with self.cache_lock:
+            found = False
+            for c_name in c_names:
+                bnet_info = self.pending_cache.pop(c_name, None)
+                if bnet_info is None:
+                    continue
+                self.character_cache[c_name] = bnet_info
+                self.cache_updated.add(c_name)
+                found = True
+            if found:
+                self.write_character_cache()
+        return found
+
+    def report_sent(self, c_name):
+        """
+        Record that the reports for ``c_name`` have been sent (or spooled),
+        and cache its data.
+        """
+        self.journal_stage(c_name, 'mailed')
+        self.cache_character(c_name)
+
+    def journal_stage(self, c_name, stage, data=None):
+        """ record a completed stage in the run journal, if there is one """
+        if self.journal is not None:
+            self.journal.record(c_name, stage, data)
+
+    def resume_run(self):
+        """
+        Open the run journal, and finish the work left by an interrupted run:
+        send the reports of characters that were simulated but whose reports
+        weren't sent, and cache the characters whose reports were. Runs taking
+        over from another run (see :py:meth:`lock_run`) don't keep a journal.
+        """
+        if self.takeover:
+            return
+        self.journal = RunJournal(os.path.join(self.confdir, 'journal.pkl'))
+        unfinished = self.journal.unfinished()
+        if len(unfinished) == 0:
+            return
+        self.logger.info("Resuming {n} characters from an interrupted run".format(
+            n=len(unfinished)))
+        for c_name, (stages, data) in unfinished.items():
+            if data['bnet'] is not None:
+                self.pending_cache[c_name] = data['bnet']
+            if 'mailed' in stages:
+                self.cache_character(c_name)
+                continue
+            if not os.path.exists(data['html_path']):
+                self.logger.warning("Report {p} for {c} no longer exists; not resending "
+                                    "it".format(p=data['html_path'], c=c_name))
+                self.pending_cache.pop(c_name, None)
+                continue
+            self.logger.info("Sending the unsent reports for {c}".format(c=c_name))
+            diff = CharacterDiff.note("Re-sent report from an interrupted run.")
+            if data['changes'] is not None:
+                diff = CharacterDiff(data['changes'], item_name=self.item_name)
+            self.send_char_email(c_name, data['c_settings'], diff, data['html_path'],
+                                 data['duration'], data['output'])
+        self.finish_uploads()
+
+    def finish_run(self):
+        """ remove the run journal at the end of a complete run """
+        if self.journal is None:
+            return
+        self.journal.clear()
+        self.journal = None
+
+    def load_item_store(self):
+        """
+        Load the item metadata store (item names etc., shared by all
+        characters), limited to ``ITEM_CACHE_SIZE`` items.
+
+        :rtype: items.ItemStore
+        """
+        store = ItemStore(os.path.join(self.confdir, 'items.pkl'),
+                          max_size=getattr(self.settings, 'ITEM_CACHE_SIZE', ItemStore.DEFAULT_SIZE))
+        store.load()
+        return store
+
+    def load_sim_history(self):
+        """
+        Load the simulation history; a dict of character name@realm to a dict
+        with 'last_run' (datetime) and 'durations' (list of seconds).
+        """
+        pklpath = os.path.join(self.confdir, 'sim_history.pkl')
+        if not os.path.exists(pklpath):
+            return {}
+        with open(pklpath, 'rb') as fh:
+            return pickle.load(fh)
+
+    def merge_updated(self, data, ours, updated):
+        """ apply the (updated or removed) ``updated`` keys of dict ``ours`` to ``data`` """
+        for k in updated:
+            if k in ours:
+                data[k] = ours[k]
+            else:
+                data.pop(k, None)
+
+    def write_sim_history(self):
+        """
+        Write the simulation history; the characters simulated by this run are
+        merged into the current file, in case another run has changed it too.
+        """
+        pklpath = os.path.join(self.confdir, 'sim_history.pkl')
+        with FileLock(pklpath + '.lock'):
+            data = self.load_sim_history()
+            self.merge_updated(data, self.sim_history, self.history_updated)
+            tmppath = pklpath + '.tmp'
+            with open(tmppath, 'wb') as fh:
+                pickle.dump(data, fh, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmppath, pklpath)
+        self.sim_history = data
 
     def read_config(self, confdir):
         """ read in config file """
@@ -171,26 +510,237 @@ class AutoSimulationCraft:
             self.logger.error("ERROR - configuration file does not exist. "
                               "Please run with --genconfig to generate an example one.")
             raise SystemExit(1)
-        self.import_from_path(confpath)
-        self.validate_config()
+        cachepath = os.path.join(os.path.dirname(confpath), 'settings.pkl')
+        cache_key = self.settings_cache_key(confpath)
+        cached = self.load_settings_cache(cachepath, cache_key)
+        if cached is not None:
+            self.settings = cached
+        else:
+            self.import_from_path(confpath)
+            self.validate_config()
+            self.normalize_config()
+            if getattr(self.settings, 'CACHE_SETTINGS', True):
+                self.write_settings_cache(cachepath, cache_key)
         self.logger.debug("Imported settings for {n} characters".format(
             n=len(self.settings.CHARACTERS))
         )
 
+    def settings_cache_key(self, confpath):
+        """
+        Return the key identifying the current contents of the settings file
+        (and the version of this program that normalized them); the settings
+        cache is only used if its key matches this.
+
+        :param confpath: absolute path to settings.py
+        :type confpath: string
+        :rtype: tuple
+        """
+        with open(confpath, 'rb') as fh:
+            digest = hashlib.sha1(fh.read()).hexdigest()
+        return (self.SETTINGS_CACHE_FORMAT, self.VERSION, digest)
+
+    def load_settings_cache(self, cachepath, cache_key):
+        """
+        Load validated, normalized settings from the settings cache.
+
+        Returns None if there is no cache, it can't be read, or it was written
+        for a different version of settings.py (i.e. ``cache_key`` differs).
+
+        :param cachepath: path to the settings cache file
+        :type cachepath: string
+        :param cache_key: current key from :py:meth:`settings_cache_key`
+        :type cache_key: tuple
+        :rtype: :py:class:`config.CachedSettings` or None
+        """
+        if not os.path.exists(cachepath):
+            self.logger.debug("no settings cache at {p}".format(p=cachepath))
+            return None
+        try:
+            with open(cachepath, 'rb') as fh:
+                data = pickle.load(fh)
+        except Exception:
+            self.logger.warning("Unable to read settings cache {p}; "
+                                "re-importing settings".format(p=cachepath))
+            return None
+        if not isinstance(data, dict) or data.get('key') != cache_key:
+            self.logger.debug("settings file changed since cache was written")
+            return None
+        for path, stamp in data.get('sources', {}).items():
+            if self.file_stamp(path) != stamp:
+                self.logger.debug("{p} changed since settings cache was written".format(p=path))
+                return None
+        self.logger.debug("loaded settings from cache {p}".format(p=cachepath))
+        return CachedSettings(data['settings'])
+
+    def file_stamp(self, path):
+        """
+        Return the (mtime, size) of a file that settings were read from, or
+        None if it doesn't exist; used to tell if the settings cache is stale.
+
+        :param path: file path
+        :type path: string
+        :rtype: tuple or None
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def write_settings_cache(self, cachepath, cache_key):
+        """
+        Write the (validated and normalized) settings to the settings cache.
+
+        Only upper-case module attributes are cached, along with the stamps of
+        any data files characters were read from. If they can't be
+        pickled, the cache is not written and settings.py will simply be
+        imported again next time.
+
+        :param cachepath: path to the settings cache file
+        :type cachepath: string
+        :param cache_key: key from :py:meth:`settings_cache_key`
+        :type cache_key: tuple
+        """
+        values = {}
+        for name in dir(self.settings):
+            if name.startswith('_') or not name.isupper():
+                continue
+            values[name] = getattr(self.settings, name)
+        try:
+            data = pickle.dumps({'key': cache_key,
+                                 'settings': values,
+                                 'sources': dict((p, self.file_stamp(p)) for p in self.config_sources)},
+                                pickle.HIGHEST_PROTOCOL)
+        except Exception as ex:
+            self.logger.info("Not caching settings; unable to pickle them: {e}".format(e=ex))
+            return
+        tmppath = cachepath + '.tmp'
+        with open(tmppath, 'wb') as fh:
+            fh.write(data)
+        # the settings may contain credentials
+        os.chmod(tmppath, 0o600)
+        os.rename(tmppath, cachepath)
+        self.logger.debug("wrote settings cache to {p}".format(p=cachepath))
+
     def validate_config(self):
         # validate config
+        has_files = hasattr(self.settings, 'CHARACTER_FILES')
+        has_guilds = len(getattr(self.settings, 'GUILDS', [])) > 0
         if not hasattr(self.settings, 'CHARACTERS'):
-            self.logger.error("ERROR: Settings file must define CHARACTERS list")
-            raise SystemExit(1)
+            if not has_files and not has_guilds:
+                self.logger.error("ERROR: Settings file must define CHARACTERS list")
+                raise SystemExit(1)
+            self.settings.CHARACTERS = []
         if not isinstance(self.settings.CHARACTERS, list):
             self.logger.error("ERROR: Settings file must define CHARACTERS list")
             raise SystemExit(1)
-        if len(self.settings.CHARACTERS) < 1:
+        if has_files:
+            self.settings.CHARACTERS = self.settings.CHARACTERS + self.load_character_files()
+        if len(self.settings.CHARACTERS) < 1 and not has_guilds:
             self.logger.error("ERROR: Settings file must define CHARACTERS"
                               " list with at least one character")
             raise SystemExit(1)
+        for guild in getattr(self.settings, 'GUILDS', []):
+            if not isinstance(guild, dict) or 'realm' not in guild or 'name' not in guild:
+                self.logger.error("ERROR: each GUILDS entry must be a dict with 'realm' and 'name'")
+                raise SystemExit(1)
+            if not has_email(guild):
+                self.logger.error("ERROR: GUILDS entry for guild '{g}' must have an 'email' "
+                                  "to send its members' reports to".format(g=guild['name']))
+                raise SystemExit(1)
+        regions = [getattr(self.settings, 'DEFAULT_REGION', DEFAULT_REGION)]
+        regions.extend(getattr(self.settings, 'API_RATE_LIMITS', {}).keys())
+        regions.extend([g['region'] for g in getattr(self.settings, 'GUILDS', []) if 'region' in g])
+        for region in regions:
+            if not isinstance(region, basestring) or region.lower() not in REGIONS:
+                self.logger.error("ERROR: unknown region '{r}'; must be one of: {a}".format(
+                    r=region, a=', '.join(sorted(REGIONS))))
+                raise SystemExit(1)
+        if getattr(self.settings, 'LOCK_POLICY', 'skip') not in LOCK_POLICIES:
+            self.logger.error("ERROR: LOCK_POLICY must be one of: {p}".format(
+                p=', '.join(LOCK_POLICIES)))
+            raise SystemExit(1)
+        if getattr(self.settings, 'ARTIFACT_BACKEND', None) is not None:
+            try:
+                backend_from_settings(self.settings.ARTIFACT_BACKEND)
+            except ArtifactError as ex:
+                self.logger.error("ERROR: invalid ARTIFACT_BACKEND: {e}".format(e=ex))
+                raise SystemExit(1)
         # end validate config
 
+    def load_character_files(self):
+        """
+        Read characters from every file in ``settings.CHARACTER_FILES``
+        (relative paths are relative to the configuration directory).
+
+        Files are read in a single streaming pass; each row is checked with
+        :py:meth:`validate_character` and must have an email address; invalid
+        rows are logged (with their row number) and skipped.
+        A file that can't be read at all is a fatal configuration error.
+
+        :rtype: list of character dicts
+        """
+        fnames = self.settings.CHARACTER_FILES
+        if not isinstance(fnames, list):
+            fnames = [fnames]
+        chars = []
+        for fname in fnames:
+            path = os.path.join(self.confdir, os.path.expanduser(fname))
+            self.config_sources.append(path)
+            count = 0
+            try:
+                for rownum, row, err in iter_roster(path):
+                    if err is None and not self.validate_character(row):
+                        err = "character must be a dict with 'realm' and 'name'"
+                    elif err is None and not has_email(row):
+                        err = "missing or empty 'email'"
+                    if err is not None:
+                        self.logger.warning("Skipping invalid character in {p} row {n}: "
+                                            "{e}".format(p=path, n=rownum, e=err))
+                        continue
+                    # JSON and YAML give unicode; names are str everywhere
+                    row['name'] = to_bytes(row['name'])
+                    row['realm'] = to_bytes(row['realm'])
+                    chars.append(row)
+                    count += 1
+            except (IOError, RosterError) as ex:
+                self.logger.error("ERROR: unable to read character file {p}: {e}".format(p=path, e=ex))
+                raise SystemExit(1)
+            self.logger.debug("Read {n} characters from {p}".format(n=count, p=path))
+        return chars
+
+    def normalize_config(self):
+        """
+        Normalize the imported settings, so that everything downstream (and
+        the settings cache) sees one consistent form. Currently this makes
+        each character's (and guild's) ``email`` a list, its ``name`` and
+        ``realm`` UTF-8 str, and sets its ``region`` (lower-case, defaulting
+        to ``DEFAULT_REGION``). Regions are accepted in any case, so
+        ``DEFAULT_REGION`` and the ``API_RATE_LIMITS`` keys are made lower-case
+        too.
+        """
+        default_region = getattr(self.settings, 'DEFAULT_REGION', DEFAULT_REGION).lower()
+        if hasattr(self.settings, 'DEFAULT_REGION'):
+            self.settings.DEFAULT_REGION = default_region
+        if hasattr(self.settings, 'API_RATE_LIMITS'):
+            self.settings.API_RATE_LIMITS = dict(
+                (k.lower(), v) for k, v in self.settings.API_RATE_LIMITS.items())
+        for char in self.settings.CHARACTERS + list(getattr(self.settings, 'GUILDS', [])):
+            if not isinstance(char, dict):
+                continue
+            char['region'] = char.get('region', default_region).lower()
+            for k in ['name', 'realm']:
+                if k in char:
+                    char[k] = to_bytes(char[k])
+            if 'email' not in char:
+                continue
+            emails = char['email']
+            if isinstance(emails, tuple):
+                emails = list(emails)
+            elif not isinstance(emails, list):
+                emails = [emails]
+            char['email'] = emails
+
     def import_from_path(self, confpath):
         """ import a module from a given filesystem path """
         if sys.version_info[0] > 3 or (sys.version_info[0] == 3 and sys.version_info[1] >= 3):
@@ -223,111 +773,605 @@ class AutoSimulationCraft:
         if 'name' not in char:
             self.logger.debug("'name' not in char dict")
             return False
+        if not isinstance(char['name'], basestring) or not isinstance(char['realm'], basestring):
+            self.logger.debug("'name' or 'realm' in char dict is not a string")
+            return False
+        region = char.get('region', DEFAULT_REGION)
+        if not isinstance(region, basestring) or region.lower() not in REGIONS:
+            self.logger.debug("unknown region in char dict")
+            return False
+        try:
+            float(char.get('priority', 0))
+        except (TypeError, ValueError):
+            self.logger.debug("'priority' in char dict is not a number")
+            return False
         return True
 
-    def run(self, no_stat=False):
-        """ do stuff here """
-        for char in self.settings.CHARACTERS:
-            cname = self.make_character_name(char['name'], char['realm'])
-            self.logger.debug("Doing character: {c}".format(c=cname))
+    def run(self, no_stat=False, only=None):
+        """
+        Fetch all characters, and simulate the ones that changed (or, in
+        offline mode, re-simulate them from the cache; see :py:meth:`run_offline`).
+        Only one run at a time uses the configuration directory; see
+        :py:meth:`lock_run`.
+
+        :param no_stat: ignore overall stats when determining if character changed
+        :type no_stat: Boolean
+        :param only: if not None, only run the characters with these name@realm
+          names (realm without spaces)
+        :type only: list
+        """
+        if not self.lock_run():
+            return
+        try:
+            self.run_characters(no_stat=no_stat, only=only)
+        finally:
+            self.unlock_run()
+
+    def run_characters(self, no_stat=False, only=None):
+        """ the body of :py:meth:`run`, once the configuration directory is locked """
+        self.resume_mail()
+        self.resume_run()
+        chars = []
+        to_run = self.characters_to_run()
+        self.migrate_character_keys(to_run)
+        for char in to_run:
+            cname = self.character_name(char)
+            if only is not None and cname not in only:
+                continue
             if not self.validate_character(char):
                 self.logger.warning("Character configuration not valid,"
                                     " skipping: {c}".format(c=cname))
                 continue
-            bnet_info = self.get_battlenet(char['realm'], char['name'])
+            chars.append(char)
+        if self.offline:
+            self.run_offline(chars)
+            return
+        pending = []
+        unchanged = []
+        for char, bnet_info in self.fetch_characters(chars):
+            cname = self.character_name(char)
+            self.logger.debug("Doing character: {c}".format(c=cname))
             if bnet_info is None:
                 self.logger.warning("Character {c} not found on"
                                     " battlenet; skipping.".format(c=cname))
                 continue
             changes = self.character_has_changes(cname, bnet_info, no_stat=no_stat)
             if changes is not None:
-                self.do_character(cname, char, changes)
-            else:
-                self.logger.info("Character {c} has no changes, skipping.".format(c=cname))
-            self.character_cache[cname] = bnet_info
-            self.write_character_cache()
+                # heapq is a min-heap; len(pending) keeps ties in config order
+                heapq.heappush(pending, (-1 * self.sim_priority(cname, char, changes),
+                                         len(pending),
+                                         cname, char, changes, bnet_info))
+                continue
+            self.logger.info("Character {c} has no changes, skipping.".format(c=cname))
+            self.pending_cache[cname] = bnet_info
+            unchanged.append(cname)
+        self.cache_characters(unchanged)
+        self.item_store.save()
+        self.logger.info("Running simulations for {n} changed characters".format(n=len(pending)))
+        while len(pending) > 0:
+            score, _, cname, char, changes, bnet_info = heapq.heappop(pending)
+            if not self.claim_character(cname):
+                continue
+            self.logger.debug("Simulating {c} (priority {p})".format(c=cname, p=(-1 * score)))
+            self.pending_cache[cname] = bnet_info
+            if not self.do_character(cname, char, changes, bnet_info):
+                # nothing to send
+                self.cache_character(cname)
+            self.write_sim_history()
+        self.item_store.save()
+        self.finish_uploads()
+        self.send_digests()
+        self.finish_mail()
+        self.finish_run()
         self.logger.info("Done with all characters.")
 
-    def make_character_name(self, name, realm):
-        realm = realm.replace(' ', '')
-        return '{n}@{r}'.format(n=name, r=realm)
+    def lock_run(self):
+        """
+        Lock the configuration directory for this run. If another run holds
+        the lock, follow the lock policy (the ``lock_policy`` argument, or
+        LOCK_POLICY): 'skip' this run, 'wait' for the lock, or 'takeover'
+        (run without the lock, only simulating the characters that the other
+        run hasn't claimed; see :py:meth:`claim_character`).
+
+        :returns: whether to go ahead with the run
+        :rtype: bool
+        """
+        policy = self.lock_policy
+        if policy is None:
+            policy = getattr(self.settings, 'LOCK_POLICY', 'skip')
+        lock = FileLock(os.path.join(self.confdir, 'autosimc.lock'))
+        if lock.acquire(blocking=False):
+            self.run_lock = lock
+            return True
+        if policy == 'skip':
+            self.logger.warning("Another run is in progress (lock {p} is held); "
+                                "skipping this run.".format(p=lock.path))
+            return False
+        if policy == 'wait':
+            self.logger.warning("Another run is in progress; waiting for it to finish.")
+            lock.acquire()
+            self.run_lock = lock
+            return True
+        self.logger.warning("Another run is in progress; only simulating the characters "
+                            "it hasn't started.")
+        self.takeover = True
+        return True
+
+    def unlock_run(self):
+        """ release the configuration directory lock and character claims """
+        self.claims.release_all()
+        if self.run_lock is not None:
+            self.run_lock.release()
+            self.run_lock = None
 
-    def fix_char_for_diff(self, char_dict, no_stat=False):
+    def claim_character(self, c_name):
         """
-        Remove unimportant items for a character dict prior to diffing.
+        Claim a character for this run before simulating it, so that a
+        concurrent run (see :py:meth:`lock_run`) won't also simulate it.
+        Claims are held until the end of the run.
 
-        Given a charactert dict, remove any portions that we don't want
-        used in the diff for determining if a character changed or not.
+        :returns: False if another run has claimed, or already simulated,
+          the character
+        :rtype: bool
+        """
+        if not self.claims.claim(c_name):
+            self.logger.info("Character {c} is being simulated by another run; "
+                             "skipping.".format(c=c_name))
+            self.pending_cache.pop(c_name, None)
+            return False
+        pklpath = os.path.join(self.confdir, 'characters.pkl')
+        if self.file_stamp(pklpath) == self.cache_stamp:
+            return True
+        # another run has updated the cache since it was read
+        with self.cache_lock:
+            data = self.load_character_cache()
+            self.merge_updated(data, self.character_cache, self.cache_updated)
+            changed = data.get(c_name, None) != self.character_cache.get(c_name, None)
+            self.character_cache = data
+        if changed:
+            self.logger.info("Character {c} was simulated by another run; "
+                             "skipping.".format(c=c_name))
+            self.pending_cache.pop(c_name, None)
+            return False
+        return True
 
-        :param char_dict: character dict
-        :type char_dict: dict
-        :param no_stat: ignore overall stats when determining if character changed
-        :type no_stat: Boolean
+    def run_offline(self, chars):
+        """
+        Re-simulate characters from their cached records, with generated simc
+        profiles, without using the Battlenet API. Characters that aren't in
+        the cache, or whose profile can't be generated, are skipped.
+
+        :param chars: character dicts to simulate
+        :type chars: list
+        """
+        note = CharacterDiff.note("Re-simulation of cached character data (offline mode).")
+        for char in chars:
+            cname = self.character_name(char)
+            rec = self.character_cache.get(cname, None)
+            if rec is None:
+                self.logger.warning("Character {c} is not in the cache; skipping.".format(c=cname))
+                continue
+            try:
+                generate_profile(rec, char.get('region', DEFAULT_REGION))
+            except ProfileError as ex:
+                self.logger.warning("Unable to generate simc profile for {c} ({e}); "
+                                    "skipping.".format(c=cname, e=ex))
+                continue
+            if not self.claim_character(cname):
+                continue
+            self.logger.debug("Simulating {c} from cache".format(c=cname))
+            self.do_character(cname, char, note, rec)
+            self.write_sim_history()
+        self.finish_uploads()
+        self.send_digests()
+        self.finish_mail()
+        self.finish_run()
+        self.logger.info("Done with all characters.")
+
+    def sim_priority(self, c_name, c_settings, c_diff):
+        """
+        Return the priority score for simulating a changed character; higher
+        scores are simulated first. See SIM_PRIORITY_WEIGHTS in the sample
+        configuration for the factors.
+
+        :param c_name: character name in name@realm format
+        :type c_name: string
+        :param c_settings: the dict for this character from settings.py
+        :type c_settings: dict
+        :param c_diff: the character changes
+        :type c_diff: chardiff.CharacterDiff
+        :rtype: float
+        """
+        weights = dict(self.PRIORITY_WEIGHTS)
+        weights.update(getattr(self.settings, 'SIM_PRIORITY_WEIGHTS', {}))
+        score = weights['priority'] * float(c_settings.get('priority', 0))
+        score += weights['changes'] * len(c_diff)
+        hist = self.sim_history.get(c_name)
+        if hist is None:
+            score += weights['age'] * self.NEVER_SIMULATED_AGE
+            return score
+        age = self.now() - hist['last_run']
+        score += weights['age'] * (age.total_seconds() / 86400.0)
+        if len(hist['durations']) > 0:
+            avg = sum(hist['durations']) / float(len(hist['durations']))
+            score -= weights['duration'] * (avg / 60.0)
+        return score
+
+    def record_sim(self, c_name, start, duration):
+        """
+        Record a completed simulation in the sim history.
+
+        :param c_name: character name in name@realm format
+        :type c_name: string
+        :param start: when the simulation started
+        :type start: datetime.datetime
+        :param duration: duration of simc run
+        :type duration: datetime.timedelta
+        """
+        self.history_updated.add(c_name)
+        hist = self.sim_history.setdefault(c_name, {'durations': []})
+        hist['last_run'] = start
+        hist['durations'] = (hist['durations'] + [duration.total_seconds()])[
+            -1 * self.SIM_HISTORY_LENGTH:]
+
+    def fetch_characters(self, chars):
+        """
+        Fetch Battlenet information for each (valid) character dict, yielding
+        ``(char, bnet_info)`` tuples; ``bnet_info`` is None for characters
+        that weren't found.
+
+        If the characters are all in one region they're fetched in order, in
+        this thread. Otherwise each region is fetched by its own thread (with
+        its own connection and rate limit), and results are yielded in the
+        order they arrive, so a slow region doesn't hold up the others.
+
+        :param chars: list of character dicts
+        :type chars: list
+        """
+        by_region = {}
+        for char in chars:
+            by_region.setdefault(char.get('region', DEFAULT_REGION), []).append(char)
+        if len(by_region) < 2:
+            for char in chars:
+                yield (char, self.get_battlenet(char['realm'], char['name'],
+                                                region=char.get('region', DEFAULT_REGION)))
+            return
+        # bounded, so fetching can't get too far ahead of simulating
+        results = queue.Queue(maxsize=10 * len(by_region))
+        for region in sorted(by_region):
+            t = threading.Thread(target=self._fetch_region_thread,
+                                 args=(region, by_region[region], results),
+                                 name='fetch-{r}'.format(r=region))
+            t.daemon = True
+            t.start()
+        running = len(by_region)
+        while running > 0:
+            item = results.get()
+            if item is None:
+                running -= 1
+                continue
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def _fetch_region_thread(self, region, chars, results):
+        """
+        Thread target for :py:meth:`fetch_characters`; fetch each character in
+        ``chars`` (all in ``region``) and put ``(char, bnet_info)`` on the
+        ``results`` queue, then None when done. An unexpected exception is
+        logged and put on the queue, ending this region's fetches.
+        """
+        try:
+            for char in chars:
+                results.put((char, self.get_battlenet(char['realm'], char['name'], region=region)))
+        except Exception as ex:
+            self.logger.exception("Error fetching characters in region {r}".format(r=region))
+            results.put(ex)
+        finally:
+            results.put(None)
+
+    def new_connection(self):
+        """
+        Return a new Battlenet API connection; unless ``HTTP_CACHE_SIZE`` is
+        0, it uses the conditional HTTP cache in ``http_cache/`` (shared by
+        all connections). With a transport, the HTTP cache is not used.
+
+        :rtype: battlenet.Connection
+        """
+        if self.transport is not None:
+            return CachingConnection(transport=self.transport)
+        size = getattr(self.settings, 'HTTP_CACHE_SIZE', self.HTTP_CACHE_SIZE)
+        if size == 0:
+            return battlenet.Connection()
+        if self.http_cache is None:
+            self.http_cache = HTTPCache(os.path.join(self.confdir, 'http_cache'), max_entries=size)
+        return CachingConnection(cache=self.http_cache)
+
+    def region_pool(self, region):
+        """
+        Return the :py:class:`regions.RegionPool` (connection and rate limit)
+        for a region, creating it the first time it's needed. The default
+        region uses ``self.bnet``; other regions get their own connection.
+
+        :param region: region name, i.e. 'us'
+        :type region: string
+        :rtype: regions.RegionPool
+        """
+        with self.region_pools_lock:
+            if region not in self.region_pools:
+                if region == getattr(self.settings, 'DEFAULT_REGION', DEFAULT_REGION):
+                    conn = self.bnet
+                else:
+                    self.logger.debug("connecting to BattleNet API for region {r}".format(r=region))
+                    conn = self.new_connection()
+                limit = getattr(self.settings, 'API_RATE_LIMITS', {}).get(region, None)
+                self.region_pools[region] = RegionPool(region, conn, per_second=limit)
+            return self.region_pools[region]
+
+    def characters_to_run(self):
+        """
+        Return the list of character dicts to process this run: everything
+        in ``settings.CHARACTERS``, followed by members of any ``settings.GUILDS``
+        that aren't already in CHARACTERS. Guild members are looked up with
+        :py:meth:`guild_characters` and saved in ``guild_members.pkl``; in
+        offline mode, the members saved by the last online run are used.
+
+        :rtype: list
+        """
+        chars = list(self.settings.CHARACTERS)
+        if len(getattr(self.settings, 'GUILDS', [])) == 0:
+            return chars
+        members = self.load_guild_members()
+        if self.offline:
+            self.logger.info("Offline mode; using the members of GUILDS found by the last "
+                             "online run")
+        seen = set()
+        for char in chars:
+            if self.validate_character(char):
+                seen.add(self.character_name(char))
+        for guild in self.settings.GUILDS:
+            key = self.guild_key(guild)
+            if self.offline:
+                found = [self.guild_member_character(guild, realm, name)
+                         for realm, name in members.get(key, [])]
+            else:
+                found = self.guild_characters(guild)
+                if found is None:
+                    # lookup failed; keep the members found last time
+                    continue
+                members[key] = [(c['realm'], c['name']) for c in found]
+            for char in found:
+                cname = self.character_name(char)
+                if cname in seen:
+                    continue
+                seen.add(cname)
+                chars.append(char)
+        if not self.offline:
+            self.write_guild_members(members)
+        return chars
+
+    def guild_key(self, guild):
+        """ the (region, realm, name) of a GUILDS entry """
+        return (guild.get('region', DEFAULT_REGION), guild['realm'], guild['name'])
+
+    def load_guild_members(self):
+        """
+        Load the guild members found by the last online run; a dict of
+        :py:meth:`guild_key` to a list of (realm, name) tuples.
+        """
+        pklpath = os.path.join(self.confdir, 'guild_members.pkl')
+        if not os.path.exists(pklpath):
+            return {}
+        with open(pklpath, 'rb') as fh:
+            return pickle.load(fh)
+
+    def write_guild_members(self, members):
+        pklpath = os.path.join(self.confdir, 'guild_members.pkl')
+        tmppath = pklpath + '.tmp'
+        with open(tmppath, 'wb') as fh:
+            pickle.dump(members, fh, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmppath, pklpath)
+
+    def guild_characters(self, guild):
+        """
+        Fetch a guild's member list from the Battlenet API (in one request)
+        and return a character dict for each member matching the guild's
+        ``min_level`` and ``ranks`` filters.
+
+        :param guild: the dict for this guild from settings.GUILDS
+        :type guild: dict
+        :returns: list of character dicts, or None if the guild wasn't found
+        :rtype: list
+        """
+        pool = self.region_pool(guild.get('region', DEFAULT_REGION))
+        pool.throttle()
+        try:
+            data = pool.connection.get_guild(pool.bnet_region,
+                                             guild['realm'],
+                                             guild['name'],
+                                             fields=['members'],
+                                             raw=True)
+        except battlenet.exceptions.APIError:
+            self.logger.error("ERROR - Guild Not Found - "
+                              "realm='{r}' guild='{g}'".format(r=guild['realm'], g=guild['name']))
+            return None
+        min_level = guild.get('min_level', 0)
+        ranks = guild.get('ranks', None)
+        chars = []
+        for member in data.get('members', []):
+            m_char = member['character']
+            if m_char.get('level', 0) < min_level:
+                continue
+            if ranks is not None and member.get('rank') not in ranks:
+                continue
+            chars.append(self.guild_member_character(guild, m_char.get('realm', guild['realm']),
+                                                     m_char['name']))
+        self.logger.info("Found {n} of {t} members of guild {g} to run".format(
+            n=len(chars), t=len(data.get('members', [])), g=guild['name']))
+        return chars
+
+    def guild_member_character(self, guild, realm, name):
+        """
+        Return the character dict for a guild member; the guild's settings
+        (``email``, ``options`` etc.) apply to it.
+
+        :param guild: the dict for this guild from settings.GUILDS
+        :type guild: dict
         :rtype: dict
         """
-        if 'totalHonorableKills' in char_dict:
-            del char_dict['totalHonorableKills']
-        if 'professions' in char_dict:
-            del char_dict['professions']
-        if 'stats' in char_dict and no_stat:
-            del char_dict['stats']
-        return char_dict
+        char = {'realm': to_bytes(realm), 'name': to_bytes(name)}
+        for k in guild:
+            if k not in ['realm', 'name', 'min_level', 'ranks']:
+                char[k] = guild[k]
+        return char
+
+    def make_character_name(self, name, realm, region=DEFAULT_REGION):
+        """
+        Return the name@realm name that identifies a character in the caches,
+        history and report file names; characters outside the default region
+        (``DEFAULT_REGION``, not the setting) are name@realm.region, so that
+        characters with the same name and realm in different regions don't
+        collide.
+
+        :param name: character name
+        :type name: string
+        :param realm: realm name; spaces are removed
+        :type realm: string
+        :param region: region, i.e. 'us'
+        :type region: string
+        :rtype: string
+        """
+        name = to_bytes(name)
+        realm = to_bytes(realm).replace(' ', '')
+        if region.lower() == DEFAULT_REGION:
+            return '{n}@{r}'.format(n=name, r=realm)
+        return '{n}@{r}.{g}'.format(n=name, r=realm, g=region.lower())
+
+    def character_name(self, char):
+        """ :py:meth:`make_character_name` for a character dict """
+        return self.make_character_name(char['name'], char['realm'],
+                                        char.get('region', DEFAULT_REGION))
+
+    def migrate_character_keys(self, chars):
+        """
+        Move the cached data, history and reports of characters outside the
+        default region from their name@realm keys (used before the region
+        was part of the name; see :py:meth:`make_character_name`) to their
+        new name@realm.region keys. A name@realm key that also belongs to a
+        default-region character is left to that character.
+
+        :param chars: character dicts
+        :type chars: list
+        """
+        keys = set()
+        moves = []
+        for char in chars:
+            if not self.validate_character(char):
+                continue
+            old = self.make_character_name(char['name'], char['realm'])
+            new = self.character_name(char)
+            keys.add(new)
+            if old != new:
+                moves.append((old, new))
+        for old, new in moves:
+            if old in keys:
+                continue
+            self.migrate_character_key(old, new)
+
+    def migrate_character_key(self, old, new):
+        """ move everything stored under character name ``old`` to ``new`` """
+        moved = False
+        for store, updated, write in [
+                (self.character_cache, self.cache_updated, self.write_character_cache),
+                (self.sim_history, self.history_updated, self.write_sim_history)]:
+            if old not in store or new in store:
+                continue
+            store[new] = store.pop(old)
+            updated.update([old, new])
+            write()
+            moved = True
+        if os.path.exists(os.path.join(self.confdir, 'results.db')):
+            moved = self.results_store().rename_character(old, new) or moved
+        moved = self.history_store().rename(old, new) or moved
+        if os.path.exists(os.path.join(self.confdir, 'archive', 'index.pkl')):
+            archive = self.report_archive()
+            if archive is not None:
+                moved = archive.rename(old, new) or moved
+        for ext in ['simc', 'html', 'json']:
+            src = os.path.join(self.confdir, '{c}.{e}'.format(c=old, e=ext))
+            dest = os.path.join(self.confdir, '{c}.{e}'.format(c=new, e=ext))
+            if os.path.exists(src) and not os.path.exists(dest):
+                os.rename(src, dest)
+                moved = True
+        if moved:
+            self.logger.info("Moved the data for {o} to {n}".format(o=old, n=new))
 
     def character_has_changes(self, c_name_realm, c_bnet, no_stat=False):
         """
         Test if a chracter has changed since the last run.
 
         If it does not have changes, return None.
-        If it does have changes, return a string human-readable representation
+        If it does have changes, return a :py:class:`~.chardiff.CharacterDiff`
         of those changes.
 
         :param c_name_realm: name@realm character identifier
         :type c_name_realm: string
         :param c_bnet: BattleNet data for this character
-        :type c_bnet: battlenet.things.Character
+        :type c_bnet: record.CharacterRecord
         :param no_stat: ignore overall stats when determining if character changed
         :type no_stat: Boolean
-        :rtype: None or String
+        :rtype: None or chardiff.CharacterDiff
         """
         if c_name_realm not in self.character_cache:
             self.logger.debug("character not in cache: {c}".format(c=c_name_realm))
-            return "Character not in cache (has not been seen before)."
-        c_bnet = self.fix_char_for_diff(c_bnet, no_stat=no_stat)
-        c_old = self.fix_char_for_diff(self.character_cache[c_name_realm], no_stat=no_stat)
-        if c_old == c_bnet:
+            return CharacterDiff.note("Character not in cache (has not been seen before).")
+        changes = diff_records(self.character_cache[c_name_realm], c_bnet,
+                               no_stat=no_stat, item_name=self.item_name)
+        if len(changes) == 0:
             self.logger.debug("character identical in cache"
                               " and battlenet: {c}".format(c=c_name_realm))
             return None
         # else they're different
         self.logger.debug("character has differences between cache"
                           " and battlenet: {c}".format(c=c_name_realm))
-        return self.character_diff(c_old, c_bnet)
+        return changes
 
-    def character_diff(self, old, new):
+    def item_name(self, item_id):
         """
-        Diff two character dicts; return a human-readable representation
+        Return the name of an item, from the item store or (if it isn't
+        there) the Battlenet item API; None if it can't be found.
 
-        :param old: old (cache) character dict
-        :type old: dict
-        :param new: new (battlenet) character dict
-        :type new: dict
-        :rtype: string
+        :param item_id: item id
+        :type item_id: int
+        :rtype: string or None
         """
-        d = diff(old, new)
-        s = ''
-        for x in sorted(list(d)):
-            if x[0] == 'change':
-                s += 'change {item} from {a} to {b}\n'.format(item=x[1],
-                                                              a=x[2][0],
-                                                              b=x[2][1])
-            elif x[0] == 'remove':
-                s += 'remove {a} {b}\n'.format(a=x[1], b=x[2])
-            else:
-                s += 'add {a} {b}\n'.format(a=x[1], b=x[2])
-        s = s.strip()
-        return s
+        info = self.item_store.lookup(item_id, self.fetch_item)
+        if info is None:
+            return None
+        return info.name
+
+    def fetch_item(self, item_id):
+        """
+        Get an item's data from the Battlenet item API, or None on error (or
+        in offline mode, where there's no API connection).
+
+        :param item_id: item id
+        :type item_id: int
+        :rtype: dict or None
+        """
+        if self.offline:
+            self.logger.debug("offline mode; not getting item {i} from battlenet".format(i=item_id))
+            return None
+        pool = self.region_pool(getattr(self.settings, 'DEFAULT_REGION', DEFAULT_REGION))
+        pool.throttle()
+        self.logger.debug("getting item {i} from battlenet".format(i=item_id))
+        try:
+            return pool.connection.make_request(pool.bnet_region, '/item/{i}'.format(i=item_id))
+        except battlenet.exceptions.APIError as ex:
+            self.logger.warning("Unable to get item {i} from battlenet: {e}".format(i=item_id, e=ex))
+            return None
 
-    def do_character(self, c_name, c_settings, c_diff):
+    def do_character(self, c_name, c_settings, c_diff, c_bnet=None):
         """
         Do the actual simc run for this character
 
@@ -335,42 +1379,235 @@ class AutoSimulationCraft:
         :type c_name: string
         :param c_settings: the dict for this character from settings.py
         :type c_settings: dict
-        :param c_diff: the textual diff of character changes that caused this run
-        :type c_diff: string
+        :param c_diff: the character changes that caused this run
+        :type c_diff: chardiff.CharacterDiff
+        :param c_bnet: BattleNet data for this character, to generate the profile from
+        :type c_bnet: record.CharacterRecord
+        :returns: whether the reports were sent (or queued to be)
+        :rtype: bool
         """
         if not os.path.exists(self.settings.SIMC_PATH):
             self.logger.error("ERROR: simc path {p}"
                               " does not exist".format(p=self.settings.SIMC_PATH))
-            return
-        simc_file = os.path.join(self.confdir, '{c}.simc'.format(c=c_name))
-        html_file = os.path.join(self.confdir, '{c}.html'.format(c=c_name))
+            return False
+        # each job runs in its own directory, and only its results are moved
+        # into the configuration directory
+        jobdir = tempfile.mkdtemp(prefix='autosimc-',
+                                  dir=getattr(self.settings, 'SIMC_WORK_DIR', None))
+        try:
+            return self.run_simc(jobdir, c_name, c_settings, c_diff, c_bnet)
+        finally:
+            shutil.rmtree(jobdir, ignore_errors=True)
+
+    def run_simc(self, jobdir, c_name, c_settings, c_diff, c_bnet):
+        """
+        Run simc for this character in ``jobdir``, move its input and reports
+        into the configuration directory, and store and send the results.
+
+        :param jobdir: absolute path to the (empty) working directory for the job
+        :type jobdir: string
+        :returns: whether the reports were sent (or queued to be)
+        :rtype: bool
+        """
+        simc_file = os.path.join(jobdir, '{c}.simc'.format(c=c_name))
+        html_file = os.path.join(jobdir, '{c}.html'.format(c=c_name))
+        json_file = os.path.join(jobdir, '{c}.json'.format(c=c_name))
         with open(simc_file, 'w') as fh:
-            fh.write('"armory=us,{realm},{char}"\n'.format(realm=c_settings['realm'],
-                                                           char=c_settings['name']))
+            fh.write(self.profile_for_char(c_name, c_settings, c_bnet))
             fh.write(self.options_for_char(c_settings))
-            fh.write("html={cn}.html".format(cn=c_name))
-        os.chdir(self.confdir)
+            fh.write("json2={p}\n".format(p=json_file))
+            fh.write("html={p}".format(p=html_file))
         self.logger.debug("Running: {p} {f}".format(p=self.settings.SIMC_PATH, f=simc_file))
         start = self.now()
         try:
             res = subprocess.check_output([self.settings.SIMC_PATH,
                                            simc_file],
-                                          stderr=subprocess.STDOUT)
+                                          stderr=subprocess.STDOUT,
+                                          cwd=jobdir)
         except subprocess.CalledProcessError as er:
             self.logger.error("Error running simc!")
             self.logger.exception(er)
-            return
+            self.store_results(c_name, start, (self.now() - start),
+                               error='simc exited {r}'.format(r=er.returncode))
+            self.archive_reports(c_name, start, {'simc': simc_file, 'log': StringIO(er.output)})
+            return False
         end = self.now()
         if not os.path.exists(html_file):
             self.logger.error("ERROR: simc finished but HTML file not found on disk.")
-            return
-        self.logger.debug("Ran simc, generated {h} in {d}".format(h=html_file, d=(end - start)))
+            return False
+        files = {}
+        for kind, path in [('simc', simc_file), ('html', html_file), ('json', json_file)]:
+            files[kind] = os.path.join(self.confdir, os.path.basename(path))
+            if kind == 'html' or os.path.exists(path):
+                self.move_into_place(path, files[kind])
+        self.logger.debug("Ran simc, generated {h} in {d}".format(h=files['html'],
+                                                                  d=(end - start)))
+        self.record_sim(c_name, start, (end - start))
+        self.store_results(c_name, start, (end - start), json_path=files['json'])
+        self.archive_reports(c_name, start, dict(files, log=StringIO(res)))
+        self.journal_stage(c_name, 'simulated', {
+            'c_settings': c_settings, 'changes': getattr(c_diff, 'changes', None),
+            'html_path': files['html'], 'duration': (end - start), 'output': res,
+            'bnet': self.pending_cache.get(c_name, None)})
         self.send_char_email(c_name,
                              c_settings,
                              c_diff,
-                             html_file,
+                             files['html'],
                              (end - start),
                              res)
+        return True
+
+    def move_into_place(self, src, dest):
+        """
+        Atomically replace ``dest`` with ``src``; if they're on different
+        filesystems (i.e. SIMC_WORK_DIR is a tmpfs), ``src`` is first copied
+        next to ``dest``.
+        """
+        try:
+            os.rename(src, dest)
+            return
+        except OSError as ex:
+            if ex.errno != errno.EXDEV:
+                raise
+        tmppath = dest + '.tmp'
+        shutil.copyfile(src, tmppath)
+        os.rename(tmppath, dest)
+        os.unlink(src)
+
+    def results_store(self):
+        """
+        Return the simulation results database (``results.db``), opening it
+        on first use.
+
+        :rtype: results.ResultStore
+        """
+        if self.results is None:
+            self.results = ResultStore(os.path.join(self.confdir, 'results.db'))
+        return self.results
+
+    def history_store(self):
+        """
+        Return the DPS history (``history/``), creating it on first use.
+
+        :rtype: history.DPSHistory
+        """
+        if self.history is None:
+            self.history = DPSHistory(os.path.join(self.confdir, 'history'))
+        return self.history
+
+    def report_archive(self):
+        """
+        Return the archive of past runs' files (``archive/``), or None if
+        REPORT_ARCHIVE_KEEP is 0.
+
+        :rtype: archive.ReportArchive
+        """
+        keep = getattr(self.settings, 'REPORT_ARCHIVE_KEEP', ReportArchive.DEFAULT_KEEP)
+        if keep < 1:
+            return None
+        if self.archive is None:
+            self.archive = ReportArchive(
+                os.path.join(self.confdir, 'archive'), keep=keep,
+                max_size=getattr(self.settings, 'REPORT_ARCHIVE_MAX_SIZE',
+                                 ReportArchive.DEFAULT_MAX_SIZE))
+        return self.archive
+
+    def archive_reports(self, c_name, start, files):
+        """
+        Save the files from a simulation run in the report archive. Files
+        that weren't written are skipped, and problems are logged, not raised.
+
+        :param c_name: character name in name@realm format
+        :type c_name: string
+        :param start: when the simulation started
+        :type start: datetime.datetime
+        :param files: kind of file (``simc``, ``html``, ``json`` or ``log``) to
+          a path or file object
+        :type files: dict
+        """
+        files = dict((k, v) for k, v in files.items()
+                     if hasattr(v, 'read') or os.path.exists(v))
+        try:
+            archive = self.report_archive()
+            if archive is None:
+                return
+            archive.add(c_name, start, files)
+        except (IOError, OSError) as ex:
+            self.logger.warning("Unable to archive reports for {c}: {e}".format(c=c_name, e=ex))
+
+    def store_results(self, c_name, start, duration, json_path=None, error=None):
+        """
+        Parse simc's JSON report (if given) and store the results of a run
+        in the results database, and its DPS in the DPS history. Problems
+        are logged, not raised, so that they don't stop the emails.
+
+        :param c_name: character name in name@realm format
+        :type c_name: string
+        :param start: when the simulation started
+        :type start: datetime.datetime
+        :param duration: duration of simc run
+        :type duration: datetime.timedelta
+        :param json_path: path to the simc json2 report
+        :type json_path: string
+        :param error: error message, for failed runs
+        :type error: string
+        """
+        result = None
+        if json_path is not None:
+            try:
+                result = read_results(json_path)
+                self.sim_results[c_name] = result
+            except PARSE_ERRORS as ex:
+                self.logger.warning("Unable to parse simc JSON report {p}: {e}".format(
+                    p=json_path, e=ex))
+                error = 'unparseable JSON report'
+        try:
+            self.results_store().add_run(c_name, start, duration.total_seconds(),
+                                         result=result, error=error)
+        except sqlite3.Error as ex:
+            self.logger.warning("Unable to store simulation results for {c}: {e}".format(
+                c=c_name, e=ex))
+        if result is None:
+            return
+        for scenario in result.scenarios:
+            if scenario.scenario != BASELINE or scenario.dps is None:
+                continue
+            try:
+                self.history_store().append(c_name, start, scenario.dps)
+            except (IOError, OSError) as ex:
+                self.logger.warning("Unable to store DPS history for {c}: {e}".format(
+                    c=c_name, e=ex))
+            break
+
+    def profile_for_char(self, c_name, c_settings, c_bnet):
+        """
+        Return the character profile portion of the simc input; a native
+        profile generated from ``c_bnet`` unless there is none (or
+        SIMC_PROFILE_SOURCE is 'armory', when not in offline mode), in which
+        case an armory import.
+
+        :param c_name: character name in name@realm format
+        :type c_name: string
+        :param c_settings: the dict for this character from settings.py
+        :type c_settings: dict
+        :param c_bnet: BattleNet data for this character, or None
+        :type c_bnet: record.CharacterRecord
+        :rtype: string
+        """
+        region = c_settings.get('region', DEFAULT_REGION)
+        if c_bnet is not None and (self.offline or getattr(
+                self.settings, 'SIMC_PROFILE_SOURCE', 'battlenet') != 'armory'):
+            try:
+                profile = generate_profile(c_bnet, region)
+                if not isinstance(profile, str):
+                    profile = profile.encode('utf-8')
+                return profile
+            except ProfileError as ex:
+                self.logger.warning("Unable to generate simc profile for {c} ({e}); "
+                                    "using armory import".format(c=c_name, e=ex))
+        return '"armory={region},{realm},{char}"\n'.format(region=region,
+                                                           realm=c_settings['realm'],
+                                                           char=c_settings['name'])
 
     def options_for_char(self, c_settings):
         """
@@ -392,24 +1629,64 @@ class AutoSimulationCraft:
 
     def send_char_email(self, c_name, c_settings, c_diff, html_path, duration, output):
         """
-        Send emails about the simc run
+        Send emails about the simc run. With ARTIFACT_BACKEND, the HTML
+        report and simc output are uploaded in the background first, and the
+        emails (see :py:meth:`send_char_report`) link to them.
+
+        :param c_name: character name in name@realm format
+        :type c_name: string
+        :param c_settings: the dict for this character from settings.py
+        :type c_settings: dict
+        :param c_diff: the character changes that caused this run
+        :type c_diff: chardiff.CharacterDiff
+        :param html_path: path to the simc HTML output
+        :type html_path: string
+        :param duration: duration of simc run
+        :type duration: datetime.timedelta
+        :param output: output from simc command
+        :type output: string
+        """
+        uploader = self.artifact_uploader()
+        if uploader is None or self.dry_run:
+            self.send_char_report(c_name, c_settings, c_diff, html_path, duration, output)
+            return
+        self.logger.debug("Uploading reports for {c}".format(c=c_name))
+        uploader.submit([(html_path, c_name + '.html', 'text/html'),
+                         (StringIO(output), c_name + '_simc_output.txt', 'text/plain')],
+                        lambda links: self.send_char_report(c_name, c_settings, c_diff, html_path,
+                                                            duration, output, links=links))
+
+    def send_char_report(self, c_name, c_settings, c_diff, html_path, duration, output,
+                         links=None):
+        """
+        Send emails about the simc run (or add it to the digests)
 
         :param c_name: character name in name@realm format
         :type c_name: string
         :param c_settings: the dict for this character from settings.py
         :type c_settings: dict
-        :param c_diff: the textual diff of character changes that caused this run
-        :type c_diff: string
+        :param c_diff: the character changes that caused this run
+        :type c_diff: chardiff.CharacterDiff
         :param html_path: path to the simc HTML output
         :type html_path: string
         :param duration: duration of simc run
         :type duration: datetime.timedelta
         :param output: output from simc command
         :type output: string
+        :param links: URLs of the uploaded reports, by file name; if None,
+          the reports are attached
+        :type links: dict
         """
         emails = c_settings['email']
         if isinstance(emails, str):
             emails = [emails]
+        if getattr(self.settings, 'EMAIL_DIGEST', False):
+            report = SimReport(c_name, c_diff, html_path, duration, output,
+                               self.baseline_dps(c_name), links)
+            for dest_addr in emails:
+                self.logger.debug("Adding {c} to the digest for {e}".format(c=c_name, e=dest_addr))
+                self.digest.add(dest_addr, report)
+            return
         from_addr = getpass.getuser() + '@' + platform.node()
         subj = 'SimulationCraft report for {c}'.format(c=c_name)
         for dest_addr in emails:
@@ -425,13 +1702,92 @@ class AutoSimulationCraft:
                                       c_diff,
                                       html_path,
                                       duration,
-                                      output)
-            if hasattr(self.settings, 'GMAIL_USERNAME') \
-               and self.settings.GMAIL_USERNAME is not None:
-                self.send_gmail(from_addr, dest_addr, msg.as_string())
-            else:
-                self.send_local(from_addr, dest_addr, msg.as_string())
+                                      output,
+                                      links=links)
+            self.send_email(from_addr, dest_addr, msg)
         self.logger.debug("done sending emails for {cname}".format(cname=c_name))
+        self.report_sent(c_name)
+
+    def baseline_dps(self, c_name):
+        """ return the DPS from this run's simulation of a character, or None """
+        result = self.sim_results.get(c_name, None)
+        if result is None:
+            return None
+        for scenario in result.scenarios:
+            if scenario.scenario == BASELINE:
+                return scenario.dps
+        return None
+
+    def send_digests(self):
+        """
+        With EMAIL_DIGEST, send each recipient one email with all of the
+        reports collected for them during this run.
+        """
+        if len(self.digest) == 0:
+            return
+        from_addr = getpass.getuser() + '@' + platform.node()
+        sent = []
+        for dest_addr, reports in self.digest:
+            sent.extend(r.c_name for r in reports if r.c_name not in sent)
+            self.logger.info("Sending digest of {n} reports to {e}".format(
+                n=len(reports), e=dest_addr))
+            if self.dry_run:
+                self.logger.warning("DRY RUN - not actually sending email")
+                continue
+            subj = 'SimulationCraft reports for {n} characters'.format(n=len(reports))
+            if len(reports) == 1:
+                subj = 'SimulationCraft report for {c}'.format(c=reports[0].c_name)
+            msg = self.format_digest(from_addr, dest_addr, subj, reports)
+            self.send_email(from_addr, dest_addr, msg)
+        self.digest.clear()
+        self.logger.debug("done sending digests")
+        for c_name in sent:
+            self.report_sent(c_name)
+
+    def format_digest(self, from_addr, dest_addr, subj, reports):
+        """
+        Build a digest email; a summary table and each character's changes,
+        with links to the uploaded HTML reports and simc output, or with them
+        attached (as a single zip file if EMAIL_DIGEST_BUNDLE is 'zip').
+
+        :param reports: the reports to include
+        :type reports: list of :py:class:`~.digest.SimReport`
+        :rtype: mimestream.StreamingMessage
+        """
+        bundle = getattr(self.settings, 'EMAIL_DIGEST_BUNDLE', None) == 'zip'
+        body = u'SimulationCraft was run for the following characters:\n\n'
+        body += summary_table(reports) + u'\n\n'
+        for r in reports:
+            body += u'Changes for {c}:\n\n{d}\n\n'.format(c=to_text(r.c_name), d=r.c_diff.text())
+            if r.links is not None:
+                body += u'HTML report: {h}\nsimc output: {o}\n\n'.format(
+                    h=r.links[r.c_name + '.html'], o=r.links[r.c_name + '_simc_output.txt'])
+        attached = [r for r in reports if r.links is None]
+        if len(attached) > 0:
+            if bundle:
+                body += u'The HTML reports and simc output are attached in a zip file.'
+            else:
+                body += u'The HTML reports and simc output are attached.'
+            body += (u' (Note that you likely need to save the HTML attachments to disk and'
+                     u' view them from there; they will not render correctly in most email'
+                     u' clients.)\n\n')
+        footer = u'This run was done on {h} at {t} by autosimulationcraft.py v{v}'
+        body += footer.format(h=platform.node(),
+                              t=self.now(),
+                              v=self.VERSION)
+        msg = self.new_message(from_addr, dest_addr, subj)
+        msg.attach_text(body)
+        if bundle and len(attached) > 0:
+            # built in a temporary file, not in memory
+            bundle_fh = tempfile.TemporaryFile()
+            zip_bundle(attached, bundle_fh)
+            msg.attach_file(bundle_fh, 'simc_reports_{d}.zip'.format(
+                d=self.now().strftime('%Y-%m-%d')), subtype='zip')
+            return msg
+        for r in attached:
+            msg.attach_file(r.html_path, r.c_name + '.html')
+            msg.attach_data(r.output, r.c_name + '_simc_output.txt')
+        return msg
 
     def format_message(self,
                        from_addr,
@@ -441,94 +1797,221 @@ class AutoSimulationCraft:
                        c_diff,
                        html_path,
                        duration,
-                       output):
-        body = 'SimulationCraft was run for {c} due to the following changes:\n'.format(c=c_name)
-        body += '\n' + c_diff + '\n\n'
-        body += 'The run was completed in {d} and the HTML report is attached'.format(d=duration)
-        body += '. (Note that you likely need to save the HTML attachment to disk and'
-        body += ' view it from there; it will not render correctly in most email clients.)\n\n'
+                       output,
+                       links=None):
+        body = u'SimulationCraft was run for {c} due to the following changes:\n'.format(
+            c=to_text(c_name))
+        body += u'\n' + c_diff.text() + u'\n\n'
+        if links is not None:
+            body += 'The run was completed in {d}. The HTML report is at:\n\n'.format(d=duration)
+            body += links[c_name + '.html'] + '\n\nand the simc output is at:\n\n'
+            body += links[c_name + '_simc_output.txt'] + '\n\n'
+        else:
+            body += 'The run was completed in {d} and the HTML report is attached'.format(
+                d=duration)
+            body += '. (Note that you likely need to save the HTML attachment to disk and'
+            body += ' view it from there; it will not render correctly in most email clients.)\n\n'
         footer = 'This run was done on {h} at {t} by autosimulationcraft.py v{v}'
         body += footer.format(h=platform.node(),
                               t=self.now(),
                               v=self.VERSION)
-        msg = MIMEMultipart()
-        msg['Subject'] = subj
-        msg['From'] = formataddr(('AutoSimulationCraft', from_addr))
-        msg['To'] = dest_addr
-        msg['Date'] = formatdate(localtime=True)
-        msg['Message-Id'] = make_msgid()
-        bodyMIME = MIMEText(body, 'plain')
-        msg.attach(bodyMIME)
-        with open(html_path, 'r') as fh:
-            html = fh.read()
-        html_att = MIMEApplication(html)
-        html_att.add_header('Content-Disposition',
-                            'attachment',
-                            filename=(c_name + '.html'))
-        msg.attach(html_att)
-        output_att = MIMEApplication(output)
-        output_att.add_header('Content-Disposition',
-                              'attachment',
-                              filename=(c_name + '_simc_output.txt'))
-        msg.attach(output_att)
+        msg = self.new_message(from_addr, dest_addr, subj)
+        # may be unicode, i.e. item names in the diff
+        msg.attach_text(body)
+        if links is not None:
+            return msg
+        # read from disk, in chunks, when the message is written
+        msg.attach_file(html_path, c_name + '.html')
+        msg.attach_data(output, c_name + '_simc_output.txt')
         return msg
 
-    def send_gmail(self, from_addr, dest, msg_s):
+    def new_message(self, from_addr, dest_addr, subj):
+        """
+        Return a new (empty) email with our standard headers.
+
+        :rtype: mimestream.StreamingMessage
+        """
+        return StreamingMessage([('Subject', subj),
+                                 ('From', formataddr(('AutoSimulationCraft', from_addr))),
+                                 ('To', dest_addr),
+                                 ('Date', formatdate(localtime=True)),
+                                 ('Message-Id', make_msgid())])
+
+    def send_email(self, from_addr, dest, msg):
+        """
+        Send an email; unless MAIL_SPOOL is False, it is written to the mail
+        spool and sent by the background :py:class:`~.spool.MailSender`.
+
+        :param msg: the message (see :py:func:`~.mimestream.write_message`)
+        :type msg: mimestream.StreamingMessage
+        """
+        if not getattr(self.settings, 'MAIL_SPOOL', True) or self.takeover:
+            # the spool belongs to the run holding the lock
+            self.deliver_email(from_addr, dest, msg)
+            return
+        self.mail_spool().add(from_addr, dest, msg)
+        self.start_mail_sender().wake()
+
+    def mail_spool(self):
+        """
+        Return the outbound mail spool (``mail_spool/``).
+
+        :rtype: spool.MailSpool
+        """
+        with self.mail_lock:
+            if self.spool is None:
+                self.spool = MailSpool(os.path.join(self.confdir, 'mail_spool'))
+        return self.spool
+
+    def start_mail_sender(self):
+        """
+        Return the background mail sender, starting it if needed.
+
+        :rtype: spool.MailSender
+        """
+        spool = self.mail_spool()
+        with self.mail_lock:
+            if self.mail_sender is None:
+                self.mail_sender = MailSender(
+                    spool, self.deliver_email, self.logger,
+                    retry_delay=getattr(self.settings, 'MAIL_RETRY_DELAY', 60),
+                    max_attempts=getattr(self.settings, 'MAIL_MAX_ATTEMPTS', 5))
+                self.mail_sender.start()
+        return self.mail_sender
+
+    def resume_mail(self):
+        """ start sending emails left in the spool by a previous run """
+        if not getattr(self.settings, 'MAIL_SPOOL', True) or self.dry_run or self.takeover:
+            return
+        count = len(self.mail_spool())
+        if count == 0:
+            return
+        self.logger.info("Resuming delivery of {n} spooled emails".format(n=count))
+        self.start_mail_sender()
+
+    def finish_mail(self):
+        """
+        Wait for the background mail sender to send the spooled emails,
+        retrying failures for up to MAIL_SPOOL_WAIT seconds, and stop it.
+        """
+        if self.mail_sender is None:
+            return
+        self.logger.debug("Waiting for spooled emails to be sent")
+        self.mail_sender.stop(wait=getattr(self.settings, 'MAIL_SPOOL_WAIT', 300))
+        self.mail_sender = None
+        count = len(self.mail_spool())
+        if count > 0:
+            self.logger.warning("{n} emails could not be sent yet; they will be retried on the "
+                                "next run".format(n=count))
+
+    def artifact_uploader(self):
+        """
+        Return the uploader for ARTIFACT_BACKEND, creating it on first use,
+        or None if ARTIFACT_BACKEND isn't set.
+
+        :rtype: artifacts.ArtifactUploader
+        """
+        conf = getattr(self.settings, 'ARTIFACT_BACKEND', None)
+        if conf is None:
+            return None
+        if self.uploader is None:
+            self.uploader = ArtifactUploader(backend_from_settings(conf), self.logger)
+        return self.uploader
+
+    def finish_uploads(self):
+        """ wait for the background report uploads (and their emails) to finish """
+        if self.uploader is None:
+            return
+        self.logger.debug("Waiting for report uploads to finish")
+        self.uploader.wait()
+
+    def deliver_email(self, from_addr, dest, msg):
+        """ Send email via GMail if GMAIL_USERNAME is set, otherwise local SMTP """
+        if getattr(self.settings, 'GMAIL_USERNAME', None) is not None:
+            self.send_gmail(from_addr, dest, msg)
+        else:
+            self.send_local(from_addr, dest, msg)
+
+    def send_gmail(self, from_addr, dest, msg):
         """Send email using GMail"""
         s = smtplib.SMTP('smtp.gmail.com:587')
         s.starttls()
         s.login(self.settings.GMAIL_USERNAME, self.settings.GMAIL_PASSWORD)
-        s.sendmail(from_addr, [dest], msg_s)
+        send_message(s, from_addr, dest, msg)
         s.quit()
 
-    def send_local(self, from_addr, dest, msg_s):
+    def send_local(self, from_addr, dest, msg):
         """
         Send email using local SMTP
         """
         s = smtplib.SMTP('localhost')
-        s.sendmail(from_addr, [dest], msg_s)
+        send_message(s, from_addr, dest, msg)
         s.quit()
 
     def now(self):
         """Helper function to make unit tests easier - return datetime.now() """
         return datetime.datetime.now()
 
-    def get_battlenet(self, realm, character):
-        """ get a character's info from Battlenet API """
+    def stale_fields(self, cached, now):
+        """
+        Return the list of :py:attr:`CHARACTER_FIELDS` that need to be
+        fetched, given the cached record for a character (or None) and the
+        ``SUBRESOURCE_TTLS`` setting.
+
+        :param cached: the character's cached record, or None
+        :type cached: record.CharacterRecord
+        :param now: the current time
+        :type now: datetime.datetime
+        :rtype: list
+        """
+        if cached is None:
+            return list(self.CHARACTER_FIELDS)
+        ttls = dict(self.SUBRESOURCE_TTLS)
+        ttls.update(getattr(self.settings, 'SUBRESOURCE_TTLS', {}))
+        fields = []
+        for field in self.CHARACTER_FIELDS:
+            last = cached.fetched.get(field, None)
+            if last is None or (now - last).total_seconds() >= ttls.get(field, 0):
+                fields.append(field)
+        return fields
+
+    def get_battlenet(self, realm, character, region=DEFAULT_REGION):
+        """
+        Get a character's info from the Battlenet API, in a single request
+        for whichever of :py:attr:`CHARACTER_FIELDS` are stale (see
+        :py:meth:`stale_fields`); the rest are taken from the cached record.
+
+        :param realm: character's realm
+        :type realm: string
+        :param character: character name
+        :type character: string
+        :param region: character's region, i.e. 'us'
+        :type region: string
+        :rtype: record.CharacterRecord or None
+        """
+        cached = self.character_cache.get(self.make_character_name(character, realm, region), None)
+        now = self.now()
+        fields = self.stale_fields(cached, now)
+        pool = self.region_pool(region)
+        pool.throttle()
         try:
-            char = self.bnet.get_character(battlenet.UNITED_STATES, realm, character)
+            data = pool.connection.get_character(pool.bnet_region, realm, character,
+                                                 fields=fields, raw=True)
         except battlenet.exceptions.CharacterNotFound:
             self.logger.error("ERROR - Character Not Found - "
                               "realm='{r}' character='{c}'".format(r=realm, c=character))
             return None
-        self.logger.debug("got character from battlenet; getting further information")
-        # get all of the info we need
-        char.appearance
-        char.equipment
-        char.level
-        char.professions
-        char.faction
-        # these seem buggy
-        try:
-            char.stats
-        except:
-            pass
-        try:
-            char.talents
-        except:
-            pass
-        # copy the dict
-        d = deepcopy(char.__dict__['_data'])
-        # remove stuff we don't want
-        for i in ['connection',
-                  'achievementPoints',
-                  'lastModified',
-                  '_items',
-                  'achievement_points']:
-            if i in d:
-                del d[i]
-        for t in ['primary', 'secondary']:
-            for i in d['professions'][t]:
-                del i['recipes']
-        self.logger.debug("cleaned up character data")
-        return d
+        self.logger.debug("got character from battlenet (fields: {f})".format(f=', '.join(fields)))
+        for field in fields:
+            if field not in data:
+                self.logger.warning("Battlenet did not return {f} for {c}@{r}; "
+                                    "ignoring it".format(f=field, c=character, r=realm))
+        # project the raw API data straight into a new record; the payload
+        # itself is neither copied nor modified
+        rec = CharacterRecord.from_bnet(data)
+        rec.fetched = dict([(f, now) for f in fields if f in data])
+        if cached is not None:
+            rec.merge_fields(cached, [f for f in self.CHARACTER_FIELDS if f not in rec.fetched])
+        self.item_store.add_from_bnet(data.get('items', {}))
+        self.logger.debug("built character record")
+        return rec
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - character change detection
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+from collections import namedtuple
+from cgi import escape
+
+#: One meaningful difference between two character records. ``section`` is
+#: one of 'character', 'talent', 'glyph', 'item', 'stat' or 'appearance';
+#: ``name`` is the attribute, talent tier, glyph name or item slot.
+Change = namedtuple('Change', ['section', 'name', 'old', 'new'])
+
+#: attributes compared as simple scalars, with their display names
+SCALARS = [
+    ('level', 'level'),
+    ('class_id', 'class'),
+    ('race_id', 'race'),
+    ('gender', 'gender'),
+    ('spec', 'spec'),
+    ('item_level', 'average equipped item level'),
+]
+
+ITEM_FIELDS = [
+    ('bonus', 'bonus ids'),
+    ('enchant', 'enchant'),
+    ('gems', 'gems'),
+    ('upgrade', 'upgrade level'),
+]
+
+
+def _fmt(value):
+    """ format a value for display in a change line """
+    if value is None or value == ():
+        return 'none'
+    if isinstance(value, tuple):
+        return '/'.join([str(v) for v in value])
+    return value
+
+
+def _talent(sel):
+    """ format a calcTalent tier selection ('0'-'2' or '.') """
+    if sel == '.':
+        return 'none'
+    return 'column {c}'.format(c=int(sel) + 1)
+
+
+def _item(item_id, item_name):
+    """ format an item id, with its name if ``item_name`` can provide it """
+    name = None
+    if item_name is not None:
+        name = item_name(item_id)
+    if name is None:
+        return 'item {i}'.format(i=item_id)
+    return u'item {i} ({n})'.format(i=item_id, n=name)
+
+
+def render_change(change, item_name=None):
+    """
+    Return the human-readable line for one :py:class:`Change`.
+
+    :param change: the change to render
+    :type change: Change
+    :param item_name: callable returning the name for an item id (or None)
+    :type item_name: callable
+    :rtype: string
+    """
+    section, name, old, new = change
+    if section == 'note':
+        return new
+    if section == 'talent':
+        return 'talent tier {t} changed from {a} to {b}'.format(
+            t=name, a=_talent(old), b=_talent(new))
+    if section == 'glyph':
+        if new is None:
+            return u'glyph removed: {g}'.format(g=name)
+        return u'glyph added: {g}'.format(g=name)
+    if section == 'item':
+        if old is None:
+            return u'{s}: equipped {i}'.format(s=name, i=_item(new.id, item_name))
+        if new is None:
+            return u'{s}: removed {i}'.format(s=name, i=_item(old.id, item_name))
+        if old.id != new.id:
+            return u'{s}: {a} replaced by {b}'.format(s=name, a=_item(old.id, item_name),
+                                                      b=_item(new.id, item_name))
+        lines = []
+        for field, desc in ITEM_FIELDS:
+            a = getattr(old, field)
+            b = getattr(new, field)
+            if a != b:
+                lines.append('{d} changed from {a} to {b}'.format(d=desc, a=_fmt(a), b=_fmt(b)))
+        return u'{s}: {i} {c}'.format(s=name, i=_item(new.id, item_name), c='; '.join(lines))
+    if section == 'stat':
+        return 'stat {s} changed from {a} to {b}'.format(s=name, a=_fmt(old), b=_fmt(new))
+    if section == 'appearance':
+        return 'appearance {s} changed from {a} to {b}'.format(s=name, a=_fmt(old), b=_fmt(new))
+    return u'{s} changed from {a} to {b}'.format(s=name, a=_fmt(old), b=_fmt(new))
+
+
+class CharacterDiff(object):
+
+    """
+    The meaningful changes between two character records, as a list of
+    :py:class:`Change` tuples. Text and HTML are only rendered when asked for;
+    ``item_name`` (if given) is used then to look up item names.
+    """
+
+    def __init__(self, changes=None, item_name=None):
+        self.changes = changes if changes is not None else []
+        self.item_name = item_name
+
+    @classmethod
+    def note(cls, text):
+        """ a "diff" that is just a single line of text """
+        return cls([Change('note', None, None, text)])
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def __eq__(self, other):
+        return isinstance(other, CharacterDiff) and self.changes == other.changes
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def lines(self):
+        """ return the list of rendered change lines """
+        return [render_change(c, item_name=self.item_name) for c in self.changes]
+
+    def text(self):
+        """ render as plain text, one change per line """
+        return '\n'.join(self.lines())
+
+    def html(self):
+        """ render as an HTML list, one change per item """
+        return '<ul>\n' + ''.join(
+            ['<li>{l}</li>\n'.format(l=escape(l)) for l in self.lines()]) + '</ul>'
+
+    def __str__(self):
+        return self.text()
+
+    def __repr__(self):
+        return '<CharacterDiff ({n} changes)>'.format(n=len(self.changes))
+
+
+def _diff_pairs(section, old, new):
+    """
+    Diff two sorted ``(name, value)`` tuples, returning Change tuples for
+    every name added, removed or changed.
+    """
+    old = dict(old or ())
+    new = dict(new or ())
+    res = []
+    for k in sorted(set(old) | set(new)):
+        if old.get(k) != new.get(k):
+            res.append(Change(section, k, old.get(k), new.get(k)))
+    return res
+
+
+def diff_records(old, new, no_stat=False, item_name=None):
+    """
+    Compare two :py:class:`~.record.CharacterRecord` instances.
+
+    Scalars (level, spec, etc.) are compared directly, talents per tier,
+    glyphs as a set, equipment per slot (by item id, bonus ids, enchant, gems
+    and upgrade level) and stats/appearance per key. Professions are ignored.
+
+    :param old: the cached record
+    :type old: record.CharacterRecord
+    :param new: the current record
+    :type new: record.CharacterRecord
+    :param no_stat: ignore overall stats
+    :type no_stat: Boolean
+    :param item_name: callable returning the name for an item id (or None),
+      used when the diff is rendered
+    :type item_name: callable
+    :rtype: CharacterDiff
+    """
+    changes = []
+    for attr, desc in SCALARS:
+        a = getattr(old, attr)
+        b = getattr(new, attr)
+        if a != b:
+            changes.append(Change('character', desc, a, b))
+    if old.talents != new.talents:
+        a = old.talents or ''
+        b = new.talents or ''
+        for tier in range(max(len(a), len(b))):
+            t_a = a[tier] if tier < len(a) else '.'
+            t_b = b[tier] if tier < len(b) else '.'
+            if t_a != t_b:
+                changes.append(Change('talent', tier + 1, t_a, t_b))
+    if old.glyphs != new.glyphs:
+        for g in sorted(set(old.glyphs) - set(new.glyphs)):
+            changes.append(Change('glyph', g, g, None))
+        for g in sorted(set(new.glyphs) - set(old.glyphs)):
+            changes.append(Change('glyph', g, None, g))
+    if old.items != new.items:
+        old_items = dict([(i.slot, i) for i in old.items])
+        new_items = dict([(i.slot, i) for i in new.items])
+        for slot in sorted(set(old_items) | set(new_items)):
+            a = old_items.get(slot)
+            b = new_items.get(slot)
+            if a != b:
+                changes.append(Change('item', slot, a, b))
+    if not no_stat and old.stats != new.stats:
+        changes.extend(_diff_pairs('stat', old.stats, new.stats))
+    if old.appearance != new.appearance:
+        changes.extend(_diff_pairs('appearance', old.appearance, new.appearance))
+    return CharacterDiff(changes, item_name=item_name)
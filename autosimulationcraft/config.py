@@ -39,3 +39,15 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 """
 
 DEFAULT_CONFDIR = '~/.autosimulationcraft'
+
+
+class CachedSettings(object):
+
+    """
+    Settings loaded from the settings cache; stands in for the imported
+    settings module, with each cached setting as an attribute.
+    """
+
+    def __init__(self, values):
+        for name, value in values.items():
+            setattr(self, name, value)
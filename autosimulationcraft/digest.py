@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - per-recipient report digests
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import zipfile
+from collections import namedtuple, OrderedDict
+
+from text import to_text
+
+#: one finished simulation, waiting to be sent in a digest; ``links`` are
+#: the URLs of its uploaded reports, by file name, or None if they are to
+#: be attached
+SimReport = namedtuple('SimReport', ['c_name', 'c_diff', 'html_path', 'duration', 'output',
+                                     'dps', 'links'])
+
+
+class Digest(object):
+
+    """
+    Collects the :py:class:`SimReport` for each recipient during a run, so
+    that each recipient can be sent a single message at the end of it.
+    """
+
+    def __init__(self):
+        self.reports = OrderedDict()
+
+    def add(self, dest_addr, report):
+        self.reports.setdefault(dest_addr, []).append(report)
+
+    def __len__(self):
+        return len(self.reports)
+
+    def __iter__(self):
+        """ iterate over ``(dest_addr, [SimReport, ...])``, in order added """
+        return iter(self.reports.items())
+
+    def clear(self):
+        self.reports.clear()
+
+
+def _duration(td):
+    """ format a timedelta as H:MM:SS """
+    secs = int(td.total_seconds())
+    return '{h}:{m:02d}:{s:02d}'.format(h=secs // 3600, m=(secs // 60) % 60, s=secs % 60)
+
+
+def summary_table(reports):
+    """
+    Return a plain-text table summarizing ``reports``: one line per
+    character, with the number of changes, the simc duration and the DPS
+    (if known).
+
+    :param reports: the reports to summarize
+    :type reports: list of :py:class:`SimReport`
+    :rtype: unicode
+    """
+    width = max([len(to_text(r.c_name)) for r in reports] + [len('Character')])
+    fmt = u'{c:<{w}}  {n:>7}  {d:>9}  {p:>10}'
+    lines = [fmt.format(c='Character', w=width, n='Changes', d='Duration', p='DPS')]
+    for r in reports:
+        dps = '' if r.dps is None else '{0:.1f}'.format(r.dps)
+        lines.append(fmt.format(c=to_text(r.c_name), w=width, n=len(r.c_diff), d=_duration(r.duration),
+                                p=dps))
+    return u'\n'.join(lines)
+
+
+def zip_bundle(reports, fh):
+    """
+    Write a (deflated) zip file containing the HTML report and simc output
+    of each of ``reports`` to the file object ``fh``.
+
+    :param reports: the reports to bundle
+    :type reports: list of :py:class:`SimReport`
+    :param fh: file object to write to
+    :type fh: file
+    """
+    zf = zipfile.ZipFile(fh, 'w', zipfile.ZIP_DEFLATED)
+    for r in reports:
+        zf.write(r.html_path, r.c_name + '.html')
+        zf.writestr(r.c_name + '_simc_output.txt', r.output)
+    zf.close()
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - compact DPS history
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+import errno
+import bisect
+import calendar
+import datetime
+import threading
+from array import array
+from collections import namedtuple
+from urllib import quote, unquote
+
+#: summary of one character's runs in a time range
+HistoryStats = namedtuple('HistoryStats', ['character', 'runs', 'first', 'last', 'change',
+                                           'mean', 'p50', 'p90'])
+
+
+def to_timestamp(dt):
+    """ naive datetime to (float) seconds since the epoch, without timezone conversion """
+    return calendar.timegm(dt.timetuple()) + dt.microsecond / 1000000.0
+
+
+def from_timestamp(ts):
+    """ inverse of :py:func:`to_timestamp` """
+    return datetime.datetime.utcfromtimestamp(ts)
+
+
+def percentile(values, pct):
+    """
+    Return the ``pct`` (0-100) percentile of sorted ``values``, interpolating
+    linearly between the closest ranks; None if there are no values.
+    """
+    if len(values) == 0:
+        return None
+    k = (len(values) - 1) * (pct / 100.0)
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class DPSHistory(object):
+
+    """
+    Per-character DPS history, stored as two append-only columns of
+    doubles per character (``<name@realm>.t`` timestamps and
+    ``<name@realm>.dps`` values) so that a run only appends 16 bytes, and a
+    character's whole history loads with a single read per column into
+    :py:class:`array.array`.
+    """
+
+    TIMES = '.t'
+    VALUES = '.dps'
+
+    def __init__(self, path):
+        """
+        :param path: directory the history is kept in (created on first append)
+        :type path: string
+        """
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _base(self, character):
+        if isinstance(character, unicode):
+            character = character.encode('utf-8')
+        return os.path.join(self.path, quote(character, safe='@'))
+
+    def append(self, character, when, dps):
+        """
+        Add one result to the end of a character's history.
+
+        :param character: character name in name@realm format
+        :type character: string
+        :param when: when the run started
+        :type when: datetime.datetime
+        :param dps: DPS of the run
+        :type dps: float
+        """
+        base = self._base(character)
+        with self.lock:
+            try:
+                os.makedirs(self.path)
+            except OSError as ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+            self._repair(base)
+            for suffix, value in [(self.TIMES, to_timestamp(when)), (self.VALUES, dps)]:
+                with open(base + suffix, 'ab') as fh:
+                    array('d', [value]).tofile(fh)
+
+    def rename(self, old, new):
+        """
+        Move the history of character ``old`` to ``new``, unless ``new``
+        already has history.
+
+        :returns: whether anything was moved
+        :rtype: bool
+        """
+        src = self._base(old)
+        dest = self._base(new)
+        with self.lock:
+            if not os.path.exists(src + self.TIMES) or os.path.exists(dest + self.TIMES):
+                return False
+            for suffix in [self.TIMES, self.VALUES]:
+                if os.path.exists(src + suffix):
+                    os.rename(src + suffix, dest + suffix)
+        return True
+
+    def _repair(self, base):
+        """ truncate the columns to the same length, after an interrupted append """
+        sizes = {}
+        for suffix in [self.TIMES, self.VALUES]:
+            try:
+                sizes[suffix] = os.path.getsize(base + suffix)
+            except OSError:
+                sizes[suffix] = 0
+        size = min(sizes.values())
+        size -= size % array('d').itemsize
+        for suffix in sizes:
+            if sizes[suffix] > size:
+                with open(base + suffix, 'r+b') as fh:
+                    fh.truncate(size)
+
+    def _read(self, path):
+        col = array('d')
+        try:
+            with open(path, 'rb') as fh:
+                col.fromfile(fh, os.fstat(fh.fileno()).st_size // col.itemsize)
+        except IOError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+        return col
+
+    def load(self, character):
+        """
+        Return a character's whole history as ``(times, values)`` arrays,
+        ordered by time.
+
+        :rtype: tuple
+        """
+        base = self._base(character)
+        times = self._read(base + self.TIMES)
+        values = self._read(base + self.VALUES)
+        # an interrupted append may have written only one column
+        n = min(len(times), len(values))
+        if n < len(times):
+            times = times[:n]
+        if n < len(values):
+            values = values[:n]
+        if any(times[i] > times[i + 1] for i in xrange(n - 1)):
+            pairs = sorted(zip(times, values))
+            times = array('d', [p[0] for p in pairs])
+            values = array('d', [p[1] for p in pairs])
+        return (times, values)
+
+    def characters(self):
+        """ return the (sorted) names of all characters with history """
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(unquote(f[:-len(self.TIMES)]).decode('utf-8')
+                      for f in os.listdir(self.path) if f.endswith(self.TIMES))
+
+    def series(self, character, start=None, end=None):
+        """
+        Return ``(times, values)`` arrays for a character's runs from
+        ``start`` (inclusive) to ``end`` (exclusive).
+
+        :param start: start of the range, or None for no limit
+        :type start: datetime.datetime
+        :param end: end of the range, or None for no limit
+        :type end: datetime.datetime
+        :rtype: tuple
+        """
+        times, values = self.load(character)
+        lo = 0 if start is None else bisect.bisect_left(times, to_timestamp(start))
+        hi = len(times) if end is None else bisect.bisect_left(times, to_timestamp(end))
+        return (times[lo:hi], values[lo:hi])
+
+    def rolling_mean(self, character, window, start=None, end=None):
+        """
+        Return ``(datetime, dps, mean)`` for each of a character's runs in
+        the range, where ``mean`` is the average of that run and up to
+        ``window - 1`` runs before it.
+
+        :param window: number of runs to average; at least 1
+        :type window: int
+        :rtype: list
+        """
+        if window < 1:
+            raise ValueError("rolling mean window must be at least 1, not {w}".format(w=window))
+        times, values = self.series(character, start=start, end=end)
+        res = []
+        total = 0.0
+        for i in xrange(len(values)):
+            total += values[i]
+            if i >= window:
+                total -= values[i - window]
+            res.append((from_timestamp(times[i]), values[i], total / min(i + 1, window)))
+        return res
+
+    def stats(self, character, start=None, end=None):
+        """
+        Summarize a character's runs in the range; None if there are none.
+
+        :rtype: HistoryStats
+        """
+        times, values = self.series(character, start=start, end=end)
+        if len(values) == 0:
+            return None
+        ordered = sorted(values)
+        return HistoryStats(character, len(values), values[0], values[-1],
+                            values[-1] - values[0], sum(values) / len(values),
+                            percentile(ordered, 50), percentile(ordered, 90))
+
+    def report(self, characters=None, start=None, end=None, window=None):
+        """
+        Return a text report of the DPS history of ``characters`` (default
+        all) in the range; a summary table, followed by the runs and their
+        rolling mean over ``window`` runs, if given.
+
+        :rtype: string
+        """
+        if characters is None:
+            characters = self.characters()
+        stats = [s for s in (self.stats(c, start=start, end=end) for c in characters)
+                 if s is not None]
+        if len(stats) == 0:
+            return 'No DPS history found.'
+        width = max([len(s.character) for s in stats] + [len('Character')])
+        fmt = (u'{c:<{w}}  {r:>5}  {f:>10.1f}  {l:>10.1f}  {d:>+10.1f}  {m:>10.1f}  {p50:>10.1f}  '
+               u'{p90:>10.1f}')
+        lines = [u'{c:<{w}}  {r:>5}  {f:>10}  {l:>10}  {d:>10}  {m:>10}  {p50:>10}  {p90:>10}'.format(
+            c='Character', w=width, r='Runs', f='First', l='Last', d='Change', m='Mean',
+            p50='p50', p90='p90')]
+        for s in stats:
+            lines.append(fmt.format(c=s.character, w=width, r=s.runs, f=s.first, l=s.last,
+                                    d=s.change, m=s.mean, p50=s.p50, p90=s.p90))
+        lines.append(u'{c:<{w}}  {r:>5}  {f:>10}  {l:>10}  {d:>+10.1f}  (mean change)'.format(
+            c='All', w=width, r=sum(s.runs for s in stats), f='', l='',
+            d=sum(s.change for s in stats) / len(stats)))
+        if window is not None:
+            for s in stats:
+                lines.append(u'')
+                lines.append(u'{c} (rolling mean of {n} runs):'.format(c=s.character, n=window))
+                for when, dps, mean in self.rolling_mean(s.character, window, start=start, end=end):
+                    lines.append(u'  {t}  {d:>10.1f}  {m:>10.1f}'.format(
+                        t=when.strftime('%Y-%m-%d %H:%M'), d=dps, m=mean))
+        return u'\n'.join(lines)
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - conditional HTTP cache for the Battlenet API
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+import time
+import json
+import hashlib
+import logging
+import threading
+import urllib2
+import urlparse
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import battlenet
+from battlenet.connection import URL_FORMAT, DAYS, MONTHS
+from battlenet.exceptions import APIError
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPCache(object):
+
+    """
+    On-disk cache of API response bodies and their validators (ETag and
+    Last-Modified), one file per URL in ``path``. When it holds more than
+    ``max_entries`` responses, the least recently used are removed.
+    """
+
+    def __init__(self, path, max_entries=5000):
+        """
+        :param path: directory to keep the cache in; created if needed
+        :type path: string
+        :param max_entries: maximum number of responses to keep
+        :type max_entries: int
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self._count = None
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def entry_path(self, url):
+        """ return the path of the cache file for a URL """
+        return os.path.join(self.path, hashlib.sha1(url).hexdigest())
+
+    def get(self, url):
+        """
+        Return the cached entry for a URL, a dict with keys 'url', 'etag',
+        'last_modified' and 'body', or None.
+
+        :param url: request URL
+        :type url: string
+        :rtype: dict or None
+        """
+        path = self.entry_path(url)
+        try:
+            with open(path, 'rb') as fh:
+                entry = pickle.load(fh)
+            # the mtime is the last use, for eviction
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if entry.get('url') != url:
+            return None
+        return entry
+
+    def put(self, url, etag, last_modified, body):
+        """
+        Cache a response body and its validators.
+
+        :param url: request URL
+        :type url: string
+        :param etag: ETag header, or None
+        :type etag: string
+        :param last_modified: Last-Modified header, or None
+        :type last_modified: string
+        :param body: response body
+        :type body: string
+        """
+        path = self.entry_path(url)
+        entry = {'url': url, 'etag': etag, 'last_modified': last_modified, 'body': body}
+        with self.lock:
+            existed = os.path.exists(path)
+            tmppath = path + '.tmp'
+            with open(tmppath, 'wb') as fh:
+                pickle.dump(entry, fh, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmppath, path)
+            if self._count is None:
+                self._count = len(self.entries())
+            elif not existed:
+                self._count += 1
+            if self._count > self.max_entries:
+                self.evict()
+
+    def entries(self):
+        """ return the list of cache file paths """
+        return [os.path.join(self.path, f) for f in os.listdir(self.path)
+                if not f.endswith('.tmp')]
+
+    def evict(self):
+        """ remove the least recently used entries down to max_entries """
+        paths = sorted(self.entries(), key=lambda p: os.stat(p).st_mtime)
+        for p in paths[:len(paths) - self.max_entries]:
+            logger.debug("removing HTTP cache entry {p}".format(p=p))
+            os.unlink(p)
+        self._count = min(len(paths), self.max_entries)
+
+
+class CachingConnection(battlenet.Connection):
+
+    """
+    :py:class:`battlenet.Connection` that sends conditional requests for
+    responses it has in an :py:class:`HTTPCache`, re-using the cached body
+    when the API answers 304 Not Modified.
+    """
+
+    url_format = URL_FORMAT
+
+    def __init__(self, cache=None, transport=None, **kwargs):
+        """
+        :param cache: the response cache, or None to not cache
+        :type cache: HTTPCache
+        :param transport: callable to send a urllib2.Request and return the
+          response (see :py:meth:`open_url`); defaults to urllib2.urlopen
+        :type transport: callable
+        """
+        super(CachingConnection, self).__init__(**kwargs)
+        self.cache = cache
+        self.transport = transport
+
+    def build_request(self, region, path, params=None):
+        """
+        Return the ``(url, headers)`` for an API request, the same as
+        :py:meth:`battlenet.Connection.make_request` would make.
+        """
+        params = params or {}
+        now = time.gmtime()
+        date = '%s, %2d %s %d %2d:%02d:%02d GMT' % (DAYS[now[6]], now[2],
+                                                    MONTHS[now[1]], now[0], now[3], now[4], now[5])
+        headers = {'Date': date}
+        url = self.url_format % {
+            'region': region,
+            'game': self.game,
+            'path': path,
+            'params': '&'.join('='.join(
+                (k, ','.join(v) if isinstance(v, (set, list)) else v))
+                for k, v in sorted(params.items()) if v)
+        }
+        if self.public_key:
+            uri = urlparse.urlparse(url)
+            signature = self.sign_request('GET', date, uri.path, self.private_key)
+            headers['Authorization'] = 'BNET %s:%s' % (self.public_key, signature)
+        return url, headers
+
+    def open_url(self, request):
+        """
+        Send a request with the transport; returns the response, or raises
+        urllib2.HTTPError or urllib2.URLError.
+
+        :param request: the request
+        :type request: urllib2.Request
+        """
+        if self.transport is not None:
+            return self.transport(request)
+        return urllib2.urlopen(request)
+
+    def make_request(self, region, path, params=None):
+        url, headers = self.build_request(region, path, params)
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.get(url)
+        if entry is not None:
+            if entry['etag'] is not None:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified'] is not None:
+                headers['If-Modified-Since'] = entry['last_modified']
+        logger.debug('Battle.net => ' + url)
+        try:
+            response = self.open_url(urllib2.Request(url, None, headers))
+            body = response.read()
+            info = response.info()
+            etag = info.getheader('ETag')
+            last_modified = info.getheader('Last-Modified')
+            if self.cache is not None and (etag is not None or last_modified is not None):
+                self.cache.put(url, etag, last_modified, body)
+        except urllib2.HTTPError as ex:
+            if ex.code != 304 or entry is None:
+                raise APIError(str(ex))
+            logger.debug('Battle.net <= 304 Not Modified; using cached response')
+            body = entry['body']
+        except urllib2.URLError as ex:
+            raise APIError(str(ex))
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise APIError('Non-JSON Response')
+        if data.get('status') == 'nok':
+            raise APIError(data['reason'])
+        return data
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - shared item metadata cache
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+import threading
+from collections import namedtuple, OrderedDict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from lock import FileLock
+
+#: the metadata kept for each item id
+ItemInfo = namedtuple('ItemInfo', ['name', 'icon', 'quality', 'item_level'])
+
+
+def item_info_from_bnet(data):
+    """
+    Build an :py:class:`ItemInfo` from a Battlenet item dict (either an
+    equipped item from a character's ``items`` or an item API response).
+
+    :param data: Battlenet item data
+    :type data: dict
+    :rtype: ItemInfo
+    """
+    return ItemInfo(data.get('name'), data.get('icon'), data.get('quality'),
+                    data.get('itemLevel'))
+
+
+class ItemStore(object):
+
+    """
+    Item id to :py:class:`ItemInfo` store, shared by all characters and
+    persisted between runs. The least-recently-used items are evicted once
+    it holds more than ``max_size`` items. Safe to use from multiple threads.
+    """
+
+    DEFAULT_SIZE = 10000
+
+    def __init__(self, path, max_size=DEFAULT_SIZE):
+        """
+        :param path: path to the pickle file the store is kept in
+        :type path: string
+        :param max_size: maximum number of items to keep
+        :type max_size: int
+        """
+        self.path = path
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        """ load the store from disk, if it exists """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as fh:
+            data = pickle.load(fh)
+        with self.lock:
+            # stored least-recently-used first
+            self.items = OrderedDict([(k, ItemInfo(*v)) for k, v in data])
+            self._evict()
+            self.dirty = False
+
+    def save(self):
+        """
+        Write the store to disk, if it has changed since it was loaded. Items
+        saved by another run in the meantime are kept, as less recently used
+        than this store's.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            data = [(k, tuple(v)) for k, v in self.items.items()]
+            self.dirty = False
+        with FileLock(self.path + '.lock'):
+            if os.path.exists(self.path):
+                with open(self.path, 'rb') as fh:
+                    merged = OrderedDict(pickle.load(fh))
+                for k, v in data:
+                    merged.pop(k, None)
+                    merged[k] = v
+                data = list(merged.items())[-self.max_size:]
+            tmppath = self.path + '.tmp'
+            with open(tmppath, 'wb') as fh:
+                pickle.dump(data, fh, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmppath, self.path)
+
+    def _evict(self):
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+            self.dirty = True
+
+    def _touch(self, item_id):
+        """ make ``item_id`` (if present) the most-recently-used item """
+        if item_id not in self.items or next(reversed(self.items)) == item_id:
+            return
+        self.items[item_id] = self.items.pop(item_id)
+        # the LRU order is saved too, so a reorder is a change
+        self.dirty = True
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item_id):
+        return item_id in self.items
+
+    def get(self, item_id):
+        """
+        Return the ItemInfo for ``item_id``, or None if it isn't known.
+
+        :param item_id: item id
+        :type item_id: int
+        :rtype: ItemInfo or None
+        """
+        with self.lock:
+            self._touch(item_id)
+            return self.items.get(item_id)
+
+    def put(self, item_id, info):
+        """
+        Store (or replace) the ItemInfo for ``item_id``.
+
+        :param item_id: item id
+        :type item_id: int
+        :param info: item metadata
+        :type info: ItemInfo
+        """
+        with self.lock:
+            self._touch(item_id)
+            if self.items.get(item_id) != info:
+                self.items[item_id] = info
+                self.dirty = True
+            self._evict()
+
+    def add_from_bnet(self, items):
+        """
+        Add the metadata for all equipped items in a character's Battlenet
+        ``items`` dict.
+
+        :param items: the ``items`` portion of Battlenet character data
+        :type items: dict
+        """
+        for slot, data in items.items():
+            if isinstance(data, dict) and 'id' in data:
+                self.put(data['id'], item_info_from_bnet(data))
+
+    def lookup(self, item_id, fetch):
+        """
+        Return the ItemInfo for ``item_id``, calling ``fetch(item_id)`` (which
+        should return a Battlenet item dict, or None) and storing the result
+        if it isn't already known.
+
+        :param item_id: item id
+        :type item_id: int
+        :param fetch: callable to get item data from the API
+        :type fetch: callable
+        :rtype: ItemInfo or None
+        """
+        info = self.get(item_id)
+        if info is not None:
+            return info
+        data = fetch(item_id)
+        if data is None:
+            return None
+        info = item_info_from_bnet(data)
+        self.put(item_id, info)
+        return info
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - run journal
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+import threading
+from collections import namedtuple, OrderedDict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+#: the stages a character goes through in a run, in order
+STAGES = ('simulated', 'mailed', 'cached')
+
+#: one recorded stage; ``data`` is only set for ``simulated``, and holds what
+#: is needed to send the character's reports again
+JournalEntry = namedtuple('JournalEntry', ['character', 'stage', 'data'])
+
+
+class RunJournal(object):
+
+    """
+    Append-only record of the stages (see :py:data:`STAGES`) each character
+    has completed in the current run, so that a run that was interrupted can
+    be resumed by the next one. Each entry is a pickle appended to ``path``
+    and synced to disk; a partially-written last entry is ignored. Safe to
+    use from multiple threads.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to the journal file
+        :type path: string
+        """
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record(self, character, stage, data=None):
+        """
+        Record that ``character`` has completed ``stage``.
+
+        :param character: character name in name@realm format
+        :type character: string
+        :param stage: one of :py:data:`STAGES`
+        :type stage: string
+        :param data: picklable data to keep with the entry
+        """
+        if stage not in STAGES:
+            raise ValueError("unknown stage '{s}'".format(s=stage))
+        with self.lock:
+            with open(self.path, 'ab') as fh:
+                pickle.dump(tuple(JournalEntry(character, stage, data)), fh,
+                            pickle.HIGHEST_PROTOCOL)
+                fh.flush()
+                os.fsync(fh.fileno())
+
+    def entries(self):
+        """
+        Return all complete entries, in the order they were recorded.
+
+        :rtype: list of :py:class:`JournalEntry`
+        """
+        if not os.path.exists(self.path):
+            return []
+        res = []
+        with self.lock:
+            with open(self.path, 'rb') as fh:
+                while True:
+                    try:
+                        res.append(JournalEntry(*pickle.load(fh)))
+                    except EOFError:
+                        break
+                    except (pickle.UnpicklingError, ValueError, TypeError, IndexError,
+                            AttributeError, ImportError):
+                        # written when the run was interrupted
+                        break
+        return res
+
+    def unfinished(self):
+        """
+        Return the characters that were simulated, but not cached (i.e. their
+        reports may not have been sent), with their completed stages and the
+        data recorded when they were simulated.
+
+        :rtype: collections.OrderedDict of character name to ``(set of stages, data)``
+        """
+        state = OrderedDict()
+        for entry in self.entries():
+            if entry.stage == 'simulated':
+                # a new simulation starts over
+                state.pop(entry.character, None)
+                state[entry.character] = (set([entry.stage]), entry.data)
+            elif entry.character in state:
+                state[entry.character][0].add(entry.stage)
+        return OrderedDict((c, v) for c, v in state.items() if 'cached' not in v[0])
+
+    def clear(self):
+        """ remove the journal, at the end of a complete run """
+        with self.lock:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - file locks
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+import errno
+import fcntl
+import urllib
+
+#: what a run does when another run holds the configuration directory lock:
+#: exit, wait for it to finish, or only simulate the characters the other
+#: run hasn't started
+LOCK_POLICIES = ('skip', 'wait', 'takeover')
+
+
+class FileLock(object):
+
+    """
+    Exclusive advisory (``flock``) lock on ``path``, which is created if
+    needed. The lock is released when the process exits, however it exits.
+    Can be used as a (blocking) context manager.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fh = None
+
+    @property
+    def locked(self):
+        return self.fh is not None
+
+    def acquire(self, blocking=True):
+        """
+        Acquire the lock; if ``blocking`` is False and it is held elsewhere,
+        return False instead of waiting for it.
+
+        :rtype: bool
+        """
+        fh = open(self.path, 'a')
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fh.fileno(), flags)
+        except IOError as ex:
+            fh.close()
+            if ex.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        self.fh = fh
+        return True
+
+    def release(self):
+        if self.fh is None:
+            return
+        fcntl.flock(self.fh.fileno(), fcntl.LOCK_UN)
+        self.fh.close()
+        self.fh = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class Claims(object):
+
+    """
+    Per-character claims, so that concurrent runs never simulate the same
+    character; each claim is a :py:class:`FileLock` on a file in ``path``,
+    held until :py:meth:`release_all`.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: claims directory; created on first use
+        :type path: string
+        """
+        self.path = path
+        self.locks = {}
+
+    def claim(self, name):
+        """
+        Claim ``name`` for this process; return False if another process
+        holds it.
+
+        :rtype: bool
+        """
+        if name in self.locks:
+            return True
+        try:
+            os.makedirs(self.path)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        lock = FileLock(os.path.join(self.path, urllib.quote(name, safe='@') + '.lock'))
+        if not lock.acquire(blocking=False):
+            return False
+        self.locks[name] = lock
+        return True
+
+    def release_all(self):
+        for lock in self.locks.values():
+            lock.release()
+        self.locks = {}
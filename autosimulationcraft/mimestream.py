@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - streaming MIME messages
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import uuid
+import base64
+import shutil
+import smtplib
+import urllib
+from StringIO import StringIO
+from email.header import Header
+
+from text import to_text
+
+# bytes of attachment read (and base64-encoded) at a time; a multiple of
+# 57, so that every chunk encodes to whole 76-character lines
+CHUNK_SIZE = 57 * 1024
+
+
+def _header(name, value):
+    """ format one header, RFC 2047-encoding it if it isn't ASCII """
+    try:
+        value.encode('ascii')
+    except UnicodeError:
+        value = Header(value, 'utf-8').encode()
+    return '{n}: {v}\n'.format(n=name, v=value)
+
+
+def _filename_param(filename):
+    """ the Content-Disposition filename parameter; RFC 2231-encoded if it isn't ASCII """
+    filename = to_text(filename)
+    try:
+        return 'filename="{f}"'.format(f=filename.encode('ascii'))
+    except UnicodeError:
+        return "filename*=utf-8''{f}".format(f=urllib.quote(filename.encode('utf-8'), safe=''))
+
+
+class StreamingMessage(object):
+
+    """
+    A multipart/mixed email that is serialized straight to a file-like
+    object by :py:meth:`write_to`, reading and base64-encoding its
+    attachments from disk :py:data:`CHUNK_SIZE` bytes at a time, instead of
+    being built in memory like :py:class:`email.mime.multipart.MIMEMultipart`.
+    """
+
+    def __init__(self, headers):
+        """
+        :param headers: ``(name, value)`` message headers, in order
+        :type headers: list
+        """
+        self.headers = list(headers)
+        self.boundary = '===============' + uuid.uuid4().hex + '=='
+        self.parts = []
+
+    def __getitem__(self, name):
+        for k, v in self.headers:
+            if k.lower() == name.lower():
+                return v
+        return None
+
+    def attach_text(self, text):
+        """ add a text/plain part (ASCII if possible, otherwise UTF-8) """
+        try:
+            self.parts.append(('text', text.encode('ascii'), 'us-ascii'))
+        except UnicodeError:
+            self.parts.append(('text', text.encode('utf-8'), 'utf-8'))
+
+    def attach_file(self, source, filename, subtype='octet-stream'):
+        """
+        Add an attachment, read when the message is written.
+
+        :param source: path to the file, or an open (seekable) file object
+        :param filename: attachment file name
+        :type filename: string
+        :param subtype: MIME subtype (of application/)
+        :type subtype: string
+        """
+        self.parts.append(('file', source, filename, subtype))
+
+    def attach_data(self, data, filename, subtype='octet-stream'):
+        """ add an attachment from a string """
+        self.parts.append(('file', StringIO(data), filename, subtype))
+
+    def write_to(self, out):
+        """ serialize the message to the file-like object ``out`` """
+        for name, value in self.headers:
+            out.write(_header(name, value))
+        out.write('MIME-Version: 1.0\n')
+        out.write('Content-Type: multipart/mixed; boundary="{b}"\n\n'.format(b=self.boundary))
+        for part in self.parts:
+            out.write('--{b}\n'.format(b=self.boundary))
+            if part[0] == 'text':
+                self._write_text(part[1], part[2], out)
+            else:
+                self._write_file(part[1], part[2], part[3], out)
+        out.write('--{b}--\n'.format(b=self.boundary))
+
+    def _write_text(self, data, charset, out):
+        out.write('Content-Type: text/plain; charset="{c}"\n'.format(c=charset))
+        if charset == 'us-ascii':
+            out.write('Content-Transfer-Encoding: 7bit\n\n')
+            out.write(data)
+            if not data.endswith('\n'):
+                out.write('\n')
+            return
+        out.write('Content-Transfer-Encoding: base64\n\n')
+        out.write(base64.encodestring(data))
+
+    def _write_file(self, source, filename, subtype, out):
+        out.write('Content-Type: application/{s}\n'.format(s=subtype))
+        out.write('Content-Transfer-Encoding: base64\n')
+        out.write('Content-Disposition: attachment; {p}\n'.format(p=_filename_param(filename)))
+        out.write('\n')
+        if isinstance(source, basestring):
+            with open(source, 'rb') as fh:
+                self._copy_base64(fh, out)
+        else:
+            source.seek(0)
+            self._copy_base64(source, out)
+
+    def _copy_base64(self, fh, out):
+        while True:
+            chunk = fh.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            out.write(base64.encodestring(chunk))
+
+    def as_string(self):
+        """ the whole serialized message; mostly for testing """
+        buf = StringIO()
+        self.write_to(buf)
+        return buf.getvalue()
+
+
+def write_message(msg, out):
+    """
+    Write a message to ``out``; ``msg`` may be a :py:class:`StreamingMessage`,
+    a string, or a file object (which is copied in chunks).
+    """
+    if hasattr(msg, 'write_to'):
+        msg.write_to(out)
+    elif isinstance(msg, basestring):
+        out.write(msg)
+    else:
+        shutil.copyfileobj(msg, out, CHUNK_SIZE)
+
+
+class DataWriter(object):
+
+    """
+    File-like object sending an SMTP ``DATA`` body to a socket as it is
+    written: converting line endings to CRLF, and dot-stuffing lines that
+    start with a ".". Call :py:meth:`close` to send the terminating ".".
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.bol = True
+
+    def write(self, data):
+        if not data:
+            return
+        lines = data.split('\n')
+        out = []
+        for i, line in enumerate(lines):
+            if i > 0:
+                out.append('\r\n')
+                self.bol = True
+            if i < len(lines) - 1 and line.endswith('\r'):
+                line = line[:-1]
+            if not line:
+                continue
+            if self.bol and line.startswith('.'):
+                out.append('.')
+            out.append(line)
+            self.bol = False
+        self.sock.sendall(''.join(out))
+
+    def close(self):
+        if not self.bol:
+            self.sock.sendall('\r\n')
+        self.sock.sendall('.\r\n')
+
+
+def send_message(smtp, from_addr, dest, msg):
+    """
+    Send one message over a connected :py:class:`smtplib.SMTP`, streaming
+    the message into the ``DATA`` command (see :py:func:`write_message` for
+    the types ``msg`` may be) instead of building it as one string like
+    :py:meth:`smtplib.SMTP.sendmail`.
+
+    :raises: smtplib.SMTPException
+    """
+    smtp.ehlo_or_helo_if_needed()
+    code, resp = smtp.mail(from_addr)
+    if code != 250:
+        smtp.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    code, resp = smtp.rcpt(dest)
+    if code not in (250, 251):
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused({dest: (code, resp)})
+    smtp.putcmd('data')
+    code, resp = smtp.getreply()
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    writer = DataWriter(smtp.sock)
+    write_message(msg, writer)
+    writer.close()
+    code, resp = smtp.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
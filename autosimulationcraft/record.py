@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - compact character records
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+from collections import namedtuple
+
+# one equipped item; ``bonus`` and ``gems`` are tuples of ids
+Item = namedtuple('Item', ['slot', 'id', 'bonus', 'enchant', 'gems', 'upgrade'])
+
+# record attributes built from each optional character API field
+FIELD_ATTRS = {
+    'appearance': ['appearance'],
+    'items': ['items', 'item_level'],
+    'professions': ['professions'],
+    'stats': ['stats'],
+    'talents': ['talents', 'spec', 'glyphs'],
+}
+
+
+def item_from_bnet(slot, data):
+    """
+    Build an :py:class:`Item` from a slot's Battlenet item data.
+
+    :param slot: Battlenet slot name, i.e. 'mainHand'
+    :type slot: string
+    :param data: Battlenet item data
+    :type data: dict
+    :rtype: Item
+    """
+    params = data.get('tooltipParams', {})
+    upgrade = None
+    if 'upgrade' in params:
+        upgrade = params['upgrade'].get('current', 0)
+    return Item(slot,
+                data['id'],
+                tuple(data.get('bonusLists', [])),
+                params.get('enchant', None),
+                tuple([params[g] for g in ['gem0', 'gem1', 'gem2'] if g in params]),
+                upgrade)
+
+
+class CharacterRecord(object):
+
+    """
+    The parts of a character's Battlenet data that are used for change
+    detection and simc profile generation, in a compact form; this is what
+    is stored in the character cache.
+
+    Everything is a scalar or a tuple; items are :py:class:`Item` tuples
+    in slot name order, and ``stats`` and ``appearance`` are sorted
+    ``(name, value)`` tuples. ``fetched`` is a dict of API field name (see
+    :py:data:`FIELD_ATTRS`) to the datetime it was last fetched; it is not
+    compared by ``==``.
+    """
+
+    __slots__ = ['name', 'realm', 'level', 'class_id', 'race_id', 'gender',
+                 'spec', 'talents', 'glyphs', 'professions', 'appearance',
+                 'item_level', 'items', 'stats', 'fetched']
+
+    def __init__(self, **kwargs):
+        for k in self.__slots__:
+            setattr(self, k, kwargs.get(k, None))
+        if self.fetched is None:
+            self.fetched = {}
+
+    @classmethod
+    def from_bnet(cls, data):
+        """
+        Build a record from Battlenet character data (as returned by the API,
+        or as stored in the character cache by older versions).
+
+        :param data: Battlenet character data
+        :type data: dict
+        :rtype: CharacterRecord
+        """
+        rec = cls(name=data.get('name'),
+                  realm=data.get('realm'),
+                  level=data.get('level'),
+                  class_id=data.get('class'),
+                  race_id=data.get('race'),
+                  gender=data.get('gender'),
+                  appearance=tuple(sorted(data.get('appearance', {}).items())),
+                  stats=tuple(sorted(data.get('stats', {}).items())),
+                  glyphs=(), talents='')
+        talents = data.get('talents', [])
+        selected = [t for t in talents if t.get('selected', False)]
+        if len(selected) == 0:
+            selected = talents
+        if len(selected) > 0:
+            rec.talents = selected[0].get('calcTalent', '')
+            if 'spec' in selected[0]:
+                rec.spec = selected[0]['spec']['name']
+            glyphs = selected[0].get('glyphs', {})
+            rec.glyphs = tuple([g['name'] for g in glyphs.get('major', []) + glyphs.get('minor', [])])
+        rec.professions = tuple([(p['name'], p['rank']) for p in
+                                 data.get('professions', {}).get('primary', [])])
+        items = data.get('items', {})
+        rec.item_level = items.get('averageItemLevelEquipped', None)
+        rec.items = tuple([item_from_bnet(slot, items[slot]) for slot in sorted(items)
+                           if isinstance(items[slot], dict)])
+        return rec
+
+    def as_dict(self):
+        """
+        Return a new (nested) dict representation of the record, for diffing.
+
+        :rtype: dict
+        """
+        items = {}
+        for i in self.items:
+            items[i.slot] = {'id': i.id,
+                             'bonusLists': list(i.bonus),
+                             'enchant': i.enchant,
+                             'gems': list(i.gems),
+                             'upgrade': i.upgrade}
+        return {'name': self.name,
+                'realm': self.realm,
+                'level': self.level,
+                'class': self.class_id,
+                'race': self.race_id,
+                'gender': self.gender,
+                'spec': self.spec,
+                'talents': self.talents,
+                'glyphs': list(self.glyphs),
+                'professions': dict(self.professions),
+                'appearance': dict(self.appearance),
+                'averageItemLevelEquipped': self.item_level,
+                'items': items,
+                'stats': dict(self.stats)}
+
+    def merge_fields(self, other, fields):
+        """
+        Copy the attributes for the given API fields from ``other``
+        (including when they were fetched).
+
+        :param other: record to copy from, i.e. the cached one
+        :type other: CharacterRecord
+        :param fields: API field names (keys of :py:data:`FIELD_ATTRS`)
+        :type fields: list
+        """
+        for field in fields:
+            for attr in FIELD_ATTRS[field]:
+                setattr(self, attr, getattr(other, attr))
+            if field in other.fetched:
+                self.fetched[field] = other.fetched[field]
+
+    def __getstate__(self):
+        return tuple([getattr(self, k) for k in self.__slots__])
+
+    def __setstate__(self, state):
+        self.fetched = {}
+        for k, v in zip(self.__slots__, state):
+            setattr(self, k, v)
+
+    def __eq__(self, other):
+        if not isinstance(other, CharacterRecord):
+            return False
+        return self.__getstate__()[:-1] == other.__getstate__()[:-1]
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return '<CharacterRecord {n!r}@{r!r}>'.format(n=self.name, r=self.realm)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - per-region Battlenet API connections
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import time
+import threading
+
+import battlenet
+
+# region names usable in settings, and the battlenet region they map to
+REGIONS = {
+    'us': battlenet.UNITED_STATES,
+    'eu': battlenet.EUROPE,
+    'kr': battlenet.KOREA,
+    'tw': battlenet.TAIWAN,
+}
+
+DEFAULT_REGION = 'us'
+
+
+class RateLimiter(object):
+
+    """
+    Thread-safe limiter spacing out calls to at most ``per_second`` per
+    second. A ``per_second`` of None means no limit.
+    """
+
+    def __init__(self, per_second=None):
+        self.interval = 0
+        if per_second:
+            self.interval = 1.0 / per_second
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def wait(self):
+        """ block until the next call is allowed """
+        if self.interval == 0:
+            return
+        with self.lock:
+            now = time.time()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RegionPool(object):
+
+    """
+    A Battlenet API connection and its rate limit budget for one region.
+    Each region gets its own, so that throttling in one region doesn't
+    hold up requests to another.
+    """
+
+    def __init__(self, region, connection, per_second=None):
+        self.region = region
+        self.bnet_region = REGIONS[region]
+        self.connection = connection
+        self.limiter = RateLimiter(per_second)
+
+    def throttle(self):
+        """ wait for this region's rate limit; call before each request """
+        self.limiter.wait()
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - record and replay of Battlenet API responses
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import re
+import gzip
+import json
+import time
+import random
+import hashlib
+import threading
+import urllib
+import urllib2
+import urlparse
+from StringIO import StringIO
+from mimetools import Message
+
+# character API paths, for ReplayTransport substitution
+CHARACTER_RE = re.compile(r'/character/[^/?]+/[^/?]+\?')
+
+
+def request_key(url):
+    """
+    Return the key recorded responses are matched on: the URL without its
+    ``fields`` parameter (with any other parameters sorted), and the set of
+    requested fields. Which fields are requested depends on what was stale
+    in the character cache, so a replayed run can ask for different fields
+    (or in a different order) than the recorded one.
+
+    :param url: request URL
+    :type url: string
+    :rtype: tuple of (string, frozenset)
+    """
+    base, _, query = url.partition('?')
+    params = []
+    fields = frozenset()
+    for k, v in urlparse.parse_qsl(query, keep_blank_values=True):
+        if k == 'fields':
+            fields = frozenset([f for f in v.split(',') if f != ''])
+        else:
+            params.append((k, v))
+    return (base + '?' + urllib.urlencode(sorted(params)), fields)
+
+
+def narrow(entry, recorded, fields):
+    """
+    Return ``entry`` (recorded with ``recorded`` fields) as if only ``fields``
+    had been requested, i.e. without the other fields in its body.
+    """
+    extra = recorded - fields
+    if len(extra) == 0 or entry['code'] != 200:
+        return entry
+    body = json.loads(entry['body'])
+    for field in extra:
+        body.pop(field, None)
+    entry = dict(entry)
+    entry['body'] = json.dumps(body)
+    return entry
+
+
+class Response(StringIO):
+
+    """ minimal urllib2 response for a recorded body """
+
+    def __init__(self, url, code, body, headers):
+        StringIO.__init__(self, body)
+        self.url = url
+        self.code = code
+        self.headers = Message(StringIO(''.join(
+            ['{k}: {v}\r\n'.format(k=k, v=v) for k, v in sorted(headers.items())])))
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+
+class Recorder(object):
+
+    """
+    Transport (for :py:class:`~.httpcache.CachingConnection`) that sends
+    requests with urllib2 and appends every response to a gzipped JSON-lines
+    archive, for later use by :py:class:`ReplayTransport`. Thread-safe;
+    call :py:meth:`close` when done.
+    """
+
+    # response headers kept in the archive
+    HEADERS = ['ETag', 'Last-Modified', 'Content-Type']
+
+    def __init__(self, path, opener=urllib2.urlopen):
+        """
+        :param path: archive file to write
+        :type path: string
+        :param opener: callable actually sending the request
+        :type opener: callable
+        """
+        self.path = path
+        self.opener = opener
+        self.lock = threading.Lock()
+        self.fh = gzip.open(path, 'wb')
+        self.count = 0
+
+    def record(self, url, code, body, headers):
+        line = json.dumps({'url': url, 'code': code, 'body': body, 'headers': headers})
+        with self.lock:
+            self.fh.write(line + '\n')
+            self.count += 1
+
+    def __call__(self, request):
+        url = request.get_full_url()
+        try:
+            response = self.opener(request)
+        except urllib2.HTTPError as ex:
+            self.record(url, ex.code, '', {})
+            raise
+        body = response.read()
+        info = response.info()
+        headers = dict([(h, info.getheader(h)) for h in self.HEADERS
+                        if info.getheader(h) is not None])
+        self.record(url, response.getcode(), body, headers)
+        return Response(url, response.getcode(), body, headers)
+
+    def close(self):
+        with self.lock:
+            self.fh.close()
+
+
+class ReplayTransport(object):
+
+    """
+    Transport (for :py:class:`~.httpcache.CachingConnection`) that answers
+    requests from an archive written by :py:class:`Recorder`, after a delay
+    of ``latency`` plus up to ``jitter`` seconds, failing a fraction
+    ``error_rate`` of requests with a URLError. Requests are matched with
+    :py:func:`request_key`, so a request for some of the fields of a
+    recorded one is answered from it. URLs not in the archive get a 404,
+    unless ``substitute`` is True and they are for a character, in which
+    case one of the recorded characters is returned (so that a larger
+    roster than was recorded can be fetched).
+    """
+
+    def __init__(self, path, latency=0.0, jitter=0.0, error_rate=0.0,
+                 substitute=False, seed=None, sleep=time.sleep):
+        """
+        :param path: archive file to read
+        :type path: string
+        :param latency: seconds to wait before every response
+        :type latency: float
+        :param jitter: maximum random seconds added to ``latency``
+        :type jitter: float
+        :param error_rate: fraction (0-1) of requests to fail
+        :type error_rate: float
+        :param substitute: answer unknown character URLs with recorded characters
+        :type substitute: Boolean
+        :param seed: random seed, for repeatable runs
+        :type seed: int
+        :param sleep: function used to wait
+        :type sleep: callable
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.substitute = substitute
+        self.sleep = sleep
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # request_key() base to {fields: entry}
+        self.responses = {}
+        self.characters = []
+        with gzip.open(path, 'rb') as fh:
+            for line in fh:
+                entry = json.loads(line)
+                base, fields = request_key(entry['url'])
+                self.responses.setdefault(base, {})[fields] = entry
+        for base in sorted(self.responses):
+            if not CHARACTER_RE.search(base):
+                continue
+            for fields, entry in sorted(self.responses[base].items(), key=lambda x: sorted(x[0])):
+                if entry['code'] == 200:
+                    self.characters.append((fields, entry))
+
+    def lookup(self, url):
+        """ return the archive entry to answer ``url`` with, or None """
+        base, fields = request_key(url)
+        recorded = self.responses.get(base, {})
+        if fields in recorded:
+            return recorded[fields]
+        # the smallest recording with all of the requested fields
+        supersets = sorted([f for f in recorded if f >= fields], key=lambda f: (len(f), sorted(f)))
+        if len(supersets) > 0:
+            return narrow(recorded[supersets[0]], supersets[0], fields)
+        if self.substitute and len(self.characters) > 0 and CHARACTER_RE.search(url):
+            idx = int(hashlib.sha1(base).hexdigest(), 16) % len(self.characters)
+            return narrow(self.characters[idx][1], self.characters[idx][0], fields)
+        return None
+
+    def __call__(self, request):
+        url = request.get_full_url()
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            fail = self.random.random() < self.error_rate
+        if delay > 0:
+            self.sleep(delay)
+        if fail:
+            raise urllib2.URLError('injected error')
+        entry = self.lookup(url)
+        if entry is None:
+            raise urllib2.HTTPError(url, 404, 'Not Found (not recorded)', {}, None)
+        if entry['code'] != 200:
+            raise urllib2.HTTPError(url, entry['code'], 'Recorded error', {}, None)
+        return Response(url, 200, entry['body'].encode('utf-8'), entry['headers'])
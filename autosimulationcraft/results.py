@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - simc JSON results parsing and storage
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import json
+import sqlite3
+from collections import namedtuple
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+#: scenario name for the results of the simulated profile itself (as
+#: opposed to its profilesets)
+BASELINE = 'baseline'
+
+#: exceptions :py:func:`read_results` may raise for a bad or missing file
+PARSE_ERRORS = (IOError, ValueError)
+if ijson is not None:
+    PARSE_ERRORS += (ijson.JSONError,)
+
+#: one simc run
+SimResult = namedtuple('SimResult', ['version', 'iterations', 'fight_style',
+                                     'elapsed', 'scenarios'])
+
+#: DPS for one scenario (the profile itself, or one of its profilesets)
+ScenarioResult = namedtuple('ScenarioResult', ['scenario', 'player', 'dps', 'dps_min',
+                                               'dps_max', 'dps_std_dev'])
+
+# json2 paths of the run-wide values, to SimResult fields
+SIM_FIELDS = {
+    'version': 'version',
+    'sim.options.iterations': 'iterations',
+    'sim.options.fight_style': 'fight_style',
+    'sim.statistics.elapsed_time_seconds': 'elapsed',
+}
+
+# json2 paths (under each player) to ScenarioResult fields
+PLAYER_PREFIX = 'sim.players.item'
+PLAYER_FIELDS = {
+    'sim.players.item.name': 'player',
+    'sim.players.item.collected_data.dps.mean': 'dps',
+    'sim.players.item.collected_data.dps.min': 'dps_min',
+    'sim.players.item.collected_data.dps.max': 'dps_max',
+    'sim.players.item.collected_data.dps.std_dev': 'dps_std_dev',
+}
+
+# json2 paths (under each profileset result) to ScenarioResult fields
+PROFILESET_PREFIX = 'sim.profilesets.results.item'
+PROFILESET_FIELDS = {
+    'sim.profilesets.results.item.name': 'scenario',
+    'sim.profilesets.results.item.mean': 'dps',
+    'sim.profilesets.results.item.min': 'dps_min',
+    'sim.profilesets.results.item.max': 'dps_max',
+    'sim.profilesets.results.item.stddev': 'dps_std_dev',
+}
+
+
+def _events(obj, prefix=''):
+    """
+    Generate ``(prefix, event, value)`` tuples for an already-loaded JSON
+    document, like ``ijson.parse()`` (only the events used by
+    :py:func:`parse_results`).
+    """
+    if isinstance(obj, dict):
+        yield (prefix, 'start_map', None)
+        for k, v in obj.items():
+            for e in _events(v, prefix + '.' + k if prefix else k):
+                yield e
+        yield (prefix, 'end_map', None)
+    elif isinstance(obj, list):
+        for v in obj:
+            for e in _events(v, prefix + '.item' if prefix else 'item'):
+                yield e
+    else:
+        yield (prefix, 'value', obj)
+
+
+def _number(value):
+    """ ijson returns Decimals; store floats """
+    if value is None:
+        return None
+    return float(value)
+
+
+def parse_results(events):
+    """
+    Build a :py:class:`SimResult` from the ``(prefix, event, value)`` events
+    of a simc ``json2`` report, only keeping the values we store.
+
+    :param events: JSON parse events
+    :type events: iterable
+    :rtype: SimResult
+    """
+    sim = dict([(f, None) for f in SimResult._fields])
+    scenarios = []
+    current = None
+    for prefix, event, value in events:
+        if prefix in (PLAYER_PREFIX, PROFILESET_PREFIX):
+            if event == 'start_map':
+                current = dict([(f, None) for f in ScenarioResult._fields])
+                if prefix == PLAYER_PREFIX:
+                    current['scenario'] = BASELINE
+            elif event == 'end_map':
+                scenarios.append(current)
+                current = None
+        elif prefix in PLAYER_FIELDS and current is not None:
+            current[PLAYER_FIELDS[prefix]] = value
+        elif prefix in PROFILESET_FIELDS and current is not None:
+            current[PROFILESET_FIELDS[prefix]] = value
+        elif prefix in SIM_FIELDS:
+            sim[SIM_FIELDS[prefix]] = value
+    # profilesets are variations of the (single) simulated player
+    players = [s['player'] for s in scenarios if s['scenario'] == BASELINE]
+    res = []
+    for s in scenarios:
+        if s['player'] is None and len(players) > 0:
+            s['player'] = players[0]
+        res.append(ScenarioResult(s['scenario'], s['player'], _number(s['dps']),
+                                  _number(s['dps_min']), _number(s['dps_max']),
+                                  _number(s['dps_std_dev'])))
+    sim['scenarios'] = res
+    if sim['iterations'] is not None:
+        sim['iterations'] = int(sim['iterations'])
+    sim['elapsed'] = _number(sim['elapsed'])
+    return SimResult(**sim)
+
+
+def read_results(path):
+    """
+    Read a simc ``json2`` report file. It is streamed with ijson if that is
+    installed; otherwise it is loaded with the json module.
+
+    :param path: path to the report
+    :type path: string
+    :rtype: SimResult
+    :raises: one of :py:data:`PARSE_ERRORS`
+    """
+    with open(path, 'rb') as fh:
+        if ijson is not None:
+            return parse_results(ijson.parse(fh))
+        return parse_results(_events(json.load(fh)))
+
+
+class ResultStore(object):
+
+    """
+    sqlite database of simulation results; one ``runs`` row per simc run
+    of a character, with one ``results`` row per scenario.
+    """
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS runs ('
+        'id INTEGER PRIMARY KEY, character TEXT NOT NULL, started TIMESTAMP NOT NULL, '
+        'duration REAL, simc_version TEXT, iterations INTEGER, fight_style TEXT, '
+        'elapsed REAL, error TEXT)',
+        'CREATE INDEX IF NOT EXISTS runs_character ON runs (character, started)',
+        'CREATE TABLE IF NOT EXISTS results ('
+        'run_id INTEGER NOT NULL REFERENCES runs (id), scenario TEXT NOT NULL, '
+        'player TEXT, dps REAL, dps_min REAL, dps_max REAL, dps_std_dev REAL)',
+        'CREATE INDEX IF NOT EXISTS results_run ON results (run_id, scenario)',
+        'CREATE INDEX IF NOT EXISTS results_scenario ON results (scenario)',
+    ]
+
+    def __init__(self, path):
+        """
+        :param path: path to the sqlite database (created if missing)
+        :type path: string
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+        with self.conn:
+            for stmt in self.SCHEMA:
+                self.conn.execute(stmt)
+
+    def add_run(self, character, started, duration, result=None, error=None):
+        """
+        Store one simc run.
+
+        :param character: character name in name@realm format
+        :type character: string
+        :param started: when the run started
+        :type started: datetime.datetime
+        :param duration: duration of the run, in seconds
+        :type duration: float
+        :param result: parsed results, if any
+        :type result: SimResult
+        :param error: error message, for failed runs
+        :type error: string
+        :returns: the run id
+        :rtype: int
+        """
+        if result is None:
+            result = SimResult(None, None, None, None, [])
+        with self.conn:
+            cur = self.conn.execute(
+                'INSERT INTO runs (character, started, duration, simc_version, iterations, '
+                'fight_style, elapsed, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (character, started, duration, result.version, result.iterations,
+                 result.fight_style, result.elapsed, error))
+            run_id = cur.lastrowid
+            self.conn.executemany(
+                'INSERT INTO results (run_id, scenario, player, dps, dps_min, dps_max, '
+                'dps_std_dev) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(run_id, ) + tuple(s) for s in result.scenarios])
+        return run_id
+
+    def history(self, character, scenario=BASELINE, limit=None):
+        """
+        Return ``(started, dps)`` for the successful runs of a character
+        (oldest first), for one scenario.
+
+        :param character: character name in name@realm format
+        :type character: string
+        :param scenario: scenario name
+        :type scenario: string
+        :param limit: only return this many of the most recent runs
+        :type limit: int
+        :rtype: list
+        """
+        sql = ('SELECT runs.started, results.dps FROM runs JOIN results '
+               'ON results.run_id = runs.id WHERE runs.character = ? AND results.scenario = ? '
+               'ORDER BY runs.started DESC')
+        params = (character, scenario)
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params += (limit, )
+        rows = self.conn.execute(sql, params).fetchall()
+        return list(reversed(rows))
+
+    def runs(self, character):
+        """
+        Return ``(id, started, duration, error)`` for all runs of a
+        character, oldest first.
+
+        :rtype: list
+        """
+        return self.conn.execute(
+            'SELECT id, started, duration, error FROM runs WHERE character = ? '
+            'ORDER BY started', (character, )).fetchall()
+
+    def rename_character(self, old, new):
+        """
+        Move all runs of character ``old`` to ``new``.
+
+        :returns: whether there were any runs to move
+        :rtype: bool
+        """
+        with self.conn:
+            cur = self.conn.execute('UPDATE runs SET character = ? WHERE character = ?', (new, old))
+        return cur.rowcount > 0
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - reading character rosters from data files
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+import csv
+import codecs
+import json
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+class RosterError(Exception):
+
+    """ raised when a roster file as a whole can't be read """
+    pass
+
+
+def iter_roster(path):
+    """
+    Iterate over the characters in a roster file, one row at a time.
+
+    The format is chosen by file extension:
+
+    - ``.csv`` - one character per row; the ``email`` column may hold several
+      addresses separated by ``;``, and ``options.<name>`` columns become
+      simc options.
+    - ``.jsonl`` - one JSON object per line.
+    - ``.json`` - a JSON list of objects.
+    - ``.yaml`` / ``.yml`` - a YAML list of mappings (requires PyYAML).
+
+    CSV and JSON-lines files are streamed. Yields ``(row_number, row, error)``
+    tuples; ``error`` is None if the row could be parsed, otherwise a string
+    describing the problem (and ``row`` is None).
+
+    :param path: path to the roster file
+    :type path: string
+    :raises: RosterError, IOError
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return _iter_csv(path)
+    if ext == '.jsonl':
+        return _iter_jsonl(path)
+    if ext == '.json':
+        return _iter_list(path, json.load)
+    if ext in ['.yaml', '.yml']:
+        if yaml is None:
+            raise RosterError("PyYAML must be installed to read YAML roster files")
+        return _iter_list(path, yaml.safe_load)
+    raise RosterError("unknown roster file type '{e}'".format(e=ext))
+
+
+def _open(path):
+    """ open a roster file, skipping the UTF-8 byte order mark Excel and others add """
+    fh = open(path, 'rb')
+    if fh.read(len(codecs.BOM_UTF8)) != codecs.BOM_UTF8:
+        fh.seek(0)
+    return fh
+
+
+def _iter_csv(path):
+    with _open(path) as fh:
+        # header is row 1
+        for rownum, raw in enumerate(csv.DictReader(fh), start=2):
+            if None in raw:
+                yield (rownum, None, 'more fields than header columns')
+                continue
+            yield (rownum, csv_row_to_character(raw), None)
+
+
+def csv_row_to_character(raw):
+    """
+    Convert a row from csv.DictReader to a character dict, in the same
+    format as a CHARACTERS entry in settings.py.
+
+    :param raw: row from csv.DictReader
+    :type raw: dict
+    :rtype: dict
+    """
+    char = {}
+    for k, v in raw.items():
+        v = v.strip() if v is not None else ''
+        if v == '':
+            continue
+        if k.startswith('options.'):
+            char.setdefault('options', {})[k[len('options.'):]] = v
+        elif k == 'email':
+            char['email'] = [e.strip() for e in v.split(';') if e.strip() != '']
+        else:
+            char[k] = v
+    return char
+
+
+def has_email(char):
+    """
+    Whether a character dict has at least one (non-empty) ``email`` address,
+    either as a string or a list of strings.
+
+    :param char: character dict
+    :type char: dict
+    :rtype: bool
+    """
+    emails = char.get('email', None)
+    if not isinstance(emails, (list, tuple)):
+        emails = [emails]
+    for e in emails:
+        if isinstance(e, basestring) and e.strip() != '':
+            return True
+    return False
+
+
+def _iter_jsonl(path):
+    with _open(path) as fh:
+        for rownum, line in enumerate(fh, start=1):
+            if line.strip() == '':
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as ex:
+                yield (rownum, None, 'invalid JSON: {e}'.format(e=ex))
+                continue
+            yield (rownum, row, None)
+
+
+def _iter_list(path, loader):
+    with _open(path) as fh:
+        try:
+            data = loader(fh)
+        except Exception as ex:
+            raise RosterError("unable to parse {p}: {e}".format(p=path, e=ex))
+    if not isinstance(data, list):
+        raise RosterError("{p} must contain a list of characters".format(p=path))
+    for rownum, row in enumerate(data, start=1):
+        yield (rownum, row, None)
@@ -40,11 +40,34 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 
 import sys
 import argparse
+import datetime
 import os
 
 from config import DEFAULT_CONFDIR
 from version import VERSION
 from autosimulationcraft import AutoSimulationCraft
+from replay import Recorder, ReplayTransport
+from history import DPSHistory
+from lock import LOCK_POLICIES
+
+
+def date_arg(s):
+    """ argparse type for YYYY-MM-DD dates """
+    try:
+        return datetime.datetime.strptime(s, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid date '{s}' (expected YYYY-MM-DD)".format(s=s))
+
+
+def positive_int(s):
+    """ argparse type for integers >= 1 """
+    try:
+        i = int(s)
+    except ValueError:
+        i = 0
+    if i < 1:
+        raise argparse.ArgumentTypeError("invalid value '{s}' (expected an integer >= 1)".format(s=s))
+    return i
 
 
 def parse_args(argv):
@@ -66,6 +89,51 @@ def parse_args(argv):
                    help='configuration directory (default: {c})'.format(c=DEFAULT_CONFDIR))
     p.add_argument('-s', '--no-stat', dest='no_stat', action='store_true', default=False,
                    help='ignore overall stats when determining if character changed')
+    p.add_argument('--offline', dest='offline', action='store_true', default=False,
+                   help='do not use the Battlenet API; re-simulate characters from '
+                   'the cached data')
+    p.add_argument('--lock-policy', dest='lock_policy', action='store', default=None,
+                   choices=LOCK_POLICIES,
+                   help='if another run is in progress, skip this run, wait for it to '
+                   'finish, or take over the characters it has not started (default: '
+                   'LOCK_POLICY setting, or skip)')
+    p.add_argument('--character', dest='characters', action='append', default=None,
+                   metavar='NAME@REALM',
+                   help='only run this character (realm without spaces, followed by '
+                   '".REGION" for characters outside the us region); may be '
+                   'specified multiple times')
+    p.add_argument('--record', dest='record', action='store', type=str, default=None,
+                   metavar='PATH',
+                   help='save every Battlenet API response to this archive')
+    p.add_argument('--replay', dest='replay', action='store', type=str, default=None,
+                   metavar='PATH',
+                   help='answer Battlenet API requests from this archive (from --record) '
+                   'instead of the real API')
+    p.add_argument('--replay-latency', dest='replay_latency', action='store', type=float,
+                   default=0.0, metavar='SECONDS',
+                   help='with --replay, delay every response by this long')
+    p.add_argument('--replay-jitter', dest='replay_jitter', action='store', type=float,
+                   default=0.0, metavar='SECONDS',
+                   help='with --replay, add a random delay of up to this long')
+    p.add_argument('--replay-error-rate', dest='replay_error_rate', action='store',
+                   type=float, default=0.0, metavar='FRACTION',
+                   help='with --replay, fail this fraction (0-1) of requests')
+    p.add_argument('--replay-substitute', dest='replay_substitute', action='store_true',
+                   default=False,
+                   help='with --replay, answer requests for characters not in the '
+                   'archive with recorded characters')
+    p.add_argument('--history', dest='history', action='store_true', default=False,
+                   help='print the DPS history of all characters (or the --character ones) '
+                   'and exit')
+    p.add_argument('--since', dest='since', action='store', type=date_arg, default=None,
+                   metavar='YYYY-MM-DD',
+                   help='with --history, only include runs on or after this date')
+    p.add_argument('--until', dest='until', action='store', type=date_arg, default=None,
+                   metavar='YYYY-MM-DD',
+                   help='with --history, only include runs before this date')
+    p.add_argument('--rolling', dest='rolling', action='store', type=positive_int, default=None,
+                   metavar='N',
+                   help='with --history, also list each run with the mean of the last N runs')
     p.add_argument('--genconfig', dest='genconfig', action='store_true', default=False,
                    help='generate a sample configuration file at configdir/settings.py')
     p.add_argument('--version', dest='version', action='store_true', default=False,
@@ -85,8 +153,29 @@ def console_entry_point():
         cpath = os.path.join(os.path.abspath(os.path.expanduser(args.confdir)), 'settings.py')
         print("Configuration file generated at: {c}".format(c=cpath))
         raise SystemExit()
-    script = AutoSimulationCraft(dry_run=args.dry_run, verbose=args.verbose, confdir=args.confdir)
-    script.run(no_stat=args.no_stat)
+    if args.history:
+        hpath = os.path.join(os.path.abspath(os.path.expanduser(args.confdir)), 'history')
+        report = DPSHistory(hpath).report(characters=args.characters, start=args.since,
+                                          end=args.until, window=args.rolling)
+        print(report.encode('utf-8'))
+        raise SystemExit()
+    transport = None
+    if args.record is not None:
+        transport = Recorder(args.record)
+    elif args.replay is not None:
+        transport = ReplayTransport(args.replay,
+                                    latency=args.replay_latency,
+                                    jitter=args.replay_jitter,
+                                    error_rate=args.replay_error_rate,
+                                    substitute=args.replay_substitute)
+    script = AutoSimulationCraft(dry_run=args.dry_run, verbose=args.verbose, confdir=args.confdir,
+                                 offline=args.offline, transport=transport,
+                                 lock_policy=args.lock_policy)
+    try:
+        script.run(no_stat=args.no_stat, only=args.characters)
+    finally:
+        if args.record is not None:
+            transport.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - generating simc profiles from Battlenet data
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import re
+
+# Battlenet class id to simc class token
+CLASSES = {
+    1: 'warrior',
+    2: 'paladin',
+    3: 'hunter',
+    4: 'rogue',
+    5: 'priest',
+    6: 'deathknight',
+    7: 'shaman',
+    8: 'mage',
+    9: 'warlock',
+    10: 'monk',
+    11: 'druid',
+}
+
+# Battlenet race id to simc race token
+RACES = {
+    1: 'human',
+    2: 'orc',
+    3: 'dwarf',
+    4: 'night_elf',
+    5: 'undead',
+    6: 'tauren',
+    7: 'gnome',
+    8: 'troll',
+    9: 'goblin',
+    10: 'blood_elf',
+    11: 'draenei',
+    22: 'worgen',
+    24: 'pandaren',
+    25: 'pandaren',
+    26: 'pandaren',
+}
+
+# (Battlenet item slot, simc item slot), in simc profile order
+SLOTS = [
+    ('head', 'head'),
+    ('neck', 'neck'),
+    ('shoulder', 'shoulders'),
+    ('back', 'back'),
+    ('chest', 'chest'),
+    ('shirt', 'shirt'),
+    ('tabard', 'tabard'),
+    ('wrist', 'wrists'),
+    ('hands', 'hands'),
+    ('waist', 'waist'),
+    ('legs', 'legs'),
+    ('feet', 'feet'),
+    ('finger1', 'finger1'),
+    ('finger2', 'finger2'),
+    ('trinket1', 'trinket1'),
+    ('trinket2', 'trinket2'),
+    ('mainHand', 'main_hand'),
+    ('offHand', 'off_hand'),
+]
+
+
+class ProfileError(Exception):
+
+    """ raised when Battlenet data can't be turned into a simc profile """
+    pass
+
+
+def tokenize(s):
+    """
+    Convert a name to simc's token format: lower case, spaces to
+    underscores, and anything else that isn't alphanumeric removed.
+
+    :param s: name to convert
+    :type s: string
+    :rtype: string
+    """
+    s = s.strip().lower().replace(' ', '_')
+    return re.sub(r'[^a-z0-9_]', '', s)
+
+
+def talents_string(calc_talent):
+    """
+    Convert Battlenet's ``calcTalent`` (one character per tier; the
+    selected column 0-2, or '.' for none) to a simc talents string
+    (one digit per tier; column 1-3, or 0 for none).
+
+    :param calc_talent: Battlenet calcTalent string
+    :type calc_talent: string
+    :rtype: string
+    """
+    s = ''
+    for c in calc_talent:
+        if c in '012':
+            s += str(int(c) + 1)
+        else:
+            s += '0'
+    return s
+
+
+def item_line(simc_slot, item):
+    """
+    Return the simc profile line for one equipped item.
+
+    :param simc_slot: simc slot name
+    :type simc_slot: string
+    :param item: the item
+    :type item: record.Item
+    :rtype: string
+    """
+    line = '{s}=,id={i}'.format(s=simc_slot, i=item.id)
+    if len(item.bonus) > 0:
+        line += ',bonus_id=' + '/'.join([str(b) for b in item.bonus])
+    if item.upgrade is not None:
+        line += ',upgrade={u}'.format(u=item.upgrade)
+    if len(item.gems) > 0:
+        line += ',gem_id=' + '/'.join([str(g) for g in item.gems])
+    if item.enchant is not None:
+        line += ',enchant_id={e}'.format(e=item.enchant)
+    return line
+
+
+def generate_profile(rec, region):
+    """
+    Generate a native simc character profile (the equivalent of what an
+    ``armory=`` import would produce) from a character record.
+
+    :param rec: the character's record
+    :type rec: record.CharacterRecord
+    :param region: the character's region, i.e. 'us'
+    :type region: string
+    :rtype: string
+    :raises: ProfileError
+    """
+    if rec.class_id not in CLASSES:
+        raise ProfileError("unknown class id {c}".format(c=rec.class_id))
+    lines = [u'{c}="{n}"'.format(c=CLASSES[rec.class_id], n=rec.name),
+             'level={l}'.format(l=rec.level)]
+    if rec.race_id in RACES:
+        lines.append('race={r}'.format(r=RACES[rec.race_id]))
+    lines.append('region={r}'.format(r=region))
+    lines.append(u'server={s}'.format(s=tokenize(rec.realm).replace('_', '')))
+    profs = [p for p in rec.professions if p[1] > 0]
+    if len(profs) > 0:
+        lines.append('professions=' + '/'.join(
+            ['{n}={r}'.format(n=tokenize(p[0]), r=p[1]) for p in profs]))
+    if rec.talents != '':
+        lines.append('talents=' + talents_string(rec.talents))
+    if len(rec.glyphs) > 0:
+        lines.append('glyphs=' + '/'.join(
+            [tokenize(re.sub(r'^Glyph of ', '', n)) for n in rec.glyphs]))
+    if rec.spec is not None:
+        lines.append('spec=' + tokenize(rec.spec))
+    lines.append('')
+    items = dict([(i.slot, i) for i in rec.items])
+    for bnet_slot, simc_slot in SLOTS:
+        if bnet_slot in items:
+            lines.append(item_line(simc_slot, items[bnet_slot]))
+    return '\n'.join(lines) + '\n'
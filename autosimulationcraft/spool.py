@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - outbound mail spool
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+import json
+import time
+import uuid
+import errno
+import socket
+import smtplib
+import threading
+from collections import namedtuple
+
+from mimestream import write_message
+
+#: a spooled message's delivery state (the message itself is kept in a
+#: separate file; see :py:meth:`MailSpool.message_path`)
+SpoolEntry = namedtuple('SpoolEntry', ['id', 'from_addr', 'dest', 'attempts',
+                                       'next_attempt', 'last_error'])
+
+#: exceptions that mean a delivery attempt failed and should be retried
+DELIVERY_ERRORS = (smtplib.SMTPException, socket.error, IOError)
+
+
+class MailSpool(object):
+
+    """
+    On-disk queue of outbound email in ``path``; each message is an
+    ``<id>.eml`` file holding the message, and an ``<id>.json`` file holding
+    its :py:class:`SpoolEntry`. Messages that can't be delivered are moved
+    to ``path/failed/``.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: spool directory; created when the first message is added
+        :type path: string
+        """
+        self.path = path
+
+    def message_path(self, msg_id):
+        return os.path.join(self.path, msg_id + '.eml')
+
+    def _entry_path(self, msg_id):
+        return os.path.join(self.path, msg_id + '.json')
+
+    def _write(self, path, msg):
+        tmppath = path + '.tmp'
+        with open(tmppath, 'wb') as fh:
+            write_message(msg, fh)
+        os.rename(tmppath, path)
+
+    def add(self, from_addr, dest, msg):
+        """
+        Add a message to the spool, due for delivery now.
+
+        :param from_addr: envelope sender
+        :type from_addr: string
+        :param dest: recipient
+        :type dest: string
+        :param msg: the message (see :py:func:`~.mimestream.write_message`);
+          it is streamed to disk
+        :type msg: mimestream.StreamingMessage
+        :returns: the new entry
+        :rtype: SpoolEntry
+        """
+        try:
+            os.makedirs(self.path)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        # ids sort in the order messages were added
+        msg_id = '{t:017d}-{u}'.format(t=int(time.time() * 1000000), u=uuid.uuid4().hex[:8])
+        entry = SpoolEntry(msg_id, from_addr, dest, 0, 0.0, None)
+        self._write(self.message_path(msg_id), msg)
+        # the entry is written last; until it exists, the message isn't queued
+        self.update(entry)
+        return entry
+
+    def update(self, entry):
+        """ write an entry's (new) delivery state """
+        self._write(self._entry_path(entry.id), json.dumps(entry._asdict()))
+
+    def entries(self):
+        """
+        Return all queued entries, the soonest due first.
+
+        :rtype: list
+        """
+        if not os.path.isdir(self.path):
+            return []
+        res = []
+        for fname in os.listdir(self.path):
+            if not fname.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.path, fname), 'rb') as fh:
+                    res.append(SpoolEntry(**json.load(fh)))
+            except (IOError, ValueError, TypeError):
+                # removed since listing, or not one of ours
+                continue
+        return sorted(res, key=lambda e: (e.next_attempt, e.id))
+
+    def __len__(self):
+        return len(self.entries())
+
+    def remove(self, entry):
+        """ remove a delivered message """
+        os.unlink(self._entry_path(entry.id))
+        os.unlink(self.message_path(entry.id))
+
+    def fail(self, entry):
+        """ move an undeliverable message (and its entry) to ``failed/`` """
+        failed = os.path.join(self.path, 'failed')
+        if not os.path.isdir(failed):
+            os.mkdir(failed)
+        os.rename(self.message_path(entry.id), os.path.join(failed, entry.id + '.eml'))
+        os.rename(self._entry_path(entry.id), os.path.join(failed, entry.id + '.json'))
+
+
+class MailSender(threading.Thread):
+
+    """
+    Background thread delivering the messages in a :py:class:`MailSpool`
+    with ``deliver(from_addr, dest, fh)``, ``fh`` being the open message file. Failed deliveries are retried
+    after ``retry_delay`` seconds, doubling for each further attempt (at most
+    :py:attr:`MAX_DELAY`), and given up on after ``max_attempts`` attempts.
+    Call :py:meth:`wake` after adding messages, and :py:meth:`stop` when done.
+    """
+
+    MAX_DELAY = 3600
+
+    def __init__(self, spool, deliver, logger, retry_delay=60, max_attempts=5,
+                 clock=time.time):
+        """
+        :param spool: the spool to deliver from
+        :type spool: MailSpool
+        :param deliver: callable sending one message
+        :type deliver: callable
+        :param logger: logger to report deliveries and failures to
+        :type logger: logging.Logger
+        :param retry_delay: seconds before the first retry
+        :type retry_delay: float
+        :param max_attempts: attempts before a message is moved to ``failed/``
+        :type max_attempts: int
+        :param clock: function returning the current time
+        :type clock: callable
+        """
+        super(MailSender, self).__init__(name='mail-sender')
+        self.daemon = True
+        self.spool = spool
+        self.deliver = deliver
+        self.logger = logger
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.cond = threading.Condition()
+        self.woken = False
+        self.deadline = None
+
+    def wake(self):
+        """ tell the sender that new messages were added """
+        with self.cond:
+            self.woken = True
+            self.cond.notify()
+
+    def stop(self, wait=0):
+        """
+        Deliver whatever is due, keep retrying failed messages for up to
+        ``wait`` seconds, and then stop; messages still undelivered stay in
+        the spool for the next run.
+
+        :param wait: maximum seconds to keep retrying for
+        :type wait: float
+        """
+        with self.cond:
+            self.deadline = self.clock() + wait
+            self.cond.notify()
+        self.join()
+
+    def backoff(self, attempts):
+        """ seconds to wait after the given number of failed attempts """
+        return min(self.retry_delay * (2 ** (attempts - 1)), self.MAX_DELAY)
+
+    def attempt(self, entry):
+        """ try to deliver one message, and update the spool """
+        try:
+            with open(self.spool.message_path(entry.id), 'rb') as fh:
+                self.deliver(entry.from_addr, entry.dest, fh)
+        except DELIVERY_ERRORS as ex:
+            attempts = entry.attempts + 1
+            if attempts >= self.max_attempts:
+                self.logger.error("Unable to send email to {d} after {n} attempts ({e}); "
+                                  "giving up".format(d=entry.dest, n=attempts, e=ex))
+                self.spool.fail(entry)
+                return
+            delay = self.backoff(attempts)
+            self.logger.warning("Unable to send email to {d} ({e}); will retry in {s} "
+                                "seconds".format(d=entry.dest, e=ex, s=delay))
+            self.spool.update(entry._replace(attempts=attempts,
+                                             next_attempt=self.clock() + delay,
+                                             last_error=str(ex)))
+            return
+        self.spool.remove(entry)
+        self.logger.debug("Sent email to {d}".format(d=entry.dest))
+
+    def run(self):
+        while True:
+            for entry in self.spool.entries():
+                if entry.next_attempt > self.clock():
+                    break
+                self.attempt(entry)
+            entries = self.spool.entries()
+            next_due = entries[0].next_attempt if len(entries) > 0 else None
+            with self.cond:
+                if self.woken:
+                    self.woken = False
+                    continue
+                if next_due is not None and next_due <= self.clock():
+                    continue
+                if self.deadline is not None and (next_due is None or next_due > self.deadline):
+                    return
+                self.cond.wait(None if next_due is None else next_due - self.clock())
+                self.woken = False
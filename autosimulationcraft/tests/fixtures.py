@@ -42,6 +42,8 @@ import pytest
 from mock import MagicMock, patch, Mock
 import battlenet
 import logging
+import threading
+import BaseHTTPServer
 from autosimulationcraft import autosimulationcraft
 
 
@@ -65,10 +67,11 @@ def mock_ns():
     def mock_eu_se(p):
         return p.replace('~/', '/home/user/')
 
-    with patch('autosimulationcraft.autosimulationcraft.battlenet.Connection', bn), \
+    with patch('autosimulationcraft.autosimulationcraft.AutoSimulationCraft.new_connection', bn), \
             patch('autosimulationcraft.autosimulationcraft.AutoSimulationCraft.read_config', rc), \
             patch('autosimulationcraft.autosimulationcraft.AutoSimulationCraft.load_character_cache',
                   lc) as lcc, \
+            patch('autosimulationcraft.autosimulationcraft.AutoSimulationCraft.load_item_store'), \
             patch('autosimulationcraft.autosimulationcraft.os.path.expanduser') as mock_eu, \
             patch('autosimulationcraft.autosimulationcraft.os.path.abspath') as mock_ap:
         mock_ap.side_effect = mock_ap_se
@@ -84,3 +87,91 @@ def mock_bnet_character(bnet_data):
                                       name='jantman',
                                       data=bnet_data)
     return char
+
+
+class FakeAPIHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """ stand-in for the Battlenet API; see the ``api`` fixture """
+
+    def do_GET(self):
+        srv = self.server
+        srv.requests.append((self.path, dict(self.headers)))
+        if self.path not in srv.responses:
+            self.send_response(404)
+            self.end_headers()
+            return
+        etag, body = srv.responses[self.path]
+        if etag is not None and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', 'Wed, 01 Jan 2014 00:00:00 GMT')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api(request):
+    """ a local HTTP server standing in for the Battlenet API """
+    srv = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FakeAPIHandler)
+    srv.requests = []
+    srv.responses = {}
+    t = threading.Thread(target=srv.serve_forever)
+    t.daemon = True
+    t.start()
+
+    def fin():
+        srv.shutdown()
+        srv.server_close()
+    request.addfinalizer(fin)
+    return srv
+
+
+class FakeS3Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """ stand-in for an S3-compatible object store; see the ``s3`` fixture """
+
+    def do_HEAD(self):
+        srv = self.server
+        srv.requests.append(('HEAD', self.path, dict(self.headers)))
+        self.send_response(200 if self.path in srv.objects else 404)
+        self.end_headers()
+
+    def do_PUT(self):
+        srv = self.server
+        srv.requests.append(('PUT', self.path, dict(self.headers)))
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if 'Authorization' not in self.headers:
+            self.send_response(403)
+            self.end_headers()
+            return
+        srv.objects[self.path] = (self.headers['Content-Type'], body)
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def s3(request):
+    """ a local HTTP server standing in for S3-compatible object storage """
+    srv = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FakeS3Handler)
+    srv.requests = []
+    srv.objects = {}
+    t = threading.Thread(target=srv.serve_forever)
+    t.daemon = True
+    t.start()
+
+    def fin():
+        srv.shutdown()
+        srv.server_close()
+    request.addfinalizer(fin)
+    return srv
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for archive module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import gzip
+import hashlib
+import datetime
+from StringIO import StringIO
+
+from autosimulationcraft.archive import ReportArchive
+
+
+def day(n):
+    return datetime.datetime(2014, 1, n)
+
+
+def test_add(tmpdir):
+    tmpdir.join('a.html').write('<html>' * 1000)
+    a = ReportArchive(str(tmpdir.join('archive')))
+    run = a.add('c@r', day(1), {'html': str(tmpdir.join('a.html')), 'log': StringIO('out')})
+    digest = hashlib.sha256('<html>' * 1000).hexdigest()
+    assert run.files == {'html': digest, 'log': hashlib.sha256('out').hexdigest()}
+    path = tmpdir.join('archive', digest[:2], digest + '.gz')
+    # stored compressed
+    assert path.size() < 200
+    assert gzip.open(str(path)).read() == '<html>' * 1000
+    assert a.open(digest).read() == '<html>' * 1000
+    assert a.history('c@r') == [run]
+    assert a.history('other@r') == []
+
+
+def test_dedupe(tmpdir):
+    """ identical files are stored once """
+    a = ReportArchive(str(tmpdir))
+    r1 = a.add('c@r', day(1), {'html': StringIO('same'), 'log': StringIO('log 1')})
+    r2 = a.add('d@r', day(2), {'html': StringIO('same'), 'log': StringIO('log 2')})
+    assert r1.files['html'] == r2.files['html']
+    assert len(a.objects) == 3
+    assert len(tmpdir.listdir(lambda p: p.isdir())) == 3
+
+
+def test_persist(tmpdir):
+    a = ReportArchive(str(tmpdir))
+    run = a.add('c@r', day(1), {'html': StringIO('x')})
+    b = ReportArchive(str(tmpdir))
+    assert b.history('c@r') == [run]
+    assert b.objects == a.objects
+
+
+def test_rename(tmpdir):
+    a = ReportArchive(str(tmpdir.join('archive')))
+    assert a.rename('c@r', 'c@r.eu') is False
+    run = a.add('c@r', day(1), {'html': StringIO('x')})
+    a.add('d@r', day(1), {'html': StringIO('y')})
+    assert a.rename('c@r', 'c@r.eu') is True
+    assert a.history('c@r') == []
+    assert ReportArchive(a.path).history('c@r.eu') == [run._replace(character='c@r.eu')]
+    assert a.rename('d@r', 'c@r.eu') is False
+
+
+def test_keep(tmpdir):
+    """ only the last ``keep`` runs of each character are kept """
+    a = ReportArchive(str(tmpdir), keep=2)
+    runs = [a.add('c@r', day(n), {'html': StringIO('html {n}'.format(n=n)),
+                                  'simc': StringIO('same input')}) for n in range(1, 4)]
+    other = a.add('d@r', day(1), {'html': StringIO('html 1')})
+    assert a.history('c@r') == runs[1:]
+    assert a.history('d@r') == [other]
+    # 'html 1' is still used by d@r
+    assert sorted(a.objects.keys()) == sorted([hashlib.sha256(c).hexdigest() for c in [
+        'html 1', 'html 2', 'html 3', 'same input']])
+    assert len(tmpdir.listdir(lambda p: p.isdir())) == 4
+
+
+def test_max_size(tmpdir):
+    """ least-recently-used files, and their runs, are evicted beyond max_size """
+    a = ReportArchive(str(tmpdir))
+    r1 = a.add('c@r', day(1), {'html': StringIO('one')})
+    r2 = a.add('d@r', day(1), {'html': StringIO('two')})
+    size = a.size
+    a.max_size = size
+    # reading r1's file makes r2's the least recently used
+    a.open(r1.files['html']).close()
+    r3 = a.add('e@r', day(1), {'html': StringIO('six')})
+    assert a.history('c@r') == [r1]
+    assert a.history('d@r') == []
+    assert a.history('e@r') == [r3]
+    assert a.size <= size
+    assert not tmpdir.join(r2.files['html'][:2], r2.files['html'] + '.gz').exists()
+    # the LRU order was saved
+    b = ReportArchive(str(tmpdir))
+    assert list(b.objects.keys()) == [r1.files['html'], r3.files['html']]
+
+
+def test_max_size_current_run(tmpdir):
+    """ the run being added is never evicted """
+    a = ReportArchive(str(tmpdir), max_size=1)
+    a.add('c@r', day(1), {'html': StringIO('one')})
+    run = a.add('c@r', day(2), {'html': StringIO('two')})
+    assert a.history('c@r') == [run]
+    assert list(a.objects.keys()) == [run.files['html']]
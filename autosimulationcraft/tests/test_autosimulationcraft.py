@@ -44,15 +44,30 @@ from mock import MagicMock, call, patch, Mock, mock_open
 import sys
 import os
 import datetime
+import json
 from copy import deepcopy
 import subprocess
-from email.mime.multipart import MIMEMultipart
-from base64 import b64decode
+import errno
+import threading
+import zipfile
+from StringIO import StringIO
+from email import message_from_string
+from email.header import decode_header
 
 from freezegun import freeze_time
 import battlenet
 
 from autosimulationcraft import autosimulationcraft
+from autosimulationcraft.record import CharacterRecord, Item
+from autosimulationcraft.chardiff import CharacterDiff, Change
+from autosimulationcraft.items import ItemStore, ItemInfo
+from autosimulationcraft.httpcache import CachingConnection
+from autosimulationcraft.results import SimResult, ScenarioResult
+from autosimulationcraft.digest import SimReport
+from autosimulationcraft.mimestream import StreamingMessage
+from autosimulationcraft.artifacts import ArtifactUploader
+from autosimulationcraft.journal import RunJournal
+from autosimulationcraft.lock import FileLock, Claims
 from data_fixtures import bnet_data, char_data
 from fixtures import Container, mock_ns, mock_bnet_character
 
@@ -80,9 +95,11 @@ class Test_AutoSimulationCraft:
         bn = MagicMock(spec_set=battlenet.Connection)
         rc = Mock()
         with patch('autosimulationcraft.autosimulationcraft.'
-                   'battlenet.Connection', bn), \
+                   'AutoSimulationCraft.new_connection', bn), \
                 patch('autosimulationcraft.autosimulationcraft.'
-                      'AutoSimulationCraft.read_config', rc):
+                      'AutoSimulationCraft.read_config', rc), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.load_item_store'):
             s = autosimulationcraft.AutoSimulationCraft(dry_run=False,
                                                         verbose=0,
                                                         confdir='~/.autosimulationcraft'
@@ -99,9 +116,11 @@ class Test_AutoSimulationCraft:
         bn = MagicMock(spec_set=battlenet.Connection)
         rc = Mock()
         with patch('autosimulationcraft.autosimulationcraft.'
-                   'battlenet.Connection', bn), \
+                   'AutoSimulationCraft.new_connection', bn), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.read_config', rc), \
                 patch('autosimulationcraft.autosimulationcraft.'
-                      'AutoSimulationCraft.read_config', rc):
+                      'AutoSimulationCraft.load_item_store'):
             s = autosimulationcraft.AutoSimulationCraft(logger=m)
         assert s.logger == m
 
@@ -110,20 +129,39 @@ class Test_AutoSimulationCraft:
         bn = MagicMock(spec_set=battlenet.Connection)
         rc = Mock()
         with patch('autosimulationcraft.autosimulationcraft.'
-                   'battlenet.Connection', bn), \
+                   'AutoSimulationCraft.new_connection', bn), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.read_config', rc), \
                 patch('autosimulationcraft.autosimulationcraft.'
-                      'AutoSimulationCraft.read_config', rc):
+                      'AutoSimulationCraft.load_item_store'):
             s = autosimulationcraft.AutoSimulationCraft(dry_run=True)
         assert s.dry_run is True
 
+    def test_init_offline(self):
+        """ test SimpleScript.init() with offline=True """
+        bn = MagicMock(spec_set=battlenet.Connection)
+        rc = Mock()
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.new_connection', bn), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.read_config', rc), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.load_item_store'):
+            s = autosimulationcraft.AutoSimulationCraft(offline=True)
+        assert s.offline is True
+        assert s.bnet is None
+        assert bn.mock_calls == []
+
     def test_init_verbose(self):
         """ test SimpleScript.init() with verbose=1 """
         bn = MagicMock(spec_set=battlenet.Connection)
         rc = Mock()
         with patch('autosimulationcraft.autosimulationcraft.'
-                   'battlenet.Connection', bn), \
+                   'AutoSimulationCraft.new_connection', bn), \
                 patch('autosimulationcraft.autosimulationcraft.'
-                      'AutoSimulationCraft.read_config', rc):
+                      'AutoSimulationCraft.read_config', rc), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.load_item_store'):
             s = autosimulationcraft.AutoSimulationCraft(verbose=1)
         assert s.logger.level == logging.INFO
 
@@ -132,9 +170,11 @@ class Test_AutoSimulationCraft:
         bn = MagicMock(spec_set=battlenet.Connection)
         rc = Mock()
         with patch('autosimulationcraft.autosimulationcraft.'
-                   'battlenet.Connection', bn), \
+                   'AutoSimulationCraft.new_connection', bn), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.read_config', rc), \
                 patch('autosimulationcraft.autosimulationcraft.'
-                      'AutoSimulationCraft.read_config', rc):
+                      'AutoSimulationCraft.load_item_store'):
             s = autosimulationcraft.AutoSimulationCraft(verbose=2)
         assert s.logger.level == logging.DEBUG
 
@@ -171,14 +211,188 @@ class Test_AutoSimulationCraft:
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.import_from_path') as mock_import, \
                 patch('autosimulationcraft.autosimulationcraft.'
-                      'AutoSimulationCraft.validate_config') as mock_validate:
+                      'AutoSimulationCraft.validate_config') as mock_validate, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.settings_cache_key') as mock_key, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.load_settings_cache') as mock_load, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.write_settings_cache') as mock_write:
             mock_path_exists.return_value = True
+            mock_key.return_value = 'mykey'
+            mock_load.return_value = None
             s.read_config('/foo')
         assert call(
             'Reading configuration from: /foo/settings.py') in mocklog.debug.call_args_list
         assert mock_import.call_args_list == [call('/foo/settings.py')]
         assert mock_path_exists.call_count == 1
         assert mock_validate.call_args_list == [call()]
+        assert mock_key.call_args_list == [call('/foo/settings.py')]
+        assert mock_load.call_args_list == [call('/foo/settings.pkl', 'mykey')]
+        assert mock_write.call_args_list == [call('/foo/settings.pkl', 'mykey')]
+
+    def test_read_config_cached(self, mock_ns):
+        """ test read_config() with valid settings cache """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        cached = Container()
+        setattr(cached, 'CHARACTERS', ['foo'])
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'os.path.exists') as mock_path_exists, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.import_from_path') as mock_import, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.validate_config') as mock_validate, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.settings_cache_key') as mock_key, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.load_settings_cache') as mock_load, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.write_settings_cache') as mock_write:
+            mock_path_exists.return_value = True
+            mock_key.return_value = 'mykey'
+            mock_load.return_value = cached
+            s.read_config('/foo')
+        assert s.settings == cached
+        assert mock_import.call_args_list == []
+        assert mock_validate.call_args_list == []
+        assert mock_write.call_args_list == []
+
+    def test_read_config_cache_disabled(self, mock_ns):
+        """ test read_config() with CACHE_SETTINGS = False """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTERS', [])
+        setattr(mock_settings, 'CACHE_SETTINGS', False)
+        setattr(s, 'settings', mock_settings)
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'os.path.exists') as mock_path_exists, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.import_from_path') as mock_import, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.validate_config'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.settings_cache_key'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.load_settings_cache') as mock_load, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.write_settings_cache') as mock_write:
+            mock_path_exists.return_value = True
+            mock_load.return_value = None
+            s.read_config('/foo')
+        assert mock_import.call_args_list == [call('/foo/settings.py')]
+        assert mock_write.call_args_list == []
+
+    def test_settings_cache_key(self, mock_ns, tmpdir):
+        """ test settings_cache_key() changes with file content """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        conf = tmpdir.join('settings.py')
+        conf.write("FOO = 'bar'\n")
+        key1 = s.settings_cache_key(str(conf))
+        assert key1 == s.settings_cache_key(str(conf))
+        conf.write("FOO = 'baz'\n")
+        assert s.settings_cache_key(str(conf)) != key1
+
+    def test_settings_cache_key_format(self, mock_ns, tmpdir):
+        """ test settings_cache_key() changes with the cache format and version """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        conf = tmpdir.join('settings.py')
+        conf.write("FOO = 'bar'\n")
+        key = s.settings_cache_key(str(conf))
+        assert key[:2] == (2, s.VERSION)
+        s.settings = Container()
+        setattr(s.settings, 'FOO', 'bar')
+        cachepath = str(tmpdir.join('settings.cache'))
+        s.write_settings_cache(cachepath, (1,) + key[1:])
+        assert s.load_settings_cache(cachepath, key) is None
+        s.VERSION = '0.0.2'
+        assert s.settings_cache_key(str(conf)) != key
+
+    def test_settings_cache_roundtrip(self, mock_ns, tmpdir):
+        """ test write_settings_cache() then load_settings_cache() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTERS', [{'name': 'n', 'realm': 'r'}])
+        setattr(mock_settings, 'GLOBAL_OPTIONS', {'threads': 2})
+        setattr(mock_settings, 'lowercase', 'ignored')
+        setattr(mock_settings, '_private', 'ignored')
+        s.settings = mock_settings
+        cachepath = str(tmpdir.join('settings.pkl'))
+        s.write_settings_cache(cachepath, ('k', 1))
+        assert oct(os.stat(cachepath).st_mode & 0o777) == oct(0o600)
+        res = s.load_settings_cache(cachepath, ('k', 1))
+        assert res.CHARACTERS == [{'name': 'n', 'realm': 'r'}]
+        assert res.GLOBAL_OPTIONS == {'threads': 2}
+        assert not hasattr(res, 'lowercase')
+        assert not hasattr(res, '_private')
+        assert s.load_settings_cache(cachepath, ('k', 2)) is None
+
+    def test_load_settings_cache_missing(self, mock_ns, tmpdir):
+        """ test load_settings_cache() with no cache file """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        cachepath = str(tmpdir.join('settings.pkl'))
+        assert s.load_settings_cache(cachepath, 'foo') is None
+
+    def test_load_settings_cache_corrupt(self, mock_ns, tmpdir):
+        """ test load_settings_cache() with an unreadable cache file """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        cachepath = tmpdir.join('settings.pkl')
+        cachepath.write('not a pickle')
+        assert s.load_settings_cache(str(cachepath), 'foo') is None
+        assert mocklog.warning.call_args_list == [
+            call("Unable to read settings cache {p}; "
+                 "re-importing settings".format(p=str(cachepath)))]
+
+    def test_write_settings_cache_unpicklable(self, mock_ns, tmpdir):
+        """ test write_settings_cache() with settings that can't be pickled """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTERS', [])
+        setattr(mock_settings, 'HANDLE', lambda x: x)
+        s.settings = mock_settings
+        cachepath = tmpdir.join('settings.pkl')
+        s.write_settings_cache(str(cachepath), 'foo')
+        assert not cachepath.check()
+        assert mocklog.info.call_count == 1
+
+    def test_normalize_config(self, mock_ns):
+        """ test normalize_config() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTERS', [
+            {'name': 'a', 'realm': 'r', 'email': 'a@example.com'},
+            {'name': 'b', 'realm': 'r', 'email': ('b@example.com', 'c@example.com')},
+            {'name': 'c', 'realm': 'r', 'email': ['c@example.com']},
+            {'name': 'd', 'realm': 'r'},
+            'notadict',
+        ])
+        s.settings = mock_settings
+        s.normalize_config()
+        assert mock_settings.CHARACTERS == [
+            {'name': 'a', 'realm': 'r', 'email': ['a@example.com'], 'region': 'us'},
+            {'name': 'b', 'realm': 'r', 'email': ['b@example.com', 'c@example.com'], 'region': 'us'},
+            {'name': 'c', 'realm': 'r', 'email': ['c@example.com'], 'region': 'us'},
+            {'name': 'd', 'realm': 'r', 'region': 'us'},
+            'notadict',
+        ]
+
+    def test_normalize_config_region(self, mock_ns):
+        """ test normalize_config() with DEFAULT_REGION and GUILDS """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'DEFAULT_REGION', 'eu')
+        setattr(mock_settings, 'CHARACTERS', [
+            {'name': 'a', 'realm': 'r'},
+            {'name': 'b', 'realm': 'r', 'region': 'US'},
+        ])
+        setattr(mock_settings, 'GUILDS', [{'name': 'g', 'realm': 'r', 'email': 'g@example.com'}])
+        s.settings = mock_settings
+        s.normalize_config()
+        assert mock_settings.CHARACTERS == [
+            {'name': 'a', 'realm': 'r', 'region': 'eu'},
+            {'name': 'b', 'realm': 'r', 'region': 'us'},
+        ]
+        assert mock_settings.GUILDS == [
+            {'name': 'g', 'realm': 'r', 'email': ['g@example.com'], 'region': 'eu'}]
 
     def test_genconfig(self):
         """ test gen_config() """
@@ -259,6 +473,233 @@ class Test_AutoSimulationCraft:
         s.validate_config()
         assert mocklog.error.call_args_list == []
 
+    def test_validate_config_character_files(self, mock_ns):
+        """ test validate_config() with CHARACTER_FILES and no CHARACTERS """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTER_FILES', ['roster.csv'])
+        setattr(s, 'settings', mock_settings)
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.load_character_files') as mock_lcf:
+            mock_lcf.return_value = [{'name': 'n', 'realm': 'r'}]
+            s.validate_config()
+        assert mock_settings.CHARACTERS == [{'name': 'n', 'realm': 'r'}]
+        assert mocklog.error.call_args_list == []
+
+    def test_validate_config_character_files_combined(self, mock_ns):
+        """ test validate_config() with CHARACTER_FILES and CHARACTERS """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTERS', [{'name': 'a', 'realm': 'r'}])
+        setattr(mock_settings, 'CHARACTER_FILES', 'roster.csv')
+        setattr(s, 'settings', mock_settings)
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.load_character_files') as mock_lcf:
+            mock_lcf.return_value = [{'name': 'b', 'realm': 'r'}]
+            s.validate_config()
+        assert mock_settings.CHARACTERS == [{'name': 'a', 'realm': 'r'},
+                                            {'name': 'b', 'realm': 'r'}]
+
+    def test_validate_config_character_files_empty(self, mock_ns):
+        """ test validate_config() with CHARACTER_FILES with no valid characters """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTER_FILES', ['roster.csv'])
+        setattr(s, 'settings', mock_settings)
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.load_character_files') as mock_lcf:
+            mock_lcf.return_value = []
+            with pytest.raises(SystemExit) as excinfo:
+                s.validate_config()
+        assert excinfo.value.code == 1
+        assert mocklog.error.call_args_list == [
+            call("ERROR: Settings file must define CHARACTERS list with at least one character")]
+
+    def test_validate_config_guilds(self, mock_ns):
+        """ test validate_config() with only GUILDS """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'GUILDS', [{'realm': 'r', 'name': 'g', 'email': 'g@example.com'}])
+        setattr(s, 'settings', mock_settings)
+        s.validate_config()
+        assert mock_settings.CHARACTERS == []
+        assert mocklog.error.call_args_list == []
+
+    def test_validate_config_guilds_invalid(self, mock_ns):
+        """ test validate_config() with an invalid GUILDS entry """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'GUILDS', [{'realm': 'r'}])
+        setattr(s, 'settings', mock_settings)
+        with pytest.raises(SystemExit) as excinfo:
+            s.validate_config()
+        assert excinfo.value.code == 1
+        assert mocklog.error.call_args_list == [
+            call("ERROR: each GUILDS entry must be a dict with 'realm' and 'name'")]
+
+    def test_validate_config_guilds_no_email(self, mock_ns):
+        """ test validate_config() with a GUILDS entry without an email """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'GUILDS', [{'realm': 'r', 'name': 'g', 'email': 'g@example.com'},
+                                          {'realm': 'r', 'name': 'h', 'email': []}])
+        setattr(s, 'settings', mock_settings)
+        with pytest.raises(SystemExit) as excinfo:
+            s.validate_config()
+        assert excinfo.value.code == 1
+        assert mocklog.error.call_args_list == [
+            call("ERROR: GUILDS entry for guild 'h' must have an 'email' to send its "
+                 "members' reports to")]
+
+    def test_validate_config_bad_region(self, mock_ns):
+        """ test validate_config() with an unknown DEFAULT_REGION """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTERS', [{'realm': 'r', 'name': 'n'}])
+        setattr(mock_settings, 'DEFAULT_REGION', 'xx')
+        setattr(s, 'settings', mock_settings)
+        with pytest.raises(SystemExit) as excinfo:
+            s.validate_config()
+        assert excinfo.value.code == 1
+        assert mocklog.error.call_args_list == [
+            call("ERROR: unknown region 'xx'; must be one of: eu, kr, tw, us")]
+
+    def test_validate_config_bad_lock_policy(self, mock_ns):
+        """ test validate_config() with an invalid LOCK_POLICY """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTERS', [{'realm': 'r', 'name': 'n'}])
+        setattr(mock_settings, 'LOCK_POLICY', 'never')
+        setattr(s, 'settings', mock_settings)
+        with pytest.raises(SystemExit) as excinfo:
+            s.validate_config()
+        assert excinfo.value.code == 1
+        assert mocklog.error.call_args_list == [
+            call("ERROR: LOCK_POLICY must be one of: skip, wait, takeover")]
+
+    def test_validate_config_bad_artifact_backend(self, mock_ns):
+        """ test validate_config() with an invalid ARTIFACT_BACKEND """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTERS', [{'realm': 'r', 'name': 'n'}])
+        setattr(mock_settings, 'ARTIFACT_BACKEND', {'type': 'directory'})
+        setattr(s, 'settings', mock_settings)
+        with pytest.raises(SystemExit) as excinfo:
+            s.validate_config()
+        assert excinfo.value.code == 1
+        assert mocklog.error.call_args_list == [
+            call("ERROR: invalid ARTIFACT_BACKEND: 'directory' backend needs a 'path'")]
+
+    def test_load_character_files(self, mock_ns, tmpdir):
+        """ test load_character_files() skipping invalid rows """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        tmpdir.join('roster.csv').write("realm,name,email\nr,one,a@b\n,noname,a@b\nr,two,a@b;c@d\n"
+                                        "r,noemail,\nr,noemail2, ; \n")
+        tmpdir.join('roster.jsonl').write('{"realm": "r", "name": "three", "email": "a@b"}\n["bad"]\n'
+                                          '{"realm": "r", "name": "four"}\n'
+                                          '{"realm": "r", "name": "five", "email": [""]}\n')
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTER_FILES', ['roster.csv', 'roster.jsonl'])
+        s.settings = mock_settings
+        s.confdir = str(tmpdir)
+        res = s.load_character_files()
+        assert res == [{'realm': 'r', 'name': 'one', 'email': ['a@b']},
+                       {'realm': 'r', 'name': 'two', 'email': ['a@b', 'c@d']},
+                       {'realm': 'r', 'name': 'three', 'email': 'a@b'}]
+        csv_path = str(tmpdir.join('roster.csv'))
+        jsonl_path = str(tmpdir.join('roster.jsonl'))
+        assert mocklog.warning.call_args_list == [
+            call("Skipping invalid character in {p} row 3: character must be a dict "
+                 "with 'realm' and 'name'".format(p=csv_path)),
+            call("Skipping invalid character in {p} row 5: missing or empty "
+                 "'email'".format(p=csv_path)),
+            call("Skipping invalid character in {p} row 6: missing or empty "
+                 "'email'".format(p=csv_path)),
+            call("Skipping invalid character in {p} row 2: character must be a dict "
+                 "with 'realm' and 'name'".format(p=jsonl_path)),
+            call("Skipping invalid character in {p} row 3: missing or empty "
+                 "'email'".format(p=jsonl_path)),
+            call("Skipping invalid character in {p} row 4: missing or empty "
+                 "'email'".format(p=jsonl_path)),
+        ]
+        assert s.config_sources == [str(tmpdir.join('roster.csv')),
+                                    str(tmpdir.join('roster.jsonl'))]
+
+    def test_load_character_files_non_ascii(self, mock_ns, tmpdir):
+        """ test load_character_files() with non-ASCII names, in str and unicode """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        tmpdir.join('roster.csv').write('\xef\xbb\xbfrealm,name,email\n'
+                                        'Area 52,J\xc3\xa4ntman,a@b\n', 'wb')
+        tmpdir.join('roster.jsonl').write('{"realm": "Area 52", "name": "\\u00c6llaria", '
+                                          '"email": "a@b"}\n'
+                                          '{"realm": "r", "name": 5, "email": "a@b"}\n')
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTER_FILES', ['roster.csv', 'roster.jsonl'])
+        setattr(mock_settings, 'CHARACTERS', [])
+        s.settings = mock_settings
+        s.confdir = str(tmpdir)
+        s.validate_config()
+        s.normalize_config()
+        chars = s.characters_to_run()
+        assert [s.character_name(c) for c in chars] == [
+            'J\xc3\xa4ntman@Area52', '\xc3\x86llaria@Area52']
+        assert all(isinstance(c['name'], str) for c in chars)
+        s.migrate_character_keys(chars)
+        assert mocklog.warning.call_args_list == [
+            call("Skipping invalid character in {p} row 2: character must be a dict "
+                 "with 'realm' and 'name'".format(p=str(tmpdir.join('roster.jsonl'))))]
+
+    def test_load_character_files_region_case(self, mock_ns, tmpdir):
+        """ test load_character_files() with upper-case regions, as in settings """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        tmpdir.join('roster.csv').write("realm,name,email,region\nr,one,a@b,EU\nr,two,a@b,Us\n"
+                                        "r,three,a@b,XX\n")
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTER_FILES', ['roster.csv'])
+        setattr(mock_settings, 'CHARACTERS', [{'name': 'four', 'realm': 'r', 'region': 'EU'}])
+        setattr(mock_settings, 'DEFAULT_REGION', 'US')
+        setattr(mock_settings, 'API_RATE_LIMITS', {'EU': 10})
+        s.settings = mock_settings
+        s.confdir = str(tmpdir)
+        s.validate_config()
+        s.normalize_config()
+        assert [(c['name'], c['region']) for c in mock_settings.CHARACTERS] == [
+            ('four', 'eu'), ('one', 'eu'), ('two', 'us')]
+        assert [s.character_name(c) for c in mock_settings.CHARACTERS] == [
+            'four@r.eu', 'one@r.eu', 'two@r']
+        assert mock_settings.DEFAULT_REGION == 'us'
+        assert mock_settings.API_RATE_LIMITS == {'eu': 10}
+        assert mocklog.warning.call_args_list == [
+            call("Skipping invalid character in {p} row 4: character must be a dict "
+                 "with 'realm' and 'name'".format(p=str(tmpdir.join('roster.csv'))))]
+
+    def test_load_character_files_missing(self, mock_ns, tmpdir):
+        """ test load_character_files() with a missing file """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTER_FILES', ['roster.csv'])
+        s.settings = mock_settings
+        s.confdir = str(tmpdir)
+        with pytest.raises(SystemExit) as excinfo:
+            s.load_character_files()
+        assert excinfo.value.code == 1
+        assert mocklog.error.call_count == 1
+
+    def test_settings_cache_sources_changed(self, mock_ns, tmpdir):
+        """ test load_settings_cache() when a character file changed """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        roster = tmpdir.join('roster.csv')
+        roster.write("realm,name\nr,one\n")
+        mock_settings = Container()
+        setattr(mock_settings, 'CHARACTERS', [{'name': 'one', 'realm': 'r'}])
+        s.settings = mock_settings
+        s.config_sources = [str(roster)]
+        cachepath = str(tmpdir.join('settings.pkl'))
+        s.write_settings_cache(cachepath, 'key')
+        assert s.load_settings_cache(cachepath, 'key') is not None
+        roster.write("realm,name\nr,one\nr,two\n")
+        assert s.load_settings_cache(cachepath, 'key') is None
+
     @pytest.mark.skipif(
         sys.version_info >= (3, 3), reason="requires python < 3.3")
     def test_import_from_path_py27(self, mock_ns):
@@ -335,6 +776,26 @@ class Test_AutoSimulationCraft:
             call("'name' not in char dict")]
         assert result is False
 
+    def test_validate_character_bad_region(self, mock_ns):
+        """ test validate_character() with an unknown region """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        char = {'realm': 'rname', 'name': 'cname', 'region': 'xx'}
+        mocklog.debug.reset_mock()
+        result = s.validate_character(char)
+        assert mocklog.debug.call_args_list == [
+            call("unknown region in char dict")]
+        assert result is False
+
+    def test_validate_character_bad_priority(self, mock_ns):
+        """ test validate_character() with a non-numeric priority """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        char = {'realm': 'rname', 'name': 'cname', 'priority': 'high'}
+        mocklog.debug.reset_mock()
+        result = s.validate_character(char)
+        assert mocklog.debug.call_args_list == [
+            call("'priority' in char dict is not a number")]
+        assert result is False
+
     def test_run(self, mock_ns):
         """ test run() in ideal/working situation """
         bn, rc, mocklog, s, conn, lcc = mock_ns
@@ -348,7 +809,19 @@ class Test_AutoSimulationCraft:
         setattr(s, 'character_cache', ccache)
         mocklog.debug.reset_mock()
         with patch('autosimulationcraft.autosimulationcraft.'
-                   'AutoSimulationCraft.validate_character') as mock_validate, \
+                   'AutoSimulationCraft.resume_mail') as mock_rm, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.resume_run') as mock_rr, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.lock_run'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.claim_character'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.migrate_character_keys'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.finish_mail') as mock_fm, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.validate_character') as mock_validate, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.get_battlenet') as mock_get_bnet, \
                 patch('autosimulationcraft.autosimulationcraft.'
@@ -356,26 +829,205 @@ class Test_AutoSimulationCraft:
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.character_has_changes') as mock_chc, \
                 patch('autosimulationcraft.autosimulationcraft.'
-                      'AutoSimulationCraft.write_character_cache') as mock_wcc:
-            mock_chc.return_value = 'foo'
+                      'AutoSimulationCraft.write_character_cache') as mock_wcc, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.write_sim_history') as mock_wsh:
+            mock_chc.return_value = CharacterDiff.note('foo')
             mock_validate.return_value = True
             mock_get_bnet.return_value = {'foo': 'bar'}
+            mock_do_char.return_value = True
             s.run()
+            # only cached once the reports are sent
+            assert mock_wcc.call_args_list == []
+            assert ccache == {}
+            s.report_sent('nameone@realmone')
         assert mocklog.debug.call_args_list == [
-            call("Doing character: nameone@realmone")]
+            call("Doing character: nameone@realmone"),
+            call("Simulating nameone@realmone (priority 31.0)")]
         assert mock_validate.call_args_list == [call(chars[0])]
-        assert mock_get_bnet.call_args_list == [call('realmone', 'nameone')]
+        assert mock_get_bnet.call_args_list == [call('realmone', 'nameone', region='us')]
         assert mock_do_char.call_args_list == [
             call(
                 'nameone@realmone',
                 chars[0],
-                'foo')]
+                CharacterDiff.note('foo'),
+                {'foo': 'bar'})]
         assert mock_chc.call_args_list == [
             call(
                 'nameone@realmone', {
                     'foo': 'bar'}, no_stat=False)]
         assert mock_wcc.call_args_list == [call()]
+        assert mock_wsh.call_args_list == [call()]
         assert ccache == {'nameone@realmone': {'foo': 'bar'}}
+        assert mock_rm.call_args_list == [call()]
+        assert mock_rr.call_args_list == [call()]
+        assert mock_fm.call_args_list == [call()]
+        assert s.pending_cache == {}
+
+    def test_run_non_ascii_guild_member(self, mock_ns, tmpdir):
+        """ test run() with a non-ASCII guild member name from the API """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s_container = Container()
+        setattr(s_container, 'CHARACTERS', [])
+        guild = {'name': 'g', 'realm': 'Area 52', 'region': 'us', 'email': ['g@example.com']}
+        setattr(s_container, 'GUILDS', [guild])
+        setattr(s_container, 'MAIL_SPOOL', False)
+        s.settings = s_container
+        s.confdir = str(tmpdir)
+        s.claims = Claims(str(tmpdir.join('claims')))
+        s.character_cache = {}
+        member = {'name': u'\xc6llaria', 'realm': u'Area 52', 'level': 100}
+        conn.get_guild.return_value = {'members': [{'character': member, 'rank': 0}]}
+        cname = '\xc3\x86llaria@Area52'
+        diff = CharacterDiff.note(u'Equipped \xc6gis')
+
+        def se_do_char(c_name, char, c_diff, bnet_info):
+            html = tmpdir.join(c_name + '.html')
+            html.write('<html>')
+            s.send_char_email(c_name, char, c_diff, str(html),
+                              datetime.timedelta(seconds=5), 'output')
+            return True
+
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.get_battlenet') as mock_get_bnet, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.character_has_changes') as mock_chc, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.do_character') as mock_do_char, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.write_character_cache'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.deliver_email') as mock_deliver:
+            mock_get_bnet.return_value = 'rec'
+            mock_chc.return_value = diff
+            mock_do_char.side_effect = se_do_char
+            s.run()
+        assert mock_get_bnet.call_args_list == [call('Area 52', '\xc3\x86llaria', region='us')]
+        assert mock_do_char.call_args_list == [
+            call(cname, {'name': '\xc3\x86llaria', 'realm': 'Area 52', 'region': 'us',
+                         'email': ['g@example.com']}, diff, 'rec')]
+        assert s.character_cache == {cname: 'rec'}
+        assert len(mock_deliver.call_args_list) == 1
+        out = StringIO()
+        mock_deliver.call_args[0][2].write_to(out)
+        msg = message_from_string(out.getvalue())
+        assert decode_header(msg['Subject'])[0][0] == 'SimulationCraft report for ' + cname
+        parts = msg.get_payload()
+        assert u'run for \xc6llaria@Area52' in parts[0].get_payload(decode=True).decode('utf-8')
+        assert parts[1].get_filename() == cname.decode('utf-8') + u'.html'
+
+    def test_run_priority(self, mock_ns):
+        """ test run() simulating changed characters in priority order """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        chars = [{'name': 'one', 'realm': 'r'},
+                 {'name': 'two', 'realm': 'r'},
+                 {'name': 'three', 'realm': 'r'},
+                 {'name': 'four', 'realm': 'r'}]
+        s_container = Container()
+        ccache = {}
+        setattr(s_container, 'CHARACTERS', chars)
+        setattr(s, 'settings', s_container)
+        setattr(s, 'character_cache', ccache)
+        prios = {'one@r': 1, 'two@r': 5, 'four@r': 1}
+
+        def se_chc(cname, bnet_info, no_stat=False):
+            if cname == 'three@r':
+                return None
+            return cname
+
+        def se_prio(cname, char, changes):
+            return prios[cname]
+
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.resume_mail'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.resume_run'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.lock_run'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.claim_character'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.migrate_character_keys'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.finish_mail'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.get_battlenet') as mock_get_bnet, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.do_character') as mock_do_char, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.character_has_changes') as mock_chc, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.sim_priority') as mock_prio, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.write_character_cache') as mock_wcc, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.write_sim_history') as mock_wsh:
+            mock_chc.side_effect = se_chc
+            mock_prio.side_effect = se_prio
+            mock_get_bnet.return_value = {'foo': 'bar'}
+            mock_do_char.return_value = False
+            s.run()
+        assert mock_do_char.call_args_list == [
+            call('two@r', chars[1], 'two@r', {'foo': 'bar'}),
+            call('one@r', chars[0], 'one@r', {'foo': 'bar'}),
+            call('four@r', chars[3], 'four@r', {'foo': 'bar'}),
+        ]
+        assert mock_wcc.call_count == 4
+        assert mock_wsh.call_count == 3
+        assert sorted(ccache.keys()) == ['four@r', 'one@r', 'three@r', 'two@r']
+
+    def test_sim_priority_new(self, mock_ns):
+        """ test sim_priority() for a never-simulated character """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.sim_history = {}
+        res = s.sim_priority('n@r', {'name': 'n', 'realm': 'r', 'priority': '2'},
+                             CharacterDiff([Change('character', 'level', 1, 2),
+                                            Change('character', 'spec', 'a', 'b')]))
+        assert res == 200.0 + 2.0 + 30.0
+
+    def test_sim_priority_history(self, mock_ns):
+        """ test sim_priority() with history and custom weights """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'SIM_PRIORITY_WEIGHTS', {'age': 2, 'changes': 0.5})
+        s.settings = settings
+        s.sim_history = {'n@r': {'last_run': datetime.datetime(2014, 1, 1, 0, 0, 0),
+                                 'durations': [60.0, 180.0]}}
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.now') as mock_now:
+            mock_now.return_value = datetime.datetime(2014, 1, 2, 12, 0, 0)
+            res = s.sim_priority('n@r', {'name': 'n', 'realm': 'r'},
+                                 CharacterDiff([Change('character', 'level', 1, 2),
+                                                Change('character', 'spec', 'a', 'b')]))
+        assert res == 0 + 1.0 + (2 * 1.5) - 2.0
+
+    def test_record_sim(self, mock_ns):
+        """ test record_sim() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.sim_history = {'a@r': {'last_run': datetime.datetime(2014, 1, 1, 0, 0, 0),
+                                 'durations': [1.0, 2.0, 3.0, 4.0, 5.0]}}
+        s.record_sim('a@r', datetime.datetime(2014, 1, 2, 0, 0, 0),
+                     datetime.timedelta(seconds=6))
+        s.record_sim('b@r', datetime.datetime(2014, 1, 3, 0, 0, 0),
+                     datetime.timedelta(minutes=1))
+        assert s.sim_history == {
+            'a@r': {'last_run': datetime.datetime(2014, 1, 2, 0, 0, 0),
+                    'durations': [2.0, 3.0, 4.0, 5.0, 6.0]},
+            'b@r': {'last_run': datetime.datetime(2014, 1, 3, 0, 0, 0),
+                    'durations': [60.0]},
+        }
+
+    def test_sim_history_roundtrip(self, mock_ns, tmpdir):
+        """ test write_sim_history() and load_sim_history() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.confdir = str(tmpdir)
+        assert s.load_sim_history() == {}
+        s.sim_history = {'a@r': {'last_run': datetime.datetime(2014, 1, 1, 0, 0, 0),
+                                 'durations': [1.0]}}
+        s.history_updated.add('a@r')
+        s.write_sim_history()
+        assert s.load_sim_history() == s.sim_history
 
     def test_run_invalid_character(self, mock_ns):
         """ test run() with an invalid character """
@@ -390,7 +1042,19 @@ class Test_AutoSimulationCraft:
         setattr(s, 'character_cache', ccache)
         mocklog.debug.reset_mock()
         with patch('autosimulationcraft.autosimulationcraft.'
-                   'AutoSimulationCraft.validate_character') as mock_validate, \
+                   'AutoSimulationCraft.resume_mail'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.resume_run'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.lock_run'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.claim_character'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.migrate_character_keys'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.finish_mail'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.validate_character') as mock_validate, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.get_battlenet') as mock_get_bnet, \
                 patch('autosimulationcraft.autosimulationcraft.'
@@ -403,8 +1067,7 @@ class Test_AutoSimulationCraft:
             mock_validate.return_value = False
             mock_get_bnet.return_value = {}
             s.run()
-        assert mocklog.debug.call_args_list == [
-            call("Doing character: nameone@realmone")]
+        assert mocklog.debug.call_args_list == []
         assert mock_validate.call_args_list == [call(chars[0])]
         assert mock_get_bnet.call_args_list == []
         assert mocklog.warning.call_args_list == [
@@ -427,7 +1090,19 @@ class Test_AutoSimulationCraft:
         setattr(s, 'character_cache', ccache)
         mocklog.debug.reset_mock()
         with patch('autosimulationcraft.autosimulationcraft.'
-                   'AutoSimulationCraft.validate_character') as mock_validate, \
+                   'AutoSimulationCraft.resume_mail'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.resume_run'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.lock_run'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.claim_character'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.migrate_character_keys'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.finish_mail'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.validate_character') as mock_validate, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.get_battlenet') as mock_get_bnet, \
                 patch('autosimulationcraft.autosimulationcraft.'
@@ -443,7 +1118,7 @@ class Test_AutoSimulationCraft:
         assert mocklog.debug.call_args_list == [
             call("Doing character: nameone@realmone")]
         assert mock_validate.call_args_list == [call(chars[0])]
-        assert mock_get_bnet.call_args_list == [call('realmone', 'nameone')]
+        assert mock_get_bnet.call_args_list == [call('realmone', 'nameone', region='us')]
         assert mocklog.warning.call_args_list == [
             call("Character nameone@realmone not found on battlenet; skipping.")]
         assert mock_do_char.call_args_list == []
@@ -455,6 +1130,12 @@ class Test_AutoSimulationCraft:
         """ test run() with no updates to character """
         bn, rc, mocklog, s, conn, lcc = mock_ns
         chars = [{'name': 'nameone',
+                  'realm': 'realmone',
+                  'email': 'foo@example.com'},
+                 {'name': 'nametwo',
+                  'realm': 'realmone',
+                  'email': 'foo@example.com'},
+                 {'name': 'namethree',
                   'realm': 'realmone',
                   'email': 'foo@example.com'}]
         s_container = Container()
@@ -464,13 +1145,27 @@ class Test_AutoSimulationCraft:
         setattr(s, 'character_cache', ccache)
         mocklog.debug.reset_mock()
         with patch('autosimulationcraft.autosimulationcraft.'
-                   'AutoSimulationCraft.validate_character') as mock_validate, \
+                   'AutoSimulationCraft.resume_mail'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.resume_run'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.lock_run'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.claim_character'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.migrate_character_keys'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.finish_mail'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.validate_character') as mock_validate, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.get_battlenet') as mock_get_bnet, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.do_character') as mock_do_char, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.character_has_changes') as mock_chc, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.journal_stage') as mock_journal, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.write_character_cache') as mock_wcc:
             mock_chc.return_value = None
@@ -478,62 +1173,327 @@ class Test_AutoSimulationCraft:
             mock_get_bnet.return_value = {'foo': 'bar'}
             s.run()
         assert mocklog.debug.call_args_list == [
-            call("Doing character: nameone@realmone")]
-        assert mock_validate.call_args_list == [call(chars[0])]
-        assert mock_get_bnet.call_args_list == [call('realmone', 'nameone')]
+            call("Doing character: nameone@realmone"),
+            call("Doing character: nametwo@realmone"),
+            call("Doing character: namethree@realmone")]
+        assert mock_validate.call_args_list == [call(c) for c in chars]
+        assert mock_get_bnet.call_args_list == [
+            call('realmone', n, region='us') for n in ['nameone', 'nametwo', 'namethree']]
         assert mock_do_char.call_args_list == []
         assert mock_chc.call_args_list == [
-            call(
-                'nameone@realmone', {
-                    'foo': 'bar'}, no_stat=False)]
+            call(n + '@realmone', {'foo': 'bar'}, no_stat=False)
+            for n in ['nameone', 'nametwo', 'namethree']]
+        # unchanged characters are cached with a single write, and not journaled
         assert mock_wcc.call_args_list == [call()]
-        assert ccache == {'nameone@realmone': {'foo': 'bar'}}
+        assert mock_journal.call_args_list == []
+        assert ccache == {'nameone@realmone': {'foo': 'bar'},
+                          'nametwo@realmone': {'foo': 'bar'},
+                          'namethree@realmone': {'foo': 'bar'}}
 
-    def test_get_battlenet(self, mock_ns, mock_bnet_character):
+    def test_get_battlenet(self, mock_ns, bnet_data):
         """ test get_battlenet() """
         bn, rc, mocklog, s, conn, lcc = mock_ns
-        conn.get_character.return_value = mock_bnet_character
+        s.settings = Container()
+        s.character_cache = {}
+        conn.get_character.return_value = bnet_data
+        orig_data = deepcopy(bnet_data)
+        result = s.get_battlenet('rname', 'cname')
+        assert conn.get_character.call_args_list == [
+            call(battlenet.UNITED_STATES, 'rname', 'cname',
+                 fields=['appearance', 'items', 'professions', 'stats', 'talents'],
+                 raw=True)]
+        assert bnet_data == orig_data
+        assert mocklog.warning.call_args_list == []
+        assert isinstance(result, CharacterRecord)
+        assert dict(result.stats)['spellCrit'] == 12.5
+        assert result.name == 'Jantman'
+        assert result.level == 100
+        assert result.professions == ((u'Tailoring', 627), (u'Enchanting', 622))
+        assert result.realm == 'Area 52'
+        assert result.class_id == 9
+        assert result.race_id == 5
+        assert dict(result.stats)['critRating'] == 825
+        items = dict([(i.slot, i) for i in result.items])
+        assert items['shoulder'].id == 115997
+        assert result.talents == '110200.'
+        assert s.item_store.add_from_bnet.call_args_list == [
+            call(bnet_data['items'])]
+
+    def test_get_battlenet_missing_fields(self, mock_ns, bnet_data):
+        """ test get_battlenet() when some fields aren't returned """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.character_cache = {}
+        del bnet_data['stats']
+        del bnet_data['talents']
+        conn.get_character.return_value = bnet_data
         result = s.get_battlenet('rname', 'cname')
-        assert conn.get_character.call_args_list == [call(battlenet.UNITED_STATES,
-                                                          'rname',
-                                                          'cname'
-                                                          )
-                                                     ]
-        for i in ['connection', 'achievementPoints',
-                  'lastModified', '_items', 'achievement_points']:
-            assert i not in result
-        assert result['stats']['spellCrit'] == 12.5
-        assert 'recipes' not in result['professions']['primary'][0]
-        assert result['name'] == 'Jantman'
-        assert result['level'] == 100
-        assert result['professions']['primary'][0] == {u'name': u'Tailoring',
-                                                       u'max': 675,
-                                                       u'rank': 627,
-                                                       u'id': 197,
-                                                       u'icon': u'trade_tailoring'
-                                                       }
-        assert result['realm'] == 'Area 52'
-        assert result['class'] == 9
-        assert result['race'] == 5
-        assert result['stats']['critRating'] == 825
-        assert result['items']['shoulder']['id'] == 115997
-        assert result['talents'][0]['talents'][
-            0]['spell']['name'] == u'Soul Leech'
-
-    def test_get_battlenet_badchar(self, mock_ns, mock_bnet_character):
+        assert mocklog.warning.call_args_list == [
+            call("Battlenet did not return stats for cname@rname; ignoring it"),
+            call("Battlenet did not return talents for cname@rname; ignoring it")]
+        assert result.name == 'Jantman'
+        assert result.stats == ()
+        assert result.talents == ''
+        assert len(result.items) == 15
+
+    def test_get_battlenet_partial(self, mock_ns, bnet_data, char_data):
+        """ test get_battlenet() re-using fresh fields from the cache """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        cached = CharacterRecord.from_bnet(char_data)
+        cached.professions = (('Tailoring', 1),)
+        cached.appearance = (('hairColor', 1),)
+        cached.stats = (('int', 1),)
+        then = datetime.datetime(2014, 1, 1, 0, 0, 0)
+        cached.fetched = {'appearance': then, 'items': then, 'professions': then,
+                          'stats': then, 'talents': then}
+        s.character_cache = {'cname@rname': cached}
+        for f in ['appearance', 'professions', 'stats']:
+            del bnet_data[f]
+        conn.get_character.return_value = bnet_data
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.now') as mock_now:
+            mock_now.return_value = datetime.datetime(2014, 1, 1, 12, 0, 0)
+            result = s.get_battlenet('rname', 'cname')
+        assert conn.get_character.call_args_list == [
+            call(battlenet.UNITED_STATES, 'rname', 'cname',
+                 fields=['items', 'stats', 'talents'], raw=True)]
+        assert mocklog.warning.call_args_list == [
+            call("Battlenet did not return stats for cname@rname; ignoring it")]
+        assert result.professions == (('Tailoring', 1),)
+        assert result.appearance == (('hairColor', 1),)
+        assert result.stats == (('int', 1),)
+        assert result.items == CharacterRecord.from_bnet(bnet_data).items
+        assert result.fetched == {'appearance': then,
+                                  'items': datetime.datetime(2014, 1, 1, 12, 0, 0),
+                                  'professions': then,
+                                  'stats': then,
+                                  'talents': datetime.datetime(2014, 1, 1, 12, 0, 0)}
+        assert cached.fetched['items'] == then
+
+    def test_stale_fields(self, mock_ns, char_data):
+        """ test stale_fields() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'SUBRESOURCE_TTLS', {'items': 3600, 'stats': 7200})
+        s.settings = settings
+        now = datetime.datetime(2014, 1, 2, 0, 0, 0)
+        assert s.stale_fields(None, now) == ['appearance', 'items', 'professions',
+                                             'stats', 'talents']
+        cached = CharacterRecord.from_bnet(char_data)
+        assert s.stale_fields(cached, now) == ['appearance', 'items', 'professions',
+                                               'stats', 'talents']
+        cached.fetched = {'appearance': datetime.datetime(2014, 1, 1, 0, 0, 0),
+                          'items': datetime.datetime(2014, 1, 1, 23, 0, 0),
+                          'professions': datetime.datetime(2014, 1, 1, 0, 0, 0),
+                          'stats': datetime.datetime(2014, 1, 1, 23, 0, 0),
+                          'talents': datetime.datetime(2014, 1, 1, 23, 59, 0)}
+        assert s.stale_fields(cached, now) == ['items', 'professions', 'talents']
+
+    def test_load_item_store(self, mock_ns, tmpdir):
+        """ test load_item_store() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'ITEM_CACHE_SIZE', 2)
+        s.settings = settings
+        s.confdir = str(tmpdir)
+        store = ItemStore(str(tmpdir.join('items.pkl')))
+        for i in range(3):
+            store.put(i, ItemInfo('item{i}'.format(i=i), None, 1, 600))
+        store.save()
+        res = s.load_item_store()
+        assert isinstance(res, ItemStore)
+        assert res.path == str(tmpdir.join('items.pkl'))
+        assert res.max_size == 2
+        assert sorted(res.items.keys()) == [1, 2]
+
+    def test_fetch_item_error(self, mock_ns):
+        """ test fetch_item() with an API error """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.character_cache = {}
+        conn.make_request.side_effect = battlenet.exceptions.APIError('foo')
+        assert s.fetch_item(123) is None
+        assert conn.make_request.call_args_list == [call(battlenet.UNITED_STATES, '/item/123')]
+        assert mocklog.warning.call_args_list == [
+            call("Unable to get item 123 from battlenet: foo")]
+
+    def test_fetch_item_offline(self, mock_ns):
+        """ test fetch_item() in offline mode """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.offline = True
+        s.bnet = None
+        assert s.fetch_item(123) is None
+        assert conn.make_request.call_args_list == []
+        assert mocklog.debug.call_args_list[-1] == call(
+            "offline mode; not getting item 123 from battlenet")
+
+    def test_item_name_offline_uncached(self, mock_ns, tmpdir):
+        """ test rendering an item change offline, with the item not cached """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.offline = True
+        s.bnet = None
+        s.item_store = ItemStore(str(tmpdir.join('items.pkl')))
+        s.item_store.put(1, ItemInfo('Known Helm', None, 1, 600))
+        changes = [Change('item', 'head', Item('head', 1, [], 0, [], 0),
+                          Item('head', 2, [], 0, [], 0))]
+        diff = CharacterDiff(changes, item_name=s.item_name)
+        assert diff.text() == u'head: item 1 (Known Helm) replaced by item 2'
+        assert s.item_store.get(2) is None
+        assert conn.make_request.call_args_list == []
+
+    def test_get_battlenet_badchar(self, mock_ns):
         """ test get_battlenet() with character not found """
         bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.character_cache = {}
         conn.get_character.side_effect = battlenet.exceptions.CharacterNotFound()
         result = s.get_battlenet('rname', 'cname')
-        assert conn.get_character.call_args_list == [call(battlenet.UNITED_STATES,
-                                                          'rname',
-                                                          'cname'
-                                                          )
-                                                     ]
+        assert conn.get_character.call_args_list == [
+            call(battlenet.UNITED_STATES, 'rname', 'cname',
+                 fields=['appearance', 'items', 'professions', 'stats', 'talents'],
+                 raw=True)]
         assert result is None
         assert mocklog.error.call_args_list == [
             call("ERROR - Character Not Found - realm='rname' character='cname'")]
 
+    def test_get_battlenet_region(self, mock_ns, bnet_data):
+        """ test get_battlenet() for a non-default region """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.character_cache = {}
+        eu_conn = MagicMock(spec_set=battlenet.Connection)
+        eu_conn.get_character.return_value = bnet_data
+        bn.return_value = eu_conn
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.new_connection', bn):
+            result = s.get_battlenet('rname', 'cname', region='eu')
+        assert conn.get_character.call_args_list == []
+        assert eu_conn.get_character.call_args_list == [
+            call(battlenet.EUROPE, 'rname', 'cname',
+                 fields=['appearance', 'items', 'professions', 'stats', 'talents'],
+                 raw=True)]
+        assert result.name == 'Jantman'
+
+    def test_new_connection(self, mock_ns, tmpdir):
+        """ test new_connection() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.confdir = str(tmpdir)
+        s.http_cache = None
+        c1 = s.new_connection()
+        c2 = s.new_connection()
+        assert isinstance(c1, CachingConnection)
+        assert c1.cache is s.http_cache
+        assert c2.cache is s.http_cache
+        assert s.http_cache.path == str(tmpdir.join('http_cache'))
+        assert s.http_cache.max_entries == 5000
+
+    def test_new_connection_no_cache(self, mock_ns):
+        """ test new_connection() with HTTP_CACHE_SIZE = 0 """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'HTTP_CACHE_SIZE', 0)
+        s.settings = settings
+        s.http_cache = None
+        res = s.new_connection()
+        assert type(res) == battlenet.Connection
+        assert s.http_cache is None
+
+    def test_new_connection_transport(self, mock_ns):
+        """ test new_connection() with a transport """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.http_cache = None
+        s.transport = Mock()
+        res = s.new_connection()
+        assert isinstance(res, CachingConnection)
+        assert res.cache is None
+        assert res.transport is s.transport
+        assert s.http_cache is None
+
+    def test_region_pool(self, mock_ns):
+        """ test region_pool() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'DEFAULT_REGION', 'eu')
+        setattr(settings, 'API_RATE_LIMITS', {'us': 5})
+        s.settings = settings
+        us_conn = Mock()
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.new_connection') as mock_conn:
+            mock_conn.return_value = us_conn
+            eu = s.region_pool('eu')
+            us = s.region_pool('us')
+            assert s.region_pool('us') is us
+        assert mock_conn.call_count == 1
+        assert eu.connection == s.bnet
+        assert eu.region == 'eu'
+        assert eu.limiter.interval == 0
+        assert us.connection == us_conn
+        assert us.limiter.interval == 0.2
+
+    def test_fetch_characters_one_region(self, mock_ns):
+        """ test fetch_characters() with all characters in one region """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        chars = [{'name': 'a', 'realm': 'r'},
+                 {'name': 'b', 'realm': 'r', 'region': 'us'}]
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.get_battlenet') as mock_get_bnet, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'threading.Thread') as mock_thread:
+            mock_get_bnet.side_effect = [{'name': 'a'}, None]
+            res = list(s.fetch_characters(chars))
+        assert res == [(chars[0], {'name': 'a'}), (chars[1], None)]
+        assert mock_get_bnet.call_args_list == [call('r', 'a', region='us'),
+                                                call('r', 'b', region='us')]
+        assert mock_thread.call_args_list == []
+
+    def test_fetch_characters_regions(self, mock_ns):
+        """ test fetch_characters() with characters in multiple regions """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        chars = [{'name': 'a', 'realm': 'r', 'region': 'us'},
+                 {'name': 'b', 'realm': 'r', 'region': 'eu'},
+                 {'name': 'c', 'realm': 'r', 'region': 'us'}]
+
+        def se_get_bnet(realm, name, region=None):
+            if name == 'b':
+                return None
+            return {'name': name, 'region': region}
+
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.get_battlenet') as mock_get_bnet:
+            mock_get_bnet.side_effect = se_get_bnet
+            res = list(s.fetch_characters(chars))
+        assert len(res) == 3
+        assert (chars[0], {'name': 'a', 'region': 'us'}) in res
+        assert (chars[1], None) in res
+        assert (chars[2], {'name': 'c', 'region': 'us'}) in res
+        # per-region order is preserved
+        assert res.index((chars[0], {'name': 'a', 'region': 'us'})) < res.index(
+            (chars[2], {'name': 'c', 'region': 'us'}))
+
+    def test_fetch_characters_regions_exception(self, mock_ns):
+        """ test fetch_characters() with an exception in a region thread """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        chars = [{'name': 'a', 'realm': 'r', 'region': 'us'},
+                 {'name': 'b', 'realm': 'r', 'region': 'eu'}]
+
+        def se_get_bnet(realm, name, region=None):
+            if name == 'b':
+                raise battlenet.exceptions.APIError('foo')
+            return {'name': name}
+
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.get_battlenet') as mock_get_bnet:
+            mock_get_bnet.side_effect = se_get_bnet
+            with pytest.raises(battlenet.exceptions.APIError):
+                list(s.fetch_characters(chars))
+        assert mocklog.exception.call_args_list == [
+            call("Error fetching characters in region eu")]
+
     def test_load_char_cache_noexist(self, mock_ns):
         """ test load_character_cache() on nonexistent file """
         bn, rc, mocklog, s, conn, lcc = mock_ns
@@ -549,9 +1509,10 @@ class Test_AutoSimulationCraft:
             call('/home/user/.autosimulationcraft/characters.pkl')]
         assert res == {}
 
-    def test_load_char_cache(self, mock_ns):
+    def test_load_char_cache(self, mock_ns, char_data):
         """ test load_character_cache() """
         bn, rc, mocklog, s, conn, lcc = mock_ns
+        rec = CharacterRecord.from_bnet(char_data)
         with patch('autosimulationcraft.autosimulationcraft.'
                    'os.path.exists') as mock_fexist, \
                 patch('autosimulationcraft.autosimulationcraft.'
@@ -560,7 +1521,7 @@ class Test_AutoSimulationCraft:
                       'pickle.load') as mock_pkl:
             mock_fexist.return_value = True
             mocko.return_value = 'filecontents'
-            mock_pkl.return_value = 'unpickled'
+            mock_pkl.return_value = {'a@b': rec, 'c@d': char_data}
             res = s.load_character_cache()
         assert mocko.mock_calls == [
             call(
@@ -569,40 +1530,42 @@ class Test_AutoSimulationCraft:
         assert mock_pkl.mock_calls == [call('filecontents')]
         assert mock_fexist.call_args_list == [
             call('/home/user/.autosimulationcraft/characters.pkl')]
-        assert res == 'unpickled'
+        assert res == {'a@b': rec, 'c@d': rec}
 
-    def test_write_char_cache(self, mock_ns):
+    def test_write_char_cache(self, mock_ns, tmpdir):
         """ test write_character_cache() """
         bn, rc, mocklog, s, conn, lcc = mock_ns
-        cache_content = {"foo": "bar", "baz": 3}
-        openmock = MagicMock()
-        with patch('autosimulationcraft.autosimulationcraft.'
-                   'open', create=True) as mocko, \
-                patch('autosimulationcraft.autosimulationcraft.'
-                      'pickle.dump') as mock_pkl:
-            mocko.return_value = openmock
-            s.character_cache = deepcopy(cache_content)
-            s.write_character_cache()
-        assert mocko.mock_calls == [call('/home/user/.autosimulationcraft/characters.pkl', 'wb'),
-                                    call().__enter__(),
-                                    call().__exit__(None, None, None)]
-        assert mock_pkl.mock_calls == [
-            call(
-                cache_content,
-                openmock.__enter__())]
+        s.confdir = str(tmpdir)
+        s.character_cache = {'foo': 'bar', 'baz': 3}
+        s.cache_updated = set(['foo', 'baz'])
+        s.write_character_cache()
+        with open(str(tmpdir.join('characters.pkl')), 'rb') as fh:
+            assert autosimulationcraft.pickle.load(fh) == {'foo': 'bar', 'baz': 3}
+        assert sorted(os.listdir(str(tmpdir))) == ['characters.pkl', 'characters.pkl.lock']
+
+    def test_write_char_cache_merge(self, mock_ns, tmpdir):
+        """ test write_character_cache() keeps entries written by another run """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.confdir = str(tmpdir)
+        with open(str(tmpdir.join('characters.pkl')), 'wb') as fh:
+            autosimulationcraft.pickle.dump({'foo': 'old', 'other': 1}, fh)
+        s.character_cache = {'foo': 'bar', 'baz': 3}
+        s.cache_updated = set(['foo'])
+        s.write_character_cache()
+        expected = {'foo': 'bar', 'other': 1}
+        with open(str(tmpdir.join('characters.pkl')), 'rb') as fh:
+            assert autosimulationcraft.pickle.load(fh) == expected
+        assert s.character_cache == expected
 
     def test_char_has_changes_true(self, mock_ns, char_data):
         """ test character_has_changes() with changes """
         bn, rc, mocklog, s, conn, lcc = mock_ns
 
-        def fix_se(char, no_stat=False):
-            return char
-
-        orig_data = char_data
+        orig_data = CharacterRecord.from_bnet(char_data)
         cname = char_data['name'] + '@' + char_data['realm']
         ccache = {cname: orig_data}
-        new_data = deepcopy(orig_data)
-        new_data['items']['shoulder'] = {u'stats': [{u'stat': 59,
+        new_bnet = deepcopy(char_data)
+        new_bnet['items']['shoulder'] = {u'stats': [{u'stat': 59,
                                                      u'amount': 60},
                                                     {u'stat': 32,
                                                      u'amount': 80},
@@ -619,127 +1582,48 @@ class Test_AutoSimulationCraft:
                                          u'bonusLists': [83],
                                          u'id': 114395,
                                          u'icon': u'inv_cloth_draenordungeon_c_01shoulder'}
+        new_bnet['stats']['critRating'] = 900
+        new_data = CharacterRecord.from_bnet(new_bnet)
         s.character_cache = ccache
-        with patch('autosimulationcraft.autosimulationcraft.'
-                   'AutoSimulationCraft.character_diff') as mock_char_diff, \
-            patch('autosimulationcraft.autosimulationcraft.'
-                  'AutoSimulationCraft.fix_char_for_diff') as mock_fix_char:
-            mock_fix_char.side_effect = fix_se
-            mock_char_diff.return_value = 'foobar'
-            result = s.character_has_changes(cname, new_data, no_stat=False)
-        assert result == 'foobar'
-        assert mock_fix_char.mock_calls == [
-            call(new_data, no_stat=False),
-            call(orig_data, no_stat=False),
-        ]
-        assert mock_char_diff.call_args_list == [call(orig_data, new_data)]
-
-    def test_character_diff_item(self, mock_ns, char_data):
-        """ test character_diff() """
-        bn, rc, mocklog, s, conn, lcc = mock_ns
-        cname = char_data['name'] + '@' + char_data['realm']
-        ccache = {cname: char_data}
-        new_data = deepcopy(char_data)
-        new_data['items']['shoulder'] = {u'stats': [{u'stat': 59,
-                                                     u'amount': 60},
-                                                    {u'stat': 32,
-                                                     u'amount': 80},
-                                                    {u'stat': 5,
-                                                     u'amount': 109},
-                                                    {u'stat': 7,
-                                                     u'amount': 163}],
-                                         u'name': u'Mantle of Hooded Nightmares of the Savage',
-                                         u'tooltipParams': {},
-                                         u'armor': 60,
-                                         u'quality': 3,
-                                         u'itemLevel': 615,
-                                         u'context': u'dungeon-normal',
-                                         u'bonusLists': [83],
-                                         u'id': 114395,
-                                         u'icon': u'inv_cloth_draenordungeon_c_01shoulder'}
-        s.character_cache = ccache
-        result = s.character_diff(char_data, new_data)
-        expected = ["change items.shoulder.context from raid-finder to dungeon-normal",
-                    "change [u'items', u'shoulder', u'stats', 0, u'stat'] from 32 to 59",
-                    "change [u'items', u'shoulder', u'stats', 0, u'amount'] from 104 to 60",
-                    "change [u'items', u'shoulder', u'stats', 1, u'stat'] from 5 to 32",
-                    "change [u'items', u'shoulder', u'stats', 1, u'amount'] from 138 to 80",
-                    "change [u'items', u'shoulder', u'stats', 2, u'stat'] from 36 to 5",
-                    "change [u'items', u'shoulder', u'stats', 2, u'amount'] from 72 to 109",
-                    "change [u'items', u'shoulder', u'stats', 3, u'amount'] from 207 to 163",
-                    "change items.shoulder.name from Twin-Gaze Spaulders "
-                    "to Mantle of Hooded Nightmares of the Savage",
-                    "remove items.shoulder.tooltipParams [(u'transmogItem', 31054)]",
-                    "change items.shoulder.armor from 71 to 60",
-                    "change items.shoulder.quality from 4 to 3",
-                    "change items.shoulder.icon from inv_shoulder_cloth_draenorlfr_c_01 "
-                    "to inv_cloth_draenordungeon_c_01shoulder",
-                    "change items.shoulder.itemLevel from 640 to 615",
-                    "change items.shoulder.id from 115997 to 114395",
-                    "add items.shoulder.bonusLists [(0, 83)]",
-                    ]
-        expected_s = "\n".join(sorted(expected))
-        assert result == expected_s
+        s.settings = Container()
+        s.item_store = ItemStore('/dev/null')
+        s.item_store.put(115997, ItemInfo(u'Twin-Gaze Spaulders', None, 4, 640))
+        conn.make_request.return_value = {'name': 'Mantle of Hooded Nightmares'}
+        result = s.character_has_changes(cname, new_data, no_stat=False)
+        assert conn.make_request.call_args_list == []
+        assert result.lines() == ['shoulder: item 115997 (Twin-Gaze Spaulders) replaced by '
+                                  'item 114395 (Mantle of Hooded Nightmares)',
+                                  'stat critRating changed from 825 to 900']
+        assert conn.make_request.call_args_list == [call(battlenet.UNITED_STATES, '/item/114395')]
+        result = s.character_has_changes(cname, new_data, no_stat=True)
+        assert result.lines() == ['shoulder: item 115997 (Twin-Gaze Spaulders) replaced by '
+                                  'item 114395 (Mantle of Hooded Nightmares)']
+        assert len(conn.make_request.call_args_list) == 1
+        assert ccache[cname] is orig_data
 
     def test_char_has_changes_false(self, mock_ns, char_data):
         """ test character_has_changes() without changes """
         bn, rc, mocklog, s, conn, lcc = mock_ns
 
-        def fix_se(char, no_stat=False):
-            return char
-
-        orig_data = char_data
+        orig_data = CharacterRecord.from_bnet(char_data)
         cname = char_data['name'] + '@' + char_data['realm']
         ccache = {cname: orig_data}
-        new_data = deepcopy(orig_data)
+        new_data = CharacterRecord.from_bnet(deepcopy(char_data))
         s.character_cache = ccache
-        with patch('autosimulationcraft.autosimulationcraft.'
-                   'AutoSimulationCraft.fix_char_for_diff') as mock_fix_char:
-            mock_fix_char.side_effect = fix_se
-            result = s.character_has_changes(cname, new_data)
+        result = s.character_has_changes(cname, new_data)
         assert result is None
 
     def test_char_has_changes_new(self, mock_ns, char_data):
         """ test character_has_changes() on never-before-seen character """
         bn, rc, mocklog, s, conn, lcc = mock_ns
 
-        def fix_se(char, no_stat=False):
-            return char
-
-        orig_data = char_data
-        cname = char_data['name'] + '@' + char_data['realm']
-        ccache = {}
-        new_data = deepcopy(orig_data)
-        s.character_cache = ccache
-        with patch('autosimulationcraft.autosimulationcraft.'
-                   'AutoSimulationCraft.fix_char_for_diff') as mock_fix_char:
-            mock_fix_char.side_effect = fix_se
-            result = s.character_has_changes(cname, new_data)
-        assert result == "Character not in cache (has not been seen before)."
-
-    def test_fix_char_for_diff(self, mock_ns, char_data):
-        bn, rc, mocklog, s, conn, lcc = mock_ns
-        sample_data = {'foo': 'bar', 'baz': 'blam'}
-        result = s.fix_char_for_diff(sample_data)
-        assert result == {'foo': 'bar', 'baz': 'blam'}
-
-    def test_fix_char_for_diff_profs(self, mock_ns, char_data):
-        bn, rc, mocklog, s, conn, lcc = mock_ns
-        assert 'professions' in char_data
-        result = s.fix_char_for_diff(char_data)
-        assert 'professions' not in result
-
-    def test_fix_char_for_diff_kills(self, mock_ns, char_data):
-        bn, rc, mocklog, s, conn, lcc = mock_ns
-        assert 'totalHonorableKills' in char_data
-        result = s.fix_char_for_diff(char_data)
-        assert 'totalHonorableKills' not in result
-
-    def test_fix_char_for_diff_no_stats(self, mock_ns, char_data):
-        bn, rc, mocklog, s, conn, lcc = mock_ns
-        assert 'stats' in char_data
-        result = s.fix_char_for_diff(char_data, no_stat=True)
-        assert 'stats' not in result
+        orig_data = char_data
+        cname = char_data['name'] + '@' + char_data['realm']
+        ccache = {}
+        new_data = deepcopy(orig_data)
+        s.character_cache = ccache
+        result = s.character_has_changes(cname, new_data)
+        assert result.text() == "Character not in cache (has not been seen before)."
 
     def test_do_character_no_simc(self, mock_ns):
         """ test do_character() with SIMC_PATH non-existant """
@@ -769,10 +1653,20 @@ class Test_AutoSimulationCraft:
                       'open', create=True) as mocko, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'os.chdir') as mock_chdir, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'tempfile.mkdtemp') as mock_mkdtemp, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'shutil.rmtree') as mock_rmtree, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.move_into_place') as mock_mip, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.now') as mock_dtnow, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'subprocess.check_output') as mock_subp, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.store_results') as mock_sr, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.archive_reports') as mock_ar, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.send_char_email') as mock_sce:
             mock_ope.side_effect = mock_ope_se
@@ -782,8 +1676,13 @@ class Test_AutoSimulationCraft:
         assert mock_ope.call_args_list == [call('/path/to/simc')]
         assert mocko.mock_calls == []
         assert mock_chdir.call_args_list == []
+        assert mock_mkdtemp.call_args_list == []
+        assert mock_rmtree.call_args_list == []
+        assert mock_mip.call_args_list == []
         assert mock_subp.call_args_list == []
         assert mock_sce.call_args_list == []
+        assert mock_sr.call_args_list == []
+        assert mock_ar.call_args_list == []
         assert mocklog.error.call_args_list == [
             call('ERROR: simc path /path/to/simc does not exist')]
 
@@ -808,15 +1707,26 @@ class Test_AutoSimulationCraft:
                       'open', create=True) as mocko, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'os.chdir') as mock_chdir, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'tempfile.mkdtemp') as mock_mkdtemp, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'shutil.rmtree') as mock_rmtree, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.move_into_place') as mock_mip, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.now') as mock_dtnow, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'subprocess.check_output') as mock_subp, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.options_for_char') as mock_ofc, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.store_results') as mock_sr, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.archive_reports') as mock_ar, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.send_char_email') as mock_sce:
             mock_ope.side_effect = mock_ope_se
+            mock_mkdtemp.return_value = '/tmp/job'
             mock_ofc.return_value = 'foo\n'
             mock_dtnow.side_effect = [
                 datetime.datetime(
@@ -827,23 +1737,33 @@ class Test_AutoSimulationCraft:
             s.do_character(c_name, c_settings, c_diff)
         assert mock_ope.call_args_list == [
             call('/path/to/simc'),
-            call('/home/user/.autosimulationcraft/cname@rname.html')]
-        assert mocko.mock_calls == [call('/home/user/.autosimulationcraft/cname@rname.simc', 'w'),
+            call('/tmp/job/cname@rname.html'),
+            call('/tmp/job/cname@rname.simc'),
+            call('/tmp/job/cname@rname.json')]
+        assert mock_mip.call_args_list == [
+            call('/tmp/job/cname@rname.simc', '/home/user/.autosimulationcraft/cname@rname.simc'),
+            call('/tmp/job/cname@rname.html', '/home/user/.autosimulationcraft/cname@rname.html'),
+            call('/tmp/job/cname@rname.json', '/home/user/.autosimulationcraft/cname@rname.json')]
+        assert mocko.mock_calls == [call('/tmp/job/cname@rname.simc', 'w'),
                                     call().__enter__(),
                                     call().__enter__().write(
                                         '"armory=us,rname,cname"\n'),
                                     call().__enter__().write(
                                         'foo\n'),
                                     call().__enter__().write(
-                                        'html=cname@rname.html'),
+                                        'json2=/tmp/job/cname@rname.json\n'),
+                                    call().__enter__().write(
+                                        'html=/tmp/job/cname@rname.html'),
                                     call().__exit__(None, None, None)]
         assert mock_ofc.call_args_list == [call(c_settings)]
-        assert mock_chdir.call_args_list == [
-            call('/home/user/.autosimulationcraft')]
-        fpath = '/home/user/.autosimulationcraft/cname@rname.simc'
+        assert mock_chdir.call_args_list == []
+        assert mock_mkdtemp.call_args_list == [call(prefix='autosimc-', dir=None)]
+        assert mock_rmtree.call_args_list == [call('/tmp/job', ignore_errors=True)]
+        fpath = '/tmp/job/cname@rname.simc'
         assert mock_subp.call_args_list == [call(['/path/to/simc',
                                                   fpath],
-                                                 stderr=subprocess.STDOUT)]
+                                                 stderr=subprocess.STDOUT,
+                                                 cwd='/tmp/job')]
         assert mock_sce.call_args_list == [call('cname@rname',
                                                 {'realm': 'rname',
                                                  'name': 'cname',
@@ -854,6 +1774,21 @@ class Test_AutoSimulationCraft:
                                                     seconds=3723),
                                                 'subprocessoutput')]
         assert mocklog.error.call_args_list == []
+        assert mock_sr.call_args_list == [call(
+            'cname@rname', datetime.datetime(2014, 1, 1, 0, 0, 0),
+            datetime.timedelta(seconds=3723),
+            json_path='/home/user/.autosimulationcraft/cname@rname.json')]
+        assert len(mock_ar.call_args_list) == 1
+        args = mock_ar.call_args[0]
+        assert args[:2] == ('cname@rname', datetime.datetime(2014, 1, 1, 0, 0, 0))
+        assert sorted(args[2].keys()) == ['html', 'json', 'log', 'simc']
+        assert args[2]['html'] == '/home/user/.autosimulationcraft/cname@rname.html'
+        assert args[2]['json'] == '/home/user/.autosimulationcraft/cname@rname.json'
+        assert args[2]['simc'] == '/home/user/.autosimulationcraft/cname@rname.simc'
+        assert args[2]['log'].read() == 'subprocessoutput'
+        assert s.sim_history['cname@rname'] == {
+            'last_run': datetime.datetime(2014, 1, 1, 0, 0, 0),
+            'durations': [3723.0]}
 
     def test_do_character_simc_error(self, mock_ns):
         """ test do_character() with simc exiting non-0 """
@@ -877,15 +1812,26 @@ class Test_AutoSimulationCraft:
                       'open', create=True) as mocko, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'os.chdir') as mock_chdir, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'tempfile.mkdtemp') as mock_mkdtemp, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'shutil.rmtree') as mock_rmtree, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.move_into_place') as mock_mip, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.now') as mock_dtnow, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'subprocess.check_output') as mock_subp, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.options_for_char') as mock_ofc, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.store_results') as mock_sr, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.archive_reports') as mock_ar, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.send_char_email') as mock_sce:
             mock_ope.side_effect = mock_ope_se
+            mock_mkdtemp.return_value = '/tmp/job'
             mock_ofc.return_value = 'foo\n'
             mock_dtnow.side_effect = [
                 datetime.datetime(
@@ -898,23 +1844,34 @@ class Test_AutoSimulationCraft:
             s.settings = settings
             s.do_character(c_name, c_settings, c_diff)
         assert mock_ope.call_args_list == [call('/path/to/simc')]
-        assert mocko.mock_calls == [call('/home/user/.autosimulationcraft/cname@rname.simc', 'w'),
+        assert mocko.mock_calls == [call('/tmp/job/cname@rname.simc', 'w'),
                                     call().__enter__(),
                                     call().__enter__().write(
                                         '"armory=us,rname,cname"\n'),
                                     call().__enter__().write(
                                         'foo\n'),
                                     call().__enter__().write(
-                                        'html=cname@rname.html'),
+                                        'json2=/tmp/job/cname@rname.json\n'),
+                                    call().__enter__().write(
+                                        'html=/tmp/job/cname@rname.html'),
                                     call().__exit__(None, None, None)]
-        assert mock_chdir.call_args_list == [
-            call('/home/user/.autosimulationcraft')]
-        fpath = '/home/user/.autosimulationcraft/cname@rname.simc'
+        assert mock_chdir.call_args_list == []
+        assert mock_mkdtemp.call_args_list == [call(prefix='autosimc-', dir=None)]
+        assert mock_rmtree.call_args_list == [call('/tmp/job', ignore_errors=True)]
+        fpath = '/tmp/job/cname@rname.simc'
         assert mock_subp.call_args_list == [call(['/path/to/simc',
                                                   fpath],
-                                                 stderr=subprocess.STDOUT)]
+                                                 stderr=subprocess.STDOUT,
+                                                 cwd='/tmp/job')]
         assert mock_sce.call_args_list == []
         assert mocklog.error.call_args_list == [call('Error running simc!')]
+        assert mock_mip.call_args_list == []
+        assert mock_sr.call_args_list == [call(
+            'cname@rname', datetime.datetime(2014, 1, 1, 0, 0, 0),
+            datetime.timedelta(seconds=3723), error='simc exited 1')]
+        args = mock_ar.call_args[0]
+        assert sorted(args[2].keys()) == ['log', 'simc']
+        assert args[2]['log'].read() == 'erroroutput'
 
     def test_do_character_no_html(self, mock_ns):
         """ do_character() - simc runs but HTML not created """
@@ -930,7 +1887,7 @@ class Test_AutoSimulationCraft:
         setattr(settings, 'CHARACTERS', [c_settings])
 
         def mock_ope_se(p):
-            if p == '/home/user/.autosimulationcraft/cname@rname.html':
+            if p == '/tmp/job/cname@rname.html':
                 return False
             return True
 
@@ -940,15 +1897,26 @@ class Test_AutoSimulationCraft:
                       'open', create=True) as mocko, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'os.chdir') as mock_chdir, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'tempfile.mkdtemp') as mock_mkdtemp, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'shutil.rmtree') as mock_rmtree, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.move_into_place') as mock_mip, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.now') as mock_dtnow, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'subprocess.check_output') as mock_subp, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.options_for_char') as mock_ofc, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.store_results') as mock_sr, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.archive_reports') as mock_ar, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.send_char_email') as mock_sce:
             mock_ope.side_effect = mock_ope_se
+            mock_mkdtemp.return_value = '/tmp/job'
             mock_ofc.return_value = 'foo\n'
             mock_dtnow.side_effect = [
                 datetime.datetime(
@@ -959,26 +1927,467 @@ class Test_AutoSimulationCraft:
             s.do_character(c_name, c_settings, c_diff)
         assert mock_ope.call_args_list == [
             call('/path/to/simc'),
-            call('/home/user/.autosimulationcraft/cname@rname.html')]
-        assert mocko.mock_calls == [call('/home/user/.autosimulationcraft/cname@rname.simc', 'w'),
+            call('/tmp/job/cname@rname.html')]
+        assert mock_mip.call_args_list == []
+        assert mocko.mock_calls == [call('/tmp/job/cname@rname.simc', 'w'),
                                     call().__enter__(),
                                     call().__enter__().write(
                                         '"armory=us,rname,cname"\n'),
                                     call().__enter__().write(
                                         'foo\n'),
                                     call().__enter__().write(
-                                        'html=cname@rname.html'),
+                                        'json2=/tmp/job/cname@rname.json\n'),
+                                    call().__enter__().write(
+                                        'html=/tmp/job/cname@rname.html'),
                                     call().__exit__(None, None, None)]
-        assert mock_chdir.call_args_list == [
-            call('/home/user/.autosimulationcraft')]
-        fpath = '/home/user/.autosimulationcraft/cname@rname.simc'
+        assert mock_chdir.call_args_list == []
+        assert mock_mkdtemp.call_args_list == [call(prefix='autosimc-', dir=None)]
+        assert mock_rmtree.call_args_list == [call('/tmp/job', ignore_errors=True)]
+        fpath = '/tmp/job/cname@rname.simc'
         assert mock_subp.call_args_list == [call(['/path/to/simc',
                                                   fpath],
-                                                 stderr=subprocess.STDOUT)]
+                                                 stderr=subprocess.STDOUT,
+                                                 cwd='/tmp/job')]
         assert mock_sce.call_args_list == []
+        assert mock_sr.call_args_list == []
+        assert mock_ar.call_args_list == []
         assert mocklog.error.call_args_list == [
             call('ERROR: simc finished but HTML file not found on disk.')]
 
+    def test_do_character_work_dir(self, mock_ns, tmpdir):
+        """ test do_character() running simc in its own directory under SIMC_WORK_DIR """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'SIMC_PATH', '/bin/true')
+        setattr(settings, 'SIMC_WORK_DIR', str(tmpdir.mkdir('work')))
+        s.settings = settings
+        s.confdir = str(tmpdir.mkdir('conf'))
+        jobdirs = []
+
+        def fake_simc(args, stderr=None, cwd=None):
+            jobdirs.append(cwd)
+            simc = open(args[1]).read().splitlines()
+            assert simc[-2] == 'json2=' + os.path.join(cwd, 'c@r.json')
+            assert simc[-1] == 'html=' + os.path.join(cwd, 'c@r.html')
+            with open(os.path.join(cwd, 'c@r.html'), 'w') as fh:
+                fh.write('<html/>')
+            return 'output'
+        with patch('autosimulationcraft.autosimulationcraft.os.path.exists', os.path.exists), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'subprocess.check_output') as mock_subp, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.options_for_char') as mock_ofc, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.store_results'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.archive_reports'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.send_char_email') as mock_sce:
+            mock_subp.side_effect = fake_simc
+            mock_ofc.return_value = ''
+            s.journal = RunJournal(str(tmpdir.join('journal.pkl')))
+            s.pending_cache['c@r'] = {'foo': 'bar'}
+            assert s.do_character('c@r', {'realm': 'r', 'name': 'c'},
+                                  CharacterDiff.note('diff')) is True
+        assert os.path.dirname(jobdirs[0]) == str(tmpdir.join('work'))
+        assert tmpdir.join('work').listdir() == []
+        assert sorted(p.basename for p in tmpdir.join('conf').listdir()) == ['c@r.html', 'c@r.simc']
+        assert tmpdir.join('conf', 'c@r.html').read() == '<html/>'
+        assert mock_sce.call_args[0][3] == str(tmpdir.join('conf', 'c@r.html'))
+        entry = s.journal.entries()[0]
+        assert entry.stage == 'simulated'
+        assert entry.data['changes'] == CharacterDiff.note('diff').changes
+        assert entry.data['bnet'] == {'foo': 'bar'}
+        assert entry.data['output'] == 'output'
+
+    def test_resume_run(self, mock_ns, tmpdir):
+        """ test resume_run() and finish_run() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.confdir = str(tmpdir)
+        s.character_cache = {}
+        tmpdir.join('a@r.html').write('<html/>')
+        duration = datetime.timedelta(seconds=3)
+        changes = [Change('character', 'level', 99, 100)]
+
+        def report(c, bnet, changes=changes):
+            return {'c_settings': {'name': c}, 'changes': changes, 'duration': duration,
+                    'html_path': str(tmpdir.join(c + '.html')), 'output': 'out', 'bnet': bnet}
+        journal = RunJournal(str(tmpdir.join('journal.pkl')))
+        journal.record('a@r', 'simulated', report('a@r', {'a': 1}))
+        journal.record('b@r', 'simulated', report('b@r', {'b': 1}))
+        journal.record('b@r', 'mailed')
+        journal.record('c@r', 'simulated', report('c@r', {'c': 1}))
+        journal.record('d@r', 'simulated', report('d@r', {'d': 1}))
+        journal.record('d@r', 'mailed')
+        journal.record('d@r', 'cached')
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.send_char_email') as mock_sce, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.write_character_cache') as mock_wcc:
+            mock_sce.side_effect = lambda c_name, *args: s.report_sent(c_name)
+            s.resume_run()
+        assert mock_sce.call_args_list == [
+            call('a@r', {'name': 'a@r'}, CharacterDiff(changes), str(tmpdir.join('a@r.html')),
+                 duration, 'out')]
+        assert mock_sce.call_args[0][2].item_name == s.item_name
+        assert mock_wcc.call_count == 2
+        assert s.character_cache == {'a@r': {'a': 1}, 'b@r': {'b': 1}}
+        assert s.pending_cache == {}
+        assert mocklog.info.call_args_list == [
+            call("Resuming 3 characters from an interrupted run"),
+            call("Sending the unsent reports for a@r")]
+        assert mocklog.warning.call_args_list == [
+            call("Report {p} for c@r no longer exists; not resending it".format(
+                p=str(tmpdir.join('c@r.html'))))]
+        assert list(s.journal.unfinished().keys()) == ['c@r']
+        s.finish_run()
+        assert s.journal is None
+        assert not tmpdir.join('journal.pkl').exists()
+        s.finish_run()
+
+    def test_resume_run_nothing(self, mock_ns, tmpdir):
+        """ test resume_run() without an interrupted run """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.confdir = str(tmpdir)
+        s.resume_run()
+        assert isinstance(s.journal, RunJournal)
+        assert mocklog.info.call_args_list == []
+        assert tmpdir.listdir() == []
+
+    def test_run_locked(self, mock_ns):
+        """ test run() when lock_run() says not to run """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.lock_run') as mock_lock, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.unlock_run') as mock_unlock, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.run_characters') as mock_rc:
+            mock_lock.return_value = False
+            s.run()
+            assert mock_rc.call_args_list == []
+            assert mock_unlock.call_args_list == []
+            mock_lock.return_value = True
+            mock_rc.side_effect = RuntimeError()
+            with pytest.raises(RuntimeError):
+                s.run(no_stat=True, only=['a@r'])
+        assert mock_rc.call_args_list == [call(no_stat=True, only=['a@r'])]
+        assert mock_unlock.call_args_list == [call()]
+
+    def test_lock_run(self, mock_ns, tmpdir):
+        """ test lock_run() and unlock_run() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.confdir = str(tmpdir)
+        s.claims = Claims(str(tmpdir.join('claims')))
+        assert s.lock_run() is True
+        assert s.run_lock.locked is True
+        assert s.takeover is False
+        assert s.claims.claim('a@r') is True
+        s.unlock_run()
+        assert s.run_lock is None
+        assert s.claims.locks == {}
+        assert FileLock(str(tmpdir.join('autosimc.lock'))).acquire(blocking=False) is True
+        assert mocklog.warning.call_args_list == []
+
+    def test_lock_run_skip(self, mock_ns, tmpdir):
+        """ test lock_run() with another run holding the lock """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.confdir = str(tmpdir)
+        other = FileLock(str(tmpdir.join('autosimc.lock')))
+        other.acquire()
+        assert s.lock_run() is False
+        assert s.run_lock is None
+        assert mocklog.warning.call_args_list == [
+            call("Another run is in progress (lock {p} is held); skipping this "
+                 "run.".format(p=str(tmpdir.join('autosimc.lock'))))]
+
+    def test_lock_run_wait(self, mock_ns, tmpdir):
+        """ test lock_run() with LOCK_POLICY = 'wait' """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        setattr(s.settings, 'LOCK_POLICY', 'wait')
+        s.confdir = str(tmpdir)
+        other = FileLock(str(tmpdir.join('autosimc.lock')))
+        other.acquire()
+        timer = threading.Timer(0.2, other.release)
+        timer.start()
+        assert s.lock_run() is True
+        timer.join()
+        assert s.run_lock.locked is True
+        assert s.takeover is False
+        assert mocklog.warning.call_args_list == [
+            call("Another run is in progress; waiting for it to finish.")]
+        s.unlock_run()
+
+    def test_lock_run_takeover(self, mock_ns, tmpdir):
+        """ test lock_run() with the 'takeover' lock_policy argument """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        setattr(s.settings, 'LOCK_POLICY', 'wait')
+        s.lock_policy = 'takeover'
+        s.confdir = str(tmpdir)
+        other = FileLock(str(tmpdir.join('autosimc.lock')))
+        other.acquire()
+        assert s.lock_run() is True
+        assert s.run_lock is None
+        assert s.takeover is True
+        # a takeover run doesn't use the journal or the mail spool
+        s.resume_run()
+        assert s.journal is None
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.deliver_email') as mock_deliver:
+            s.send_email('from', 'to', 'msg')
+        assert mock_deliver.call_args_list == [call('from', 'to', 'msg')]
+        assert tmpdir.listdir() == [tmpdir.join('autosimc.lock')]
+        s.unlock_run()
+
+    def test_claim_character(self, mock_ns, tmpdir):
+        """ test claim_character() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.confdir = str(tmpdir)
+        s.claims = Claims(str(tmpdir.join('claims')))
+        other = Claims(str(tmpdir.join('claims')))
+        other.claim('b@r')
+        s.character_cache = {'a@r': 'a1', 'b@r': 'b1', 'c@r': 'c1'}
+        s.pending_cache = {'a@r': 'a2', 'b@r': 'b2', 'c@r': 'c2'}
+        assert s.claim_character('a@r') is True
+        assert s.claim_character('b@r') is False
+        assert s.pending_cache == {'a@r': 'a2', 'c@r': 'c2'}
+        assert mocklog.info.call_args_list == [
+            call("Character b@r is being simulated by another run; skipping.")]
+        other.release_all()
+
+    def test_claim_character_cache_changed(self, mock_ns, tmpdir):
+        """ test claim_character() after another run has updated the cache """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.confdir = str(tmpdir)
+        s.claims = Claims(str(tmpdir.join('claims')))
+        s.character_cache = {'a@r': 'a1', 'b@r': 'b1', 'c@r': 'c1'}
+        s.cache_updated = set(['a@r'])
+        s.pending_cache = {'b@r': 'b2', 'c@r': 'c2'}
+        with open(str(tmpdir.join('characters.pkl')), 'wb') as fh:
+            autosimulationcraft.pickle.dump({'a@r': 'a0', 'b@r': 'b2', 'c@r': 'c1'}, fh)
+        assert s.claim_character('b@r') is False
+        assert s.character_cache == {'a@r': 'a1', 'b@r': 'b2', 'c@r': 'c1'}
+        assert s.pending_cache == {'c@r': 'c2'}
+        assert mocklog.info.call_args_list == [
+            call("Character b@r was simulated by another run; skipping.")]
+        assert s.claim_character('c@r') is True
+        assert s.pending_cache == {'c@r': 'c2'}
+        s.unlock_run()
+
+    def test_move_into_place(self, mock_ns, tmpdir):
+        """ test move_into_place(), including across filesystems """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        tmpdir.join('a').write('new a')
+        tmpdir.join('b').write('new b')
+        tmpdir.join('dest_b').write('old b')
+        s.move_into_place(str(tmpdir.join('a')), str(tmpdir.join('dest_a')))
+        assert tmpdir.join('dest_a').read() == 'new a'
+        real_rename = os.rename
+
+        def rename(src, dest):
+            if src == str(tmpdir.join('b')):
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            real_rename(src, dest)
+        with patch('autosimulationcraft.autosimulationcraft.os.rename') as mock_rename:
+            mock_rename.side_effect = rename
+            s.move_into_place(str(tmpdir.join('b')), str(tmpdir.join('dest_b')))
+        assert mock_rename.call_args_list[1] == call(str(tmpdir.join('dest_b.tmp')),
+                                                     str(tmpdir.join('dest_b')))
+        assert sorted(p.basename for p in tmpdir.listdir()) == ['dest_a', 'dest_b']
+        assert tmpdir.join('dest_b').read() == 'new b'
+        with pytest.raises(OSError):
+            s.move_into_place(str(tmpdir.join('missing')), str(tmpdir.join('dest_c')))
+
+    def test_archive_reports(self, mock_ns, tmpdir):
+        """ test report_archive() and archive_reports() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'REPORT_ARCHIVE_KEEP', 3)
+        s.settings = settings
+        s.confdir = str(tmpdir)
+        tmpdir.join('c.simc').write('input')
+        start = datetime.datetime(2014, 1, 1)
+        with patch('autosimulationcraft.autosimulationcraft.os.path.exists', os.path.exists):
+            s.archive_reports('c@r', start, {'simc': str(tmpdir.join('c.simc')),
+                                             'html': str(tmpdir.join('c.html')),
+                                             'log': StringIO('output')})
+        archive = s.report_archive()
+        assert archive.path == str(tmpdir.join('archive'))
+        assert archive.keep == 3
+        runs = archive.history('c@r')
+        assert len(runs) == 1
+        assert sorted(runs[0].files.keys()) == ['log', 'simc']
+        assert archive.open(runs[0].files['log']).read() == 'output'
+        with patch.object(archive, 'add') as mock_add:
+            mock_add.side_effect = IOError('disk full')
+            s.archive_reports('c@r', start, {'log': StringIO('output')})
+        assert mocklog.warning.call_args_list == [
+            call("Unable to archive reports for c@r: disk full")]
+
+    def test_archive_reports_disabled(self, mock_ns, tmpdir):
+        """ test archive_reports() with REPORT_ARCHIVE_KEEP = 0 """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'REPORT_ARCHIVE_KEEP', 0)
+        s.settings = settings
+        s.confdir = str(tmpdir)
+        s.archive_reports('c@r', datetime.datetime(2014, 1, 1), {'log': StringIO('output')})
+        assert s.report_archive() is None
+        assert tmpdir.listdir() == []
+
+    def test_store_results(self, mock_ns, tmpdir):
+        """ test store_results() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.confdir = str(tmpdir)
+        report = tmpdir.join('c@r.json')
+        report.write(json.dumps({'sim': {'options': {'iterations': 100}, 'players': [
+            {'name': 'c', 'collected_data': {'dps': {'mean': 1234.5}}}]}}))
+        tmpdir.join('bad.json').write('{')
+        start = datetime.datetime(2015, 1, 1)
+        s.store_results('c@r', start, datetime.timedelta(seconds=90), json_path=str(report))
+        s.store_results('c@r', start + datetime.timedelta(days=1), datetime.timedelta(seconds=9),
+                        json_path=str(tmpdir.join('bad.json')))
+        s.store_results('c@r', start + datetime.timedelta(days=2), datetime.timedelta(seconds=1),
+                        error='simc exited 1')
+        assert s.results.path == str(tmpdir.join('results.db'))
+        assert s.results.history('c@r') == [(start, 1234.5)]
+        assert [(r[2], r[3]) for r in s.results.runs('c@r')] == [
+            (90.0, None), (9.0, 'unparseable JSON report'), (1.0, 'simc exited 1')]
+        assert s.history.path == str(tmpdir.join('history'))
+        assert s.history.rolling_mean('c@r', 2) == [(start, 1234.5, 1234.5)]
+        assert len(mocklog.warning.call_args_list) == 1
+        assert mocklog.warning.call_args[0][0].startswith(
+            'Unable to parse simc JSON report {p}: '.format(p=tmpdir.join('bad.json')))
+
+    def test_store_results_db_error(self, mock_ns):
+        """ test store_results() with a database error """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.results = Mock()
+        s.results.add_run.side_effect = autosimulationcraft.sqlite3.OperationalError('locked')
+        s.store_results('c@r', datetime.datetime(2015, 1, 1), datetime.timedelta(seconds=1),
+                        error='foo')
+        assert mocklog.warning.call_args_list == [
+            call('Unable to store simulation results for c@r: locked')]
+
+    def test_store_results_history_error(self, mock_ns):
+        """ test store_results() when the DPS history can't be written """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.results = Mock()
+        s.history = Mock()
+        s.history.append.side_effect = IOError('disk full')
+        res = SimResult(None, 10, None, None, [ScenarioResult('ps1', 'c', 1.0, 1, 1, 0),
+                                               ScenarioResult('baseline', 'c', 2.0, 2, 2, 0)])
+        start = datetime.datetime(2015, 1, 1)
+        with patch('autosimulationcraft.autosimulationcraft.read_results') as mock_rr:
+            mock_rr.return_value = res
+            s.store_results('c@r', start, datetime.timedelta(seconds=1), json_path='x')
+        assert s.history.append.call_args_list == [call('c@r', start, 2.0)]
+        assert mocklog.warning.call_args_list == [
+            call('Unable to store DPS history for c@r: disk full')]
+
+    def test_do_character_profile(self, mock_ns, char_data):
+        """ test do_character() generating the profile from battlenet data """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        c_settings = {
+            'realm': 'rname',
+            'name': 'cname',
+            'email': ['foo@example.com']}
+        settings = Container()
+        setattr(settings, 'SIMC_PATH', '/path/to/simc')
+        s.settings = settings
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'os.path.exists') as mock_ope, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'open', create=True) as mocko, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'os.chdir'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'tempfile.mkdtemp') as mock_mkdtemp, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'shutil.rmtree'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.move_into_place'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'subprocess.check_output'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.options_for_char') as mock_ofc, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.profile_for_char') as mock_pfc, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.store_results'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.archive_reports'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.send_char_email'):
+            mock_ope.return_value = True
+            mock_mkdtemp.return_value = '/tmp/job'
+            mock_ofc.return_value = 'foo\n'
+            mock_pfc.return_value = 'profile\n'
+            s.do_character('cname@rname', c_settings, 'diff', char_data)
+        assert mock_pfc.call_args_list == [call('cname@rname', c_settings, char_data)]
+        assert call().__enter__().write('profile\n') in mocko.mock_calls
+        assert mock_mkdtemp.call_args_list == [call(prefix='autosimc-', dir=None)]
+
+    def test_profile_for_char_armory(self, mock_ns):
+        """ test profile_for_char() without battlenet data """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        c_settings = {'realm': 'rname', 'name': 'cname', 'region': 'eu'}
+        res = s.profile_for_char('cname@rname', c_settings, None)
+        assert res == '"armory=eu,rname,cname"\n'
+
+    def test_profile_for_char_armory_setting(self, mock_ns, char_data):
+        """ test profile_for_char() with SIMC_PROFILE_SOURCE = 'armory' """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'SIMC_PROFILE_SOURCE', 'armory')
+        s.settings = settings
+        c_settings = {'realm': 'rname', 'name': 'cname'}
+        res = s.profile_for_char('cname@rname', c_settings,
+                                 CharacterRecord.from_bnet(char_data))
+        assert res == '"armory=us,rname,cname"\n'
+
+    def test_profile_for_char_offline(self, mock_ns, char_data):
+        """ test profile_for_char() ignores SIMC_PROFILE_SOURCE in offline mode """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'SIMC_PROFILE_SOURCE', 'armory')
+        s.settings = settings
+        s.offline = True
+        c_settings = {'realm': 'Area 52', 'name': 'Jantman'}
+        res = s.profile_for_char('Jantman@Area52', c_settings,
+                                 CharacterRecord.from_bnet(char_data))
+        assert res.startswith('warlock="Jantman"\n')
+
+    def test_profile_for_char_generated(self, mock_ns, char_data):
+        """ test profile_for_char() generating a native profile """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        c_settings = {'realm': 'Area 52', 'name': 'Jantman', 'region': 'us'}
+        res = s.profile_for_char('Jantman@Area52', c_settings,
+                                 CharacterRecord.from_bnet(char_data))
+        assert isinstance(res, str)
+        assert res.startswith('warlock="Jantman"\n')
+        assert 'armory=' not in res
+
+    def test_profile_for_char_error(self, mock_ns, char_data):
+        """ test profile_for_char() when the profile can't be generated """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        char_data['class'] = 99
+        c_settings = {'realm': 'rname', 'name': 'cname'}
+        res = s.profile_for_char('cname@rname', c_settings,
+                                 CharacterRecord.from_bnet(char_data))
+        assert res == '"armory=us,rname,cname"\n'
+        assert mocklog.warning.call_args_list == [
+            call("Unable to generate simc profile for cname@rname (unknown class id 99); "
+                 "using armory import")]
+
     def test_options_for_char_none(self, mock_ns):
         """ test options_for_char() with none """
         bn, rc, mocklog, s, conn, lcc = mock_ns
@@ -1076,10 +2485,11 @@ class Test_AutoSimulationCraft:
         settings = Container()
         setattr(settings, 'SIMC_PATH', '/path/to/simc')
         setattr(settings, 'CHARACTERS', [c_settings])
+        setattr(settings, 'MAIL_SPOOL', False)
         with patch('autosimulationcraft.autosimulationcraft.'
                    'AutoSimulationCraft.send_gmail') as mock_gmail, \
                 patch('autosimulationcraft.autosimulationcraft.'
-                      'AutoSimulationCraft.format_message', spec_set=MIMEMultipart) as mock_format, \
+                      'AutoSimulationCraft.format_message', spec_set=StreamingMessage) as mock_format, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.send_local') as mock_local, \
                 patch('autosimulationcraft.autosimulationcraft.'
@@ -1088,7 +2498,7 @@ class Test_AutoSimulationCraft:
                       'getpass.getuser') as mock_user:
             mock_node.return_value = 'nodename'
             mock_user.return_value = 'username'
-            mock_format.return_value.as_string.return_value = 'msgbody'
+            mock_format.return_value = 'msgbody'
             s.settings = settings
             s.send_char_email(c_name,
                               c_settings,
@@ -1103,7 +2513,8 @@ class Test_AutoSimulationCraft:
                                                    c_diff,
                                                    html_path,
                                                    duration,
-                                                   output)]
+                                                   output,
+                                                   links=None)]
         assert mock_local.call_args_list == [call('username@nodename',
                                                   'foo@example.com',
                                                   'msgbody')]
@@ -1124,10 +2535,11 @@ class Test_AutoSimulationCraft:
         settings = Container()
         setattr(settings, 'SIMC_PATH', '/path/to/simc')
         setattr(settings, 'CHARACTERS', [c_settings])
+        setattr(settings, 'MAIL_SPOOL', False)
         with patch('autosimulationcraft.autosimulationcraft.'
                    'AutoSimulationCraft.send_gmail') as mock_gmail, \
                 patch('autosimulationcraft.autosimulationcraft.'
-                      'AutoSimulationCraft.format_message', spec_set=MIMEMultipart) as mock_format, \
+                      'AutoSimulationCraft.format_message', spec_set=StreamingMessage) as mock_format, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.send_local') as mock_local, \
                 patch('autosimulationcraft.autosimulationcraft.'
@@ -1136,7 +2548,7 @@ class Test_AutoSimulationCraft:
                       'getpass.getuser') as mock_user:
             mock_node.return_value = 'nodename'
             mock_user.return_value = 'username'
-            mock_format.return_value.as_string.return_value = 'msgbody'
+            mock_format.return_value = 'msgbody'
             s.settings = settings
             s.send_char_email(c_name,
                               c_settings,
@@ -1151,7 +2563,8 @@ class Test_AutoSimulationCraft:
                                                    c_diff,
                                                    html_path,
                                                    duration,
-                                                   output)]
+                                                   output,
+                                                   links=None)]
         assert mock_local.call_args_list == [call('username@nodename',
                                                   'foo@example.com',
                                                   'msgbody')]
@@ -1172,12 +2585,13 @@ class Test_AutoSimulationCraft:
         settings = Container()
         setattr(settings, 'SIMC_PATH', '/path/to/simc')
         setattr(settings, 'CHARACTERS', [c_settings])
+        setattr(settings, 'MAIL_SPOOL', False)
         setattr(settings, 'GMAIL_USERNAME', None)
         setattr(settings, 'GMAIL_PASSWORD', 'gmailpass')
         with patch('autosimulationcraft.autosimulationcraft.'
                    'AutoSimulationCraft.send_gmail') as mock_gmail, \
                 patch('autosimulationcraft.autosimulationcraft.'
-                      'AutoSimulationCraft.format_message', spec_set=MIMEMultipart) as mock_format, \
+                      'AutoSimulationCraft.format_message', spec_set=StreamingMessage) as mock_format, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.send_local') as mock_local, \
                 patch('autosimulationcraft.autosimulationcraft.'
@@ -1186,7 +2600,7 @@ class Test_AutoSimulationCraft:
                       'getpass.getuser') as mock_user:
             mock_node.return_value = 'nodename'
             mock_user.return_value = 'username'
-            mock_format.return_value.as_string.return_value = 'msgbody'
+            mock_format.return_value = 'msgbody'
             s.settings = settings
             s.send_char_email(c_name,
                               c_settings,
@@ -1201,7 +2615,8 @@ class Test_AutoSimulationCraft:
                                                    c_diff,
                                                    html_path,
                                                    duration,
-                                                   output)]
+                                                   output,
+                                                   links=None)]
         assert mock_local.call_args_list == [call('username@nodename',
                                                   'foo@example.com',
                                                   'msgbody')]
@@ -1222,12 +2637,13 @@ class Test_AutoSimulationCraft:
         settings = Container()
         setattr(settings, 'SIMC_PATH', '/path/to/simc')
         setattr(settings, 'CHARACTERS', [c_settings])
+        setattr(settings, 'MAIL_SPOOL', False)
         setattr(settings, 'GMAIL_USERNAME', 'gmailuser')
         setattr(settings, 'GMAIL_PASSWORD', 'gmailpass')
         with patch('autosimulationcraft.autosimulationcraft.'
                    'AutoSimulationCraft.send_gmail') as mock_gmail, \
                 patch('autosimulationcraft.autosimulationcraft.'
-                      'AutoSimulationCraft.format_message', spec_set=MIMEMultipart) as mock_format, \
+                      'AutoSimulationCraft.format_message', spec_set=StreamingMessage) as mock_format, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.send_local') as mock_local, \
                 patch('autosimulationcraft.autosimulationcraft.'
@@ -1236,7 +2652,7 @@ class Test_AutoSimulationCraft:
                       'getpass.getuser') as mock_user:
             mock_node.return_value = 'nodename'
             mock_user.return_value = 'username'
-            mock_format.return_value.as_string.return_value = 'msgbody'
+            mock_format.return_value = 'msgbody'
             s.settings = settings
             s.send_char_email(c_name,
                               c_settings,
@@ -1251,7 +2667,8 @@ class Test_AutoSimulationCraft:
                                                    c_diff,
                                                    html_path,
                                                    duration,
-                                                   output)]
+                                                   output,
+                                                   links=None)]
         assert mock_gmail.call_args_list == [call('username@nodename',
                                                   'foo@example.com',
                                                   'msgbody')]
@@ -1271,10 +2688,11 @@ class Test_AutoSimulationCraft:
         settings = Container()
         setattr(settings, 'SIMC_PATH', '/path/to/simc')
         setattr(settings, 'CHARACTERS', [c_settings])
+        setattr(settings, 'MAIL_SPOOL', False)
         with patch('autosimulationcraft.autosimulationcraft.'
                    'AutoSimulationCraft.send_gmail') as mock_gmail, \
                 patch('autosimulationcraft.autosimulationcraft.'
-                      'AutoSimulationCraft.format_message', spec_set=MIMEMultipart) as mock_format, \
+                      'AutoSimulationCraft.format_message', spec_set=StreamingMessage) as mock_format, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.send_local') as mock_local, \
                 patch('autosimulationcraft.autosimulationcraft.'
@@ -1283,7 +2701,7 @@ class Test_AutoSimulationCraft:
                       'getpass.getuser') as mock_user:
             mock_node.return_value = 'nodename'
             mock_user.return_value = 'username'
-            mock_format.as_string.return_value = 'msgbody'
+            mock_format.return_value = 'msgbody'
             s.settings = settings
             s.dry_run = True
             s.send_char_email(c_name,
@@ -1300,18 +2718,238 @@ class Test_AutoSimulationCraft:
         assert mock_local.call_args_list == []
         assert mock_gmail.call_args_list == []
 
-    def test_format_message(self, mock_ns):
+    def test_send_char_email_upload(self, mock_ns):
+        """ test send_char_email() with ARTIFACT_BACKEND """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        c_settings = {'realm': 'rname', 'name': 'cname', 'email': 'foo@example.com'}
+        duration = datetime.timedelta(seconds=3723)
+        s.settings = Container()
+        uploader = Mock(spec_set=ArtifactUploader)
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.artifact_uploader') as mock_au, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.send_char_report') as mock_report:
+            mock_au.return_value = uploader
+            s.send_char_email('cname@rname', c_settings, 'diff', '/path/to/output.html',
+                              duration, 'output')
+            assert mock_report.call_args_list == []
+            files, callback = uploader.submit.call_args[0]
+            assert files[0] == ('/path/to/output.html', 'cname@rname.html', 'text/html')
+            assert files[1][1:] == ('cname@rname_simc_output.txt', 'text/plain')
+            assert files[1][0].read() == 'output'
+            callback({'cname@rname.html': 'http://x/h'})
+        assert mock_report.call_args_list == [
+            call('cname@rname', c_settings, 'diff', '/path/to/output.html', duration, 'output',
+                 links={'cname@rname.html': 'http://x/h'})]
+
+    def test_send_char_email_digest(self, mock_ns):
+        """ test send_char_email() with EMAIL_DIGEST """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        c_settings = {'realm': 'rname',
+                      'name': 'cname',
+                      'email': ['foo@example.com', 'bar@example.com']}
+        settings = Container()
+        setattr(settings, 'EMAIL_DIGEST', True)
+        s.settings = settings
+        s.sim_results['cname@rname'] = SimResult(None, None, None, None, [
+            ScenarioResult('ps1', 'cname', 1.0, 1.0, 1.0, 0.0),
+            ScenarioResult('baseline', 'cname', 2.0, 2.0, 2.0, 0.0)])
+        duration = datetime.timedelta(seconds=3723)
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.send_email') as mock_send:
+            s.send_char_email('cname@rname', c_settings, 'diff', '/path/to/output.html',
+                              duration, 'output')
+            s.send_char_email('other@rname', {'email': ['foo@example.com']}, 'diff2',
+                              '/path/to/other.html', duration, 'output2')
+        assert mock_send.call_args_list == []
+        assert list(s.digest) == [
+            ('foo@example.com', [
+                SimReport('cname@rname', 'diff', '/path/to/output.html', duration, 'output', 2.0, None),
+                SimReport('other@rname', 'diff2', '/path/to/other.html', duration, 'output2',
+                          None, None)]),
+            ('bar@example.com', [
+                SimReport('cname@rname', 'diff', '/path/to/output.html', duration, 'output', 2.0, None)]),
+        ]
+
+    def test_send_digests(self, mock_ns):
+        """ test send_digests() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        duration = datetime.timedelta(seconds=1)
+        r1 = SimReport('a@r', 'diff', '/a.html', duration, 'out', None, None)
+        r2 = SimReport('b@r', 'diff', '/b.html', duration, 'out', None, None)
+        s.digest.add('foo@example.com', r1)
+        s.digest.add('foo@example.com', r2)
+        s.digest.add('bar@example.com', r2)
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.send_email') as mock_send, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.format_digest') as mock_fd, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'platform.node') as mock_node, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'getpass.getuser') as mock_user:
+            mock_node.return_value = 'nodename'
+            mock_user.return_value = 'username'
+            mock_fd.return_value = 'msgbody'
+            with patch.object(s, 'report_sent') as mock_rs:
+                s.send_digests()
+                s.send_digests()
+        assert mock_rs.call_args_list == [call('a@r'), call('b@r')]
+        assert mock_fd.call_args_list == [
+            call('username@nodename', 'foo@example.com',
+                 'SimulationCraft reports for 2 characters', [r1, r2]),
+            call('username@nodename', 'bar@example.com',
+                 'SimulationCraft report for b@r', [r2]),
+        ]
+        assert mock_send.call_args_list == [
+            call('username@nodename', 'foo@example.com', 'msgbody'),
+            call('username@nodename', 'bar@example.com', 'msgbody'),
+        ]
+        assert mocklog.info.call_args_list == [
+            call('Sending digest of 2 reports to foo@example.com'),
+            call('Sending digest of 1 reports to bar@example.com'),
+        ]
+        assert len(s.digest) == 0
+
+    def test_send_digests_dryrun(self, mock_ns):
+        """ test send_digests() for a dry run """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.dry_run = True
+        s.digest.add('foo@example.com', SimReport('a@r', 'diff', '/a.html',
+                                                  datetime.timedelta(seconds=1), 'out', None,
+                                                  None))
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.send_email') as mock_send, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.format_digest') as mock_fd:
+            s.send_digests()
+        assert mock_fd.call_args_list == []
+        assert mock_send.call_args_list == []
+        assert mocklog.warning.call_args_list == [call("DRY RUN - not actually sending email")]
+
+    def test_format_digest(self, mock_ns, tmpdir):
+        """ test format_digest() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        tmpdir.join('a.html').write('<html>a</html>')
+        tmpdir.join('b.html').write('<html>b</html>')
+        duration = datetime.timedelta(seconds=3723)
+        reports = [
+            SimReport('a@r', CharacterDiff.note('diff a'), str(tmpdir.join('a.html')), duration,
+                      'out a', 1234.5, None),
+            SimReport('b@r', CharacterDiff.note(u'diff \xe9'), str(tmpdir.join('b.html')),
+                      duration, 'out b', None, None),
+        ]
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'platform.node') as mock_node, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.now') as mock_now:
+            mock_node.return_value = 'nodename'
+            mock_now.return_value = datetime.datetime(2014, 1, 1, 0, 0, 0)
+            with patch.object(s, 'VERSION', 'a.b.c'):
+                res = s.format_digest('from@me', 'foo@example.com', 'mysubj', reports)
+        assert res['Subject'] == 'mysubj'
+        assert res['To'] == 'foo@example.com'
+        parts = message_from_string(res.as_string()).get_payload()
+        body = parts[0].get_payload(decode=True).decode('utf-8')
+        assert body == (
+            u'SimulationCraft was run for the following characters:\n\n'
+            u'Character  Changes   Duration         DPS\n'
+            u'a@r              1    1:02:03      1234.5\n'
+            u'b@r              1    1:02:03            \n\n'
+            u'Changes for a@r:\n\ndiff a\n\n'
+            u'Changes for b@r:\n\ndiff \xe9\n\n'
+            u'The HTML reports and simc output are attached. (Note that you likely need to save '
+            u'the HTML attachments to disk and view them from there; they will not render '
+            u'correctly in most email clients.)\n\n'
+            u'This run was done on nodename at 2014-01-01 00:00:00 by autosimulationcraft.py '
+            u'va.b.c')
+        assert len(parts) == 5
+        assert parts[1].get_payload(decode=True) == '<html>a</html>'
+        assert parts[2].get_payload(decode=True) == 'out a'
+        assert parts[3].get_payload(decode=True) == '<html>b</html>'
+        assert parts[4].get_filename() == 'b@r_simc_output.txt'
+
+    def test_format_digest_zip(self, mock_ns, tmpdir):
+        """ test format_digest() with EMAIL_DIGEST_BUNDLE = 'zip' """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'EMAIL_DIGEST_BUNDLE', 'zip')
+        s.settings = settings
+        tmpdir.join('a.html').write('<html>a</html>')
+        reports = [SimReport('a@r', CharacterDiff.note('diff a'), str(tmpdir.join('a.html')),
+                             datetime.timedelta(seconds=1), 'out a', None, None)]
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.now') as mock_now:
+            mock_now.return_value = datetime.datetime(2014, 1, 2, 0, 0, 0)
+            res = s.format_digest('from@me', 'foo@example.com', 'mysubj', reports)
+        parts = message_from_string(res.as_string()).get_payload()
+        assert 'attached in a zip file.' in parts[0].get_payload()
+        assert len(parts) == 2
+        assert parts[1]['Content-Type'] == 'application/zip'
+        assert parts[1].get_filename() == 'simc_reports_2014-01-02.zip'
+        zf = zipfile.ZipFile(StringIO(parts[1].get_payload(decode=True)))
+        assert zf.read('a@r.html') == '<html>a</html>'
+
+    def test_format_digest_links(self, mock_ns, tmpdir):
+        """ test format_digest() with uploaded and attached reports """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'EMAIL_DIGEST_BUNDLE', 'zip')
+        s.settings = settings
+        tmpdir.join('b.html').write('<html>b</html>')
+        duration = datetime.timedelta(seconds=1)
+        links = {'a@r.html': 'http://x/a.html', 'a@r_simc_output.txt': 'http://x/a.txt'}
+        reports = [SimReport('a@r', CharacterDiff.note('diff a'), '/nonexistent/a.html',
+                             duration, 'out a', None, links)]
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.now') as mock_now:
+            mock_now.return_value = datetime.datetime(2014, 1, 2, 0, 0, 0)
+            res = s.format_digest('from@me', 'foo@example.com', 'mysubj', reports)
+            parts = message_from_string(res.as_string()).get_payload()
+            assert len(parts) == 1
+            body = parts[0].get_payload()
+            assert 'Changes for a@r:\n\ndiff a\n\nHTML report: http://x/a.html\n' \
+                'simc output: http://x/a.txt\n\n' in body
+            assert 'attached' not in body
+            reports.append(SimReport('b@r', CharacterDiff.note('diff b'),
+                                     str(tmpdir.join('b.html')), duration, 'out b', None, None))
+            res = s.format_digest('from@me', 'foo@example.com', 'mysubj', reports)
+        parts = message_from_string(res.as_string()).get_payload()
+        assert len(parts) == 2
+        zf = zipfile.ZipFile(StringIO(parts[1].get_payload(decode=True)))
+        assert zf.namelist() == ['b@r.html', 'b@r_simc_output.txt']
+
+    def test_deliver_email(self, mock_ns):
+        """ test deliver_email() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        s.settings = settings
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.send_gmail') as mock_gmail, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.send_local') as mock_local:
+            s.deliver_email('from', 'to', 'msg')
+            setattr(settings, 'GMAIL_USERNAME', 'me')
+            s.deliver_email('from', 'to2', 'msg')
+        assert mock_local.call_args_list == [call('from', 'to', 'msg')]
+        assert mock_gmail.call_args_list == [call('from', 'to2', 'msg')]
+
+    def test_format_message(self, mock_ns, tmpdir):
         """ test format_message() """
         bn, rc, mocklog, s, conn, lcc = mock_ns
         dest_addr = 'foo@example.com'
         subj = 'mysubj'
         c_name = 'cname@rname'
-        c_diff = 'characterDiffHere'
-        html_path = '/path/to/file.html'
+        c_diff = CharacterDiff.note('characterDiffHere')
+        html_path = str(tmpdir.join('file.html'))
         duration = datetime.timedelta(seconds=3723)  # 1h 2m 3s
         output = 'simcoutput'
         from_addr = 'from@me'
         htmlcontent = '<html><head><title>foo</title></head><body>bar</body></html>'
+        tmpdir.join('file.html').write(htmlcontent)
         expected = 'SimulationCraft was run for cname@rname due to the following changes:\n'
         expected += '\ncharacterDiffHere\n\n'
         expected += 'The run was completed in 1:02:03 and the HTML report is attached'
@@ -1323,8 +2961,6 @@ class Test_AutoSimulationCraft:
                    'platform.node') as mock_node, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'AutoSimulationCraft.now') as mock_now, \
-                patch('autosimulationcraft.autosimulationcraft.'
-                      'open', create=True) as mock_open, \
                 patch('autosimulationcraft.autosimulationcraft.'
                       'make_msgid') as mock_msgid, \
                 patch('autosimulationcraft.autosimulationcraft.'
@@ -1333,9 +2969,7 @@ class Test_AutoSimulationCraft:
             mock_date.return_value = 'mydate'
             mock_node.return_value = 'nodename'
             mock_now.return_value = datetime.datetime(2014, 1, 1, 0, 0, 0)
-            mock_open.return_value = MagicMock(spec=file)
             with patch.object(s, 'VERSION', 'a.b.c'):
-                mock_open.return_value.__enter__.return_value.read.return_value = htmlcontent
                 res = s.format_message(from_addr,
                                        dest_addr,
                                        subj,
@@ -1344,37 +2978,149 @@ class Test_AutoSimulationCraft:
                                        html_path,
                                        duration,
                                        output)
-        assert res['Subject'] == subj
-        assert res['To'] == dest_addr
-        assert res['From'] == 'AutoSimulationCraft <{f}>'.format(f=from_addr)
-        assert res['Date'] == 'mydate'
-        assert res['Message-Id'] == 'mymessageid'
-        assert res._payload[0]._payload == expected
-        assert b64decode(res._payload[1]._payload) == htmlcontent
-        assert (
-            'Content-Disposition',
-            'attachment; filename="cname@rname.html"') in res._payload[1]._headers
-        assert b64decode(res._payload[2]._payload) == output
-        assert (
-            'Content-Disposition',
-            'attachment; filename="cname@rname_simc_output.txt"') in res._payload[2]._headers
-        assert len(res._payload) == 3
-        file_handle = mock_open.return_value.__enter__.return_value
-        assert mock_open.call_args_list == [call('/path/to/file.html', 'r')]
-        assert file_handle.read.call_count == 1
+        # the HTML is only read when the message is written
+        tmpdir.join('file.html').write(htmlcontent + 'x')
+        msg = message_from_string(res.as_string())
+        assert msg['Subject'] == subj
+        assert msg['To'] == dest_addr
+        assert msg['From'] == 'AutoSimulationCraft <{f}>'.format(f=from_addr)
+        assert msg['Date'] == 'mydate'
+        assert msg['Message-Id'] == 'mymessageid'
+        parts = msg.get_payload()
+        assert len(parts) == 3
+        assert parts[0].get_payload(decode=True) == expected
+        assert parts[1].get_payload(decode=True) == htmlcontent + 'x'
+        assert parts[1].get_filename() == 'cname@rname.html'
+        assert parts[2].get_payload(decode=True) == output
+        assert parts[2].get_filename() == 'cname@rname_simc_output.txt'
         assert mock_date.call_args_list == [call(localtime=True)]
         assert mock_msgid.call_args_list == [call()]
 
+    def test_format_message_links(self, mock_ns):
+        """ test format_message() with links to the uploaded reports """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        links = {'cname@rname.html': 'http://x/h.html',
+                 'cname@rname_simc_output.txt': 'http://x/o.txt'}
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'platform.node') as mock_node, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.now') as mock_now:
+            mock_node.return_value = 'nodename'
+            mock_now.return_value = datetime.datetime(2014, 1, 1, 0, 0, 0)
+            with patch.object(s, 'VERSION', 'a.b.c'):
+                res = s.format_message('from@me', 'foo@example.com', 'mysubj', 'cname@rname',
+                                       CharacterDiff.note('characterDiffHere'),
+                                       '/nonexistent.html', datetime.timedelta(seconds=3723),
+                                       'simcoutput', links=links)
+        parts = message_from_string(res.as_string()).get_payload()
+        assert len(parts) == 1
+        assert parts[0].get_payload(decode=True) == (
+            'SimulationCraft was run for cname@rname due to the following changes:\n'
+            '\ncharacterDiffHere\n\n'
+            'The run was completed in 1:02:03. The HTML report is at:\n\n'
+            'http://x/h.html\n\nand the simc output is at:\n\nhttp://x/o.txt\n\n'
+            'This run was done on nodename at 2014-01-01 00:00:00 by '
+            'autosimulationcraft.py va.b.c')
+
+    def test_send_email_no_spool(self, mock_ns):
+        """ test send_email() with MAIL_SPOOL = False """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'MAIL_SPOOL', False)
+        s.settings = settings
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.deliver_email') as mock_deliver, \
+                patch('autosimulationcraft.autosimulationcraft.MailSender') as mock_sender:
+            s.send_email('from', 'to', 'msg')
+        assert mock_deliver.call_args_list == [call('from', 'to', 'msg')]
+        assert mock_sender.mock_calls == []
+        assert s.spool is None
+
+    def test_send_email_spool(self, mock_ns, tmpdir):
+        """ test send_email() adding to the mail spool """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'MAIL_RETRY_DELAY', 10)
+        s.settings = settings
+        s.confdir = str(tmpdir)
+        with patch('autosimulationcraft.autosimulationcraft.MailSender') as mock_sender:
+            s.send_email('from', 'to', 'msg1')
+            s.send_email('from', 'to2', 'msg2')
+        assert s.spool.path == str(tmpdir.join('mail_spool'))
+        assert [(e.dest, e.attempts) for e in s.spool.entries()] == [('to', 0), ('to2', 0)]
+        assert mock_sender.mock_calls == [
+            call(s.spool, s.deliver_email, mocklog, retry_delay=10, max_attempts=5),
+            call().start(),
+            call().wake(),
+            call().wake(),
+        ]
+
+    def test_resume_mail(self, mock_ns, tmpdir):
+        """ test resume_mail() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.confdir = str(tmpdir)
+        with patch('autosimulationcraft.autosimulationcraft.MailSender') as mock_sender:
+            s.resume_mail()
+            assert mock_sender.mock_calls == []
+            s.mail_spool().add('from', 'to', 'msg')
+            s.dry_run = True
+            s.resume_mail()
+            assert mock_sender.mock_calls == []
+            s.dry_run = False
+            s.resume_mail()
+        assert mock_sender.mock_calls == [
+            call(s.spool, s.deliver_email, mocklog, retry_delay=60, max_attempts=5),
+            call().start()]
+        assert mocklog.info.call_args_list == [call("Resuming delivery of 1 spooled emails")]
+
+    def test_finish_mail(self, mock_ns, tmpdir):
+        """ test finish_mail() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        settings = Container()
+        setattr(settings, 'MAIL_SPOOL_WAIT', 30)
+        s.settings = settings
+        s.confdir = str(tmpdir)
+        s.finish_mail()
+        sender = Mock()
+        s.mail_sender = sender
+        s.finish_mail()
+        assert sender.mock_calls == [call.stop(wait=30)]
+        assert s.mail_sender is None
+        assert mocklog.warning.call_args_list == []
+        s.mail_spool().add('from', 'to', 'msg')
+        s.mail_sender = sender
+        s.finish_mail()
+        assert mocklog.warning.call_args_list == [
+            call("1 emails could not be sent yet; they will be retried on the next run")]
+
+    def test_artifact_uploader(self, mock_ns, tmpdir):
+        """ test artifact_uploader() and finish_uploads() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        assert s.artifact_uploader() is None
+        s.finish_uploads()
+        setattr(s.settings, 'ARTIFACT_BACKEND', {'type': 'directory', 'path': str(tmpdir)})
+        uploader = s.artifact_uploader()
+        assert isinstance(uploader, ArtifactUploader)
+        assert uploader.backend.path == str(tmpdir)
+        assert s.artifact_uploader() is uploader
+        with patch.object(uploader, 'wait') as mock_wait:
+            s.finish_uploads()
+        assert mock_wait.call_args_list == [call()]
+        assert mocklog.debug.call_args_list[-1] == call("Waiting for report uploads to finish")
+
     def test_send_local(self, mock_ns):
         """ send_local() test """
         bn, rc, mocklog, s, conn, lcc = mock_ns
         with patch('autosimulationcraft.autosimulationcraft.'
-                   'smtplib.SMTP', autospec=True) as mock_smtp:
+                   'smtplib.SMTP', autospec=True) as mock_smtp, \
+                patch('autosimulationcraft.autosimulationcraft.send_message') as mock_send:
             s.send_local('from', 'to', 'msg')
         assert mock_smtp.mock_calls == [call('localhost'),
-                                        call().sendmail('from', ['to'], 'msg'),
                                         call().quit()
                                         ]
+        assert mock_send.call_args_list == [call(mock_smtp.return_value, 'from', 'to', 'msg')]
 
     def test_send_gmail(self, mock_ns):
         """ send_gmail() test """
@@ -1383,17 +3129,211 @@ class Test_AutoSimulationCraft:
         setattr(settings, 'GMAIL_USERNAME', 'myusername')
         setattr(settings, 'GMAIL_PASSWORD', 'mypassword')
         with patch('autosimulationcraft.autosimulationcraft.'
-                   'smtplib.SMTP', autospec=True) as mock_smtp:
+                   'smtplib.SMTP', autospec=True) as mock_smtp, \
+                patch('autosimulationcraft.autosimulationcraft.send_message') as mock_send:
             s.settings = settings
             s.send_gmail('from', 'to', 'msg')
         assert mock_smtp.mock_calls == [call('smtp.gmail.com:587'),
                                         call().starttls(),
-                                        call().login(
-            'myusername',
-            'mypassword'),
-            call().sendmail('from', ['to'], 'msg'),
-            call().quit()
+                                        call().login('myusername', 'mypassword'),
+                                        call().quit()]
+        assert mock_send.call_args_list == [call(mock_smtp.return_value, 'from', 'to', 'msg')]
+
+    def test_characters_to_run(self, mock_ns):
+        """ test characters_to_run() without GUILDS """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        chars = [{'name': 'nameone', 'realm': 'realmone'}]
+        s_container = Container()
+        setattr(s_container, 'CHARACTERS', chars)
+        s.settings = s_container
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.guild_characters') as mock_gc:
+            res = s.characters_to_run()
+        assert res == chars
+        assert res is not chars
+        assert mock_gc.call_args_list == []
+
+    def test_characters_to_run_offline(self, mock_ns, tmpdir):
+        """ test characters_to_run() with GUILDS in offline mode """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        chars = [{'name': 'nameone', 'realm': 'realmone'}]
+        guilds = [{'name': 'g1', 'realm': 'realmone', 'email': 'g1@example.com', 'region': 'us'},
+                  {'name': 'g2', 'realm': 'realmone', 'email': 'g2@example.com', 'region': 'us'}]
+        s_container = Container()
+        setattr(s_container, 'CHARACTERS', chars)
+        setattr(s_container, 'GUILDS', guilds)
+        s.settings = s_container
+        s.confdir = str(tmpdir)
+        s.offline = True
+        s.write_guild_members({('us', 'realmone', 'g1'): [('realmone', 'nameone'),
+                                                          ('realmtwo', 'nametwo')],
+                               ('eu', 'realmone', 'g2'): [('realmone', 'namethree')]})
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.guild_characters') as mock_gc:
+            res = s.characters_to_run()
+        assert res == chars + [{'name': 'nametwo', 'realm': 'realmtwo', 'email': 'g1@example.com',
+                                'region': 'us'}]
+        assert mock_gc.call_args_list == []
+        assert mocklog.info.call_args_list == [
+            call("Offline mode; using the members of GUILDS found by the last online run")]
+
+    def test_run_only_offline(self, mock_ns):
+        """ test run() in offline mode, with only """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        chars = [{'name': 'one', 'realm': 'r'}, {'name': 'two', 'realm': 'r'},
+                 {'name': 'three', 'realm': 'r'}]
+        s.offline = True
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.resume_mail'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.resume_run'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.lock_run'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.claim_character'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.migrate_character_keys'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.finish_mail'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.characters_to_run') as mock_ctr, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.fetch_characters') as mock_fetch, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.run_offline') as mock_offline:
+            mock_ctr.return_value = chars
+            s.run(only=['three@r', 'one@r'])
+        assert mock_offline.call_args_list == [call([chars[0], chars[2]])]
+        assert mock_fetch.call_args_list == []
+
+    def test_run_offline(self, mock_ns, char_data):
+        """ test run_offline() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        rec = CharacterRecord.from_bnet(char_data)
+        bad = CharacterRecord.from_bnet(char_data)
+        bad.class_id = 99
+        s.character_cache = {'one@r': rec, 'three@r': bad}
+        chars = [{'name': 'one', 'realm': 'r'}, {'name': 'two', 'realm': 'r'},
+                 {'name': 'three', 'realm': 'r'}]
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.resume_mail'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.resume_run'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.lock_run'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.claim_character'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.migrate_character_keys'), \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.finish_mail') as mock_fm, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.do_character') as mock_do_char, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.write_sim_history') as mock_wsh, \
+                patch('autosimulationcraft.autosimulationcraft.'
+                      'AutoSimulationCraft.write_character_cache') as mock_wcc:
+            s.run_offline(chars)
+        note = CharacterDiff.note("Re-simulation of cached character data (offline mode).")
+        assert mock_do_char.call_args_list == [call('one@r', chars[0], note, rec)]
+        assert mock_wsh.call_count == 1
+        assert mock_wcc.call_count == 0
+        assert mock_fm.call_args_list == [call()]
+        assert mocklog.warning.call_args_list == [
+            call("Character two@r is not in the cache; skipping."),
+            call("Unable to generate simc profile for three@r (unknown class id 99); skipping.")]
+
+    def test_characters_to_run_guilds(self, mock_ns, tmpdir):
+        """ test characters_to_run() with GUILDS """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        chars = [{'name': 'nameone', 'realm': 'realm one', 'email': ['one@example.com']}]
+        guilds = [{'name': 'g1', 'realm': 'realm one'}, {'name': 'g2', 'realm': 'realm one'},
+                  {'name': 'g3', 'realm': 'realm one'}]
+        s_container = Container()
+        setattr(s_container, 'CHARACTERS', chars)
+        setattr(s_container, 'GUILDS', guilds)
+        s.settings = s_container
+        s.confdir = str(tmpdir)
+        s.write_guild_members({('us', 'realm one', 'g1'): [('realm one', 'old')],
+                               ('us', 'realm one', 'g3'): [('realm one', 'kept')]})
+
+        def se_gc(guild):
+            if guild['name'] == 'g1':
+                return [{'name': 'nameone', 'realm': 'realm one', 'email': ['g1@example.com']},
+                        {'name': 'nametwo', 'realm': 'realm one', 'email': ['g1@example.com']}]
+            if guild['name'] == 'g3':
+                return None
+            return [{'name': 'nametwo', 'realm': 'realmone', 'email': ['g2@example.com']},
+                    {'name': 'namethree', 'realm': 'realm one', 'email': ['g2@example.com']}]
+
+        with patch('autosimulationcraft.autosimulationcraft.'
+                   'AutoSimulationCraft.guild_characters') as mock_gc:
+            mock_gc.side_effect = se_gc
+            res = s.characters_to_run()
+        assert res == [
+            {'name': 'nameone', 'realm': 'realm one', 'email': ['one@example.com']},
+            {'name': 'nametwo', 'realm': 'realm one', 'email': ['g1@example.com']},
+            {'name': 'namethree', 'realm': 'realm one', 'email': ['g2@example.com']},
+        ]
+        assert mock_gc.call_args_list == [call(guilds[0]), call(guilds[1]), call(guilds[2])]
+        assert s.load_guild_members() == {
+            ('us', 'realm one', 'g1'): [('realm one', 'nameone'), ('realm one', 'nametwo')],
+            ('us', 'realm one', 'g2'): [('realmone', 'nametwo'), ('realm one', 'namethree')],
+            ('us', 'realm one', 'g3'): [('realm one', 'kept')],
+        }
+
+    def test_guild_characters(self, mock_ns):
+        """ test guild_characters() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        guild = {'name': 'My Guild',
+                 'realm': 'Area 52',
+                 'email': ['foo@example.com'],
+                 'options': {'threads': 2},
+                 'min_level': 100,
+                 'ranks': [0, 1]}
+        conn.get_guild.return_value = {
+            'name': 'My Guild',
+            'members': [
+                {'character': {'name': 'one', 'realm': 'Area 52', 'level': 100}, 'rank': 0},
+                {'character': {'name': 'two', 'realm': 'Area 52', 'level': 90}, 'rank': 1},
+                {'character': {'name': 'three', 'realm': 'Area 52', 'level': 100}, 'rank': 5},
+                {'character': {'name': 'four', 'realm': 'Other', 'level': 100}, 'rank': 1},
+            ]
+        }
+        res = s.guild_characters(guild)
+        assert conn.get_guild.call_args_list == [
+            call(battlenet.UNITED_STATES, 'Area 52', 'My Guild', fields=['members'], raw=True)]
+        assert res == [
+            {'name': 'one', 'realm': 'Area 52', 'email': ['foo@example.com'],
+             'options': {'threads': 2}},
+            {'name': 'four', 'realm': 'Other', 'email': ['foo@example.com'],
+             'options': {'threads': 2}},
         ]
+        assert mocklog.info.call_args_list == [
+            call("Found 2 of 4 members of guild My Guild to run")]
+
+    def test_guild_characters_no_filters(self, mock_ns):
+        """ test guild_characters() with no level or rank filters """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        conn.get_guild.return_value = {
+            'members': [
+                {'character': {'name': 'one', 'level': 10}, 'rank': 9},
+            ]
+        }
+        res = s.guild_characters({'name': 'g', 'realm': 'r'})
+        assert res == [{'name': 'one', 'realm': 'r'}]
+
+    def test_guild_characters_not_found(self, mock_ns):
+        """ test guild_characters() with guild not found """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        conn.get_guild.side_effect = battlenet.exceptions.GuildNotFound()
+        res = s.guild_characters({'name': 'g', 'realm': 'r'})
+        assert res is None
+        assert mocklog.error.call_args_list == [
+            call("ERROR - Guild Not Found - realm='r' guild='g'")]
 
     def test_make_char_name(self, mock_ns):
         """ make_character_name() tests """
@@ -1403,6 +3343,49 @@ class Test_AutoSimulationCraft:
         assert s.make_character_name(
             'sómÊñámé',
             'Area 52') == 'sómÊñámé@Area52'
+        assert s.make_character_name('n', 'r', 'us') == 'n@r'
+        # unicode (i.e. from the API) gives the same UTF-8 str
+        assert s.make_character_name(u'sómÊñámé', u'Area 52') == 'sómÊñámé@Area52'
+        assert s.make_character_name('n', 'Area 52', 'EU') == 'n@Area52.eu'
+        assert s.character_name({'name': 'n', 'realm': 'r', 'region': 'kr'}) == 'n@r.kr'
+        assert s.character_name({'name': 'n', 'realm': 'r'}) == 'n@r'
+
+    def test_migrate_character_keys(self, mock_ns, tmpdir):
+        """ test migrate_character_keys() """
+        bn, rc, mocklog, s, conn, lcc = mock_ns
+        s.settings = Container()
+        s.confdir = str(tmpdir)
+        # written with the old (region-less) names
+        s.character_cache = {'eu@r': 'eu rec', 'same@r': 'us rec', 'x@r': 'x rec'}
+        s.cache_updated = set(s.character_cache.keys())
+        s.write_character_cache()
+        s.sim_history = {'eu@r': {'durations': [1.0]}}
+        s.history_updated = set(['eu@r'])
+        s.write_sim_history()
+        s.results_store().add_run('eu@r', datetime.datetime(2015, 1, 1), 1.0)
+        s.history_store().append('eu@r', datetime.datetime(2015, 1, 1), 100.0)
+        for ext in ['simc', 'html']:
+            tmpdir.join('eu@r.' + ext).write(ext)
+        chars = [{'name': 'eu', 'realm': 'r', 'region': 'eu'},
+                 {'name': 'same', 'realm': 'r', 'region': 'us'},
+                 {'name': 'same', 'realm': 'r', 'region': 'eu'},
+                 {'name': 'new', 'realm': 'r', 'region': 'tw'},
+                 'invalid']
+        s.migrate_character_keys(chars)
+        expected = {'eu@r.eu': 'eu rec', 'same@r': 'us rec', 'x@r': 'x rec'}
+        assert s.character_cache == expected
+        assert s.load_character_cache() == expected
+        assert s.load_sim_history() == {'eu@r.eu': {'durations': [1.0]}}
+        assert len(s.results_store().runs('eu@r.eu')) == 1
+        assert s.results_store().runs('eu@r') == []
+        assert len(s.history_store().load('eu@r.eu')[1]) == 1
+        assert tmpdir.join('eu@r.eu.simc').read() == 'simc'
+        assert tmpdir.join('eu@r.eu.html').read() == 'html'
+        assert tmpdir.join('eu@r.simc').check() is False
+        assert mocklog.info.call_args_list == [call("Moved the data for eu@r to eu@r.eu")]
+        # nothing left to move
+        s.migrate_character_keys(chars)
+        assert mocklog.info.call_count == 1
 
     @freeze_time("2014-01-01 01:02:03")
     def test_now(self, mock_ns):
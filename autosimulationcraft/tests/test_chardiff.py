@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for chardiff module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+from copy import deepcopy
+
+from autosimulationcraft.chardiff import (CharacterDiff, Change, diff_records,
+                                          render_change)
+from autosimulationcraft.record import CharacterRecord, Item
+from data_fixtures import bnet_data, char_data
+
+
+def make_flakes_happy():
+    """
+    hack to make flakes think fixtures are used.
+    this function never gets executed.
+    """
+    print(bnet_data, char_data)
+
+
+def test_diff_records_same(char_data):
+    old = CharacterRecord.from_bnet(char_data)
+    new = CharacterRecord.from_bnet(deepcopy(char_data))
+    res = diff_records(old, new)
+    assert len(res) == 0
+    assert res.text() == ''
+
+
+def test_diff_records(char_data):
+    old = CharacterRecord.from_bnet(char_data)
+    data = deepcopy(char_data)
+    data['level'] = 101
+    data['talents'][0]['calcTalent'] = '110201.'
+    data['talents'][0]['glyphs']['minor'] = []
+    data['talents'][0]['glyphs']['major'].append({'name': 'Glyph of Foo'})
+    data['items']['shoulder']['id'] = 114395
+    data['items']['neck']['bonusLists'] = [15, 16]
+    data['items']['neck']['tooltipParams'] = {'enchant': 5324, 'gem0': 115809}
+    del data['items']['trinket2']
+    data['items']['shirt'] = {'id': 1}
+    data['items']['head']['name'] = 'Not Compared'
+    data['stats']['critRating'] = 900
+    data['appearance']['hairColor'] = 1
+    data['professions']['primary'][0]['rank'] = 700
+    new = CharacterRecord.from_bnet(data)
+    res = diff_records(old, new)
+    assert res.lines() == [
+        'level changed from 100 to 101',
+        'talent tier 6 changed from column 1 to column 2',
+        'glyph removed: Glyph of Nightmares',
+        'glyph added: Glyph of Foo',
+        'neck: item 114951 bonus ids changed from 15 to 15/16; enchant changed from none '
+        'to 5324; gems changed from none to 115809',
+        'shirt: equipped item 1',
+        'shoulder: item 115997 replaced by item 114395',
+        'trinket2: removed item 114367',
+        'stat critRating changed from 825 to 900',
+        'appearance hairColor changed from 9 to 1',
+    ]
+    assert len(res) == 10
+    assert str(res) == '\n'.join(res.lines())
+    no_stat = diff_records(old, new, no_stat=True)
+    assert len(no_stat) == 9
+    assert 'stat critRating changed from 825 to 900' not in no_stat.lines()
+
+
+def test_diff_records_talents(char_data):
+    old = CharacterRecord.from_bnet(char_data)
+    new = CharacterRecord.from_bnet(char_data)
+    new.talents = '1'
+    res = diff_records(old, new)
+    assert res.changes == [Change('talent', 2, '1', '.'),
+                           Change('talent', 3, '0', '.'),
+                           Change('talent', 4, '2', '.'),
+                           Change('talent', 5, '0', '.'),
+                           Change('talent', 6, '0', '.')]
+    assert res.lines()[0] == 'talent tier 2 changed from column 2 to none'
+
+
+def test_render_change_scalar():
+    assert render_change(Change('character', 'spec', 'Affliction', 'Destruction')) == \
+        'spec changed from Affliction to Destruction'
+    assert render_change(Change('character', 'spec', None, 'Destruction')) == \
+        'spec changed from none to Destruction'
+
+
+def test_render_change_item_upgrade():
+    old = Item('head', 1, (), None, (), 1)
+    new = Item('head', 1, (), None, (), 2)
+    assert render_change(Change('item', 'head', old, new)) == \
+        'head: item 1 upgrade level changed from 1 to 2'
+
+
+def test_note():
+    d = CharacterDiff.note('foo bar')
+    assert len(d) == 1
+    assert d.text() == 'foo bar'
+    assert d == CharacterDiff.note('foo bar')
+    assert d != CharacterDiff.note('baz')
+
+
+def test_html():
+    d = CharacterDiff([Change('character', 'level', 1, 2),
+                       Change('note', None, None, 'a <b> & c')])
+    assert d.html() == ('<ul>\n<li>level changed from 1 to 2</li>\n'
+                        '<li>a &lt;b&gt; &amp; c</li>\n</ul>')
+
+
+def test_render_is_lazy():
+    class Exploding(object):
+        def __eq__(self, other):
+            return False
+
+        def __str__(self):
+            raise AssertionError('rendered')
+
+    d = CharacterDiff([Change('character', 'level', Exploding(), 2)])
+    assert len(d) == 1
+    assert repr(d) == '<CharacterDiff (1 changes)>'
+
+
+def test_item_names():
+    names = {1: u'Foo', 2: u'Bar'}
+    d = CharacterDiff([Change('item', 'head', Item('head', 1, (), None, (), None),
+                              Item('head', 2, (), None, (), None)),
+                       Change('item', 'neck', None, Item('neck', 3, (), None, (), None))],
+                      item_name=names.get)
+    assert d.lines() == ['head: item 1 (Foo) replaced by item 2 (Bar)',
+                         'neck: equipped item 3']
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for digest module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import zipfile
+import datetime
+from StringIO import StringIO
+
+from autosimulationcraft.chardiff import CharacterDiff, Change
+from autosimulationcraft.digest import Digest, SimReport, summary_table, zip_bundle
+
+
+def report(c_name, html_path='/dev/null', dps=None, changes=1):
+    diff = CharacterDiff([Change('character', 'level', 99, 100)] * changes)
+    return SimReport(c_name, diff, html_path, datetime.timedelta(seconds=3723), 'out', dps,
+                     None)
+
+
+def test_digest():
+    d = Digest()
+    assert len(d) == 0
+    a = report('a@r')
+    b = report('b@r')
+    d.add('x@example.com', a)
+    d.add('y@example.com', a)
+    d.add('x@example.com', b)
+    assert len(d) == 2
+    assert list(d) == [('x@example.com', [a, b]), ('y@example.com', [a])]
+    d.clear()
+    assert list(d) == []
+
+
+def test_summary_table():
+    res = summary_table([report('a@r', dps=12345.678, changes=3),
+                         report(u'Jäntman@Area52')])
+    assert res.split(u'\n') == [
+        u'Character       Changes   Duration         DPS',
+        u'a@r                   3    1:02:03     12345.7',
+        u'Jäntman@Area52        1    1:02:03            ',
+    ]
+    # character names are UTF-8 str
+    assert summary_table([report(u'Jäntman@Area52'.encode('utf-8'))]).split(u'\n')[1] == \
+        u'Jäntman@Area52        1    1:02:03            '
+
+
+def test_zip_bundle(tmpdir):
+    tmpdir.join('a.html').write('<html>a</html>')
+    tmpdir.join('b.html').write('<html>b</html>' * 1000)
+    buf = StringIO()
+    zip_bundle([report('a@r', html_path=str(tmpdir.join('a.html'))),
+                report('b@r', html_path=str(tmpdir.join('b.html')))], buf)
+    data = buf.getvalue()
+    zf = zipfile.ZipFile(StringIO(data))
+    assert zf.namelist() == ['a@r.html', 'a@r_simc_output.txt', 'b@r.html',
+                             'b@r_simc_output.txt']
+    assert zf.read('b@r.html') == '<html>b</html>' * 1000
+    assert zf.read('a@r_simc_output.txt') == 'out'
+    assert zf.getinfo('b@r.html').compress_type == zipfile.ZIP_DEFLATED
+    assert len(data) < 1000
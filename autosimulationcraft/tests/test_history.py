@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for history module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+import datetime
+import pytest
+
+from autosimulationcraft.history import (DPSHistory, HistoryStats, percentile, to_timestamp,
+                                         from_timestamp)
+
+
+def day(n, hour=0):
+    return datetime.datetime(2015, 3, n, hour, 0, 0)
+
+
+def filled(tmpdir):
+    hist = DPSHistory(str(tmpdir.join('history')))
+    for n, dps in enumerate([100.0, 110.0, 90.0, 130.0, 120.0], start=1):
+        hist.append('a@r', day(n), dps)
+    hist.append(u'Jäntman@Area52', day(2), 50.0)
+    hist.append(u'Jäntman@Area52', day(9), 80.0)
+    return hist
+
+
+def test_timestamps():
+    dt = datetime.datetime(2015, 3, 29, 2, 30, 0, 500000)
+    assert to_timestamp(dt) == 1427596200.5
+    assert from_timestamp(to_timestamp(dt)) == dt
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([5.0], 90) == 5.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5
+    assert percentile([1.0, 2.0, 3.0, 4.0], 100) == 4.0
+    assert percentile([0.0, 10.0], 90) == 9.0
+
+
+def test_append_load(tmpdir):
+    hist = filled(tmpdir)
+    times, values = hist.load('a@r')
+    assert list(values) == [100.0, 110.0, 90.0, 130.0, 120.0]
+    assert [from_timestamp(t) for t in times] == [day(n) for n in range(1, 6)]
+    assert os.path.getsize(str(tmpdir.join('history', 'a@r.dps'))) == 5 * 8
+    assert hist.characters() == [u'Jäntman@Area52', u'a@r']
+    assert [len(c) for c in hist.load('x@r')] == [0, 0]
+    assert DPSHistory(str(tmpdir.join('nothing'))).characters() == []
+
+
+def test_rename(tmpdir):
+    hist = filled(tmpdir)
+    expected = hist.load('a@r')
+    assert hist.rename('a@r', 'a@r.eu') is True
+    assert hist.load('a@r.eu') == expected
+    assert [len(c) for c in hist.load('a@r')] == [0, 0]
+    assert hist.rename('a@r', 'a@r.eu') is False
+    hist.append('a@r', day(9), 1.0)
+    assert hist.rename('a@r', 'a@r.eu') is False
+    assert hist.load('a@r.eu') == expected
+
+
+def test_load_partial_and_unordered(tmpdir):
+    hist = filled(tmpdir)
+    # an interrupted append
+    with open(str(tmpdir.join('history', 'a@r.t')), 'ab') as fh:
+        fh.write('\0' * 8)
+    hist.append('a@r', day(3, 12), 95.0)
+    hist.append('a@r', day(6), 140.0)
+    times, values = hist.load('a@r')
+    assert len(times) == 7
+    assert list(values) == [100.0, 110.0, 90.0, 95.0, 130.0, 120.0, 140.0]
+    assert from_timestamp(times[3]) == day(3, 12)
+
+
+def test_series(tmpdir):
+    hist = filled(tmpdir)
+    times, values = hist.series('a@r', start=day(2), end=day(4))
+    assert list(values) == [110.0, 90.0]
+    assert list(hist.series('a@r', start=day(4, 1))[1]) == [120.0]
+    assert list(hist.series('a@r', end=day(2))[1]) == [100.0]
+
+
+def test_rolling_mean(tmpdir):
+    hist = filled(tmpdir)
+    assert hist.rolling_mean('a@r', 2) == [
+        (day(1), 100.0, 100.0),
+        (day(2), 110.0, 105.0),
+        (day(3), 90.0, 100.0),
+        (day(4), 130.0, 110.0),
+        (day(5), 120.0, 125.0),
+    ]
+    assert hist.rolling_mean('a@r', 3, start=day(3)) == [
+        (day(3), 90.0, 90.0),
+        (day(4), 130.0, 110.0),
+        (day(5), 120.0, 340.0 / 3),
+    ]
+    with pytest.raises(ValueError):
+        hist.rolling_mean('a@r', 0)
+
+
+def test_stats(tmpdir):
+    hist = filled(tmpdir)
+    assert hist.stats('a@r') == HistoryStats('a@r', 5, 100.0, 120.0, 20.0, 110.0, 110.0, 126.0)
+    assert hist.stats('a@r', start=day(10)) is None
+
+
+def test_report(tmpdir):
+    hist = filled(tmpdir)
+    assert hist.report(start=day(2)).split(u'\n') == [
+        u'Character        Runs       First        Last      Change        Mean         p50         p90',
+        u'Jäntman@Area52      2        50.0        80.0       +30.0        65.0        65.0        77.0',
+        u'a@r                 4       110.0       120.0       +10.0       112.5       115.0       127.0',
+        u'All                 6                               +20.0  (mean change)',
+    ]
+    assert hist.report(characters=['a@r'], start=day(4), window=2).split(u'\n')[2:] == [
+        u'All            2                               -10.0  (mean change)',
+        u'',
+        u'a@r (rolling mean of 2 runs):',
+        u'  2015-03-04 00:00       130.0       130.0',
+        u'  2015-03-05 00:00       120.0       125.0',
+    ]
+    assert hist.report(characters=['x@r']) == 'No DPS history found.'
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for httpcache module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+import json
+
+import pytest
+import battlenet
+from battlenet.exceptions import APIError
+
+from autosimulationcraft.httpcache import HTTPCache, CachingConnection
+from fixtures import api
+
+
+def make_flakes_happy():
+    """
+    hack to make flakes think fixtures are used.
+    this function never gets executed.
+    """
+    print(api)
+
+
+def connection(api, cache):
+    conn = CachingConnection(cache=cache)
+    conn.url_format = 'http://127.0.0.1:{p}/%(region)s/%(game)s%(path)s?%(params)s'.format(
+        p=api.server_port)
+    return conn
+
+
+def test_conditional_request(api, tmpdir):
+    body = json.dumps({'name': 'Jantman', 'realm': 'Area 52', 'level': 100})
+    path = '/us/wow/character/area%2052/jantman?fields=items,talents'
+    api.responses[path] = ('"abc"', body)
+    cache = HTTPCache(str(tmpdir.join('cache')))
+    conn = connection(api, cache)
+    res1 = conn.get_character(battlenet.UNITED_STATES, 'Area 52', 'Jantman',
+                              fields=['items', 'talents'], raw=True)
+    res2 = conn.get_character(battlenet.UNITED_STATES, 'Area 52', 'Jantman',
+                              fields=['items', 'talents'], raw=True)
+    assert res1 == res2
+    assert res1['level'] == 100
+    assert len(api.requests) == 2
+    assert 'if-none-match' not in api.requests[0][1]
+    assert api.requests[1][1]['if-none-match'] == '"abc"'
+    assert api.requests[1][1]['if-modified-since'] == 'Wed, 01 Jan 2014 00:00:00 GMT'
+
+
+def test_changed_response(api, tmpdir):
+    path = '/us/wow/item/1?'
+    api.responses[path] = ('"v1"', json.dumps({'name': 'one'}))
+    conn = connection(api, HTTPCache(str(tmpdir)))
+    assert conn.make_request('us', '/item/1')['name'] == 'one'
+    api.responses[path] = ('"v2"', json.dumps({'name': 'two'}))
+    assert conn.make_request('us', '/item/1')['name'] == 'two'
+    assert conn.make_request('us', '/item/1')['name'] == 'two'
+    url = conn.build_request('us', '/item/1')[0]
+    assert conn.cache.get(url)['etag'] == '"v2"'
+    assert [r[1].get('if-none-match') for r in api.requests] == [None, '"v1"', '"v2"']
+
+
+def test_no_validators_not_cached(api, tmpdir):
+    api.responses['/us/wow/item/1?'] = (None, json.dumps({'name': 'one'}))
+    cache = HTTPCache(str(tmpdir))
+    conn = connection(api, cache)
+    conn.make_request('us', '/item/1')
+    conn.make_request('us', '/item/1')
+    assert cache.entries() == []
+    assert 'if-none-match' not in api.requests[1][1]
+
+
+def test_errors(api, tmpdir):
+    api.responses['/us/wow/item/2?'] = ('"x"', 'not json')
+    api.responses['/us/wow/item/3?'] = ('"y"', json.dumps({'status': 'nok', 'reason': 'nope'}))
+    conn = connection(api, HTTPCache(str(tmpdir)))
+    with pytest.raises(APIError):
+        conn.make_request('us', '/item/1')
+    with pytest.raises(APIError) as excinfo:
+        conn.make_request('us', '/item/2')
+    assert str(excinfo.value) == 'Non-JSON Response'
+    with pytest.raises(APIError) as excinfo:
+        conn.make_request('us', '/item/3')
+    assert str(excinfo.value) == 'nope'
+    with pytest.raises(battlenet.CharacterNotFound):
+        conn.get_character('us', 'realm', 'nobody')
+
+
+def test_no_cache(api):
+    api.responses['/us/wow/item/1?'] = ('"v1"', json.dumps({'name': 'one'}))
+    conn = connection(api, None)
+    conn.make_request('us', '/item/1')
+    conn.make_request('us', '/item/1')
+    assert 'if-none-match' not in api.requests[1][1]
+
+
+def test_cache_eviction(tmpdir):
+    cache = HTTPCache(str(tmpdir), max_entries=2)
+    cache.put('http://a', '"a"', None, 'A')
+    cache.put('http://b', '"b"', None, 'B')
+    os.utime(cache.entry_path('http://a'), (1000, 1000))
+    os.utime(cache.entry_path('http://b'), (2000, 2000))
+    assert cache.get('http://a')['body'] == 'A'
+    cache.put('http://c', '"c"', None, 'C')
+    assert len(cache.entries()) == 2
+    assert cache.get('http://b') is None
+    assert cache.get('http://a')['body'] == 'A'
+    assert cache.get('http://c')['body'] == 'C'
+    cache.put('http://c', '"c2"', None, 'C2')
+    assert len(cache.entries()) == 2
+    assert cache.get('http://c')['etag'] == '"c2"'
+
+
+def test_cache_bad_entry(tmpdir):
+    cache = HTTPCache(str(tmpdir.join('sub')))
+    assert os.path.isdir(str(tmpdir.join('sub')))
+    with open(cache.entry_path('http://a'), 'wb') as fh:
+        fh.write('garbage')
+    assert cache.get('http://a') is None
+    assert cache.get('http://nonexistent') is None
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for items module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+from mock import Mock, call
+
+from autosimulationcraft.items import ItemStore, ItemInfo, item_info_from_bnet
+from data_fixtures import bnet_data, char_data
+
+
+def make_flakes_happy():
+    """
+    hack to make flakes think fixtures are used.
+    this function never gets executed.
+    """
+    print(bnet_data, char_data)
+
+
+def info(i):
+    return ItemInfo('item{i}'.format(i=i), 'icon{i}'.format(i=i), 3, 600 + i)
+
+
+def test_item_info_from_bnet(char_data):
+    assert item_info_from_bnet(char_data['items']['shoulder']) == ItemInfo(
+        u'Twin-Gaze Spaulders', u'inv_shoulder_cloth_draenorlfr_c_01', 4, 640)
+    assert item_info_from_bnet({}) == ItemInfo(None, None, None, None)
+
+
+def test_lru_eviction():
+    store = ItemStore('/dev/null', max_size=3)
+    for i in range(3):
+        store.put(i, info(i))
+    assert store.get(0) == info(0)
+    store.put(3, info(3))
+    assert len(store) == 3
+    assert 1 not in store
+    assert store.get(1) is None
+    assert list(store.items.keys()) == [2, 0, 3]
+
+
+def test_add_from_bnet(char_data):
+    store = ItemStore('/dev/null')
+    store.add_from_bnet(char_data['items'])
+    assert len(store) == 15
+    assert store.get(118942).name == u'Crown of Power'
+    assert store.dirty is True
+
+
+def test_lookup():
+    store = ItemStore('/dev/null')
+    store.put(1, info(1))
+    fetch = Mock()
+    fetch.return_value = {'name': 'foo', 'icon': 'bar', 'quality': 4, 'itemLevel': 700}
+    assert store.lookup(1, fetch) == info(1)
+    assert store.lookup(2, fetch) == ItemInfo('foo', 'bar', 4, 700)
+    assert store.lookup(2, fetch) == ItemInfo('foo', 'bar', 4, 700)
+    assert fetch.call_args_list == [call(2)]
+
+
+def test_lookup_not_found():
+    store = ItemStore('/dev/null')
+    fetch = Mock()
+    fetch.return_value = None
+    assert store.lookup(2, fetch) is None
+    assert 2 not in store
+
+
+def test_save_load(tmpdir):
+    path = str(tmpdir.join('items.pkl'))
+    store = ItemStore(path)
+    store.load()
+    assert len(store) == 0
+    for i in range(4):
+        store.put(i, info(i))
+    store.get(0)
+    store.save()
+    assert store.dirty is False
+    assert tmpdir.join('items.pkl.tmp').check() is False
+    loaded = ItemStore(path, max_size=3)
+    loaded.load()
+    assert list(loaded.items.keys()) == [2, 3, 0]
+    assert loaded.get(0) == info(0)
+    assert loaded.dirty is False
+    assert loaded.get(3) == info(3)
+    assert loaded.dirty is True
+
+
+def test_save_not_dirty(tmpdir):
+    path = tmpdir.join('items.pkl')
+    store = ItemStore(str(path))
+    store.save()
+    assert path.check() is False
+    store.put(1, info(1))
+    store.save()
+    path.remove()
+    store.put(1, info(1))
+    store.save()
+    assert path.check() is False
+
+
+def test_save_merge(tmpdir):
+    """ items saved by another store since loading are kept, as less recently used """
+    path = str(tmpdir.join('items.pkl'))
+    a = ItemStore(path, max_size=3)
+    b = ItemStore(path, max_size=3)
+    a.put(1, info(1))
+    a.put(2, info(2))
+    a.save()
+    b.put(3, info(3))
+    b.put(2, info(2))
+    b.save()
+    c = ItemStore(path, max_size=3)
+    c.load()
+    assert list(c.items.keys()) == [1, 3, 2]
+    b.put(4, info(4))
+    b.save()
+    c.load()
+    assert list(c.items.keys()) == [3, 2, 4]
+
+
+def test_save_lru_order(tmpdir):
+    """ a get() or put() that only reorders the items is saved """
+    path = str(tmpdir.join('items.pkl'))
+    store = ItemStore(path, max_size=2)
+    store.put(1, info(1))
+    store.put(2, info(2))
+    store.save()
+    store = ItemStore(path, max_size=2)
+    store.load()
+    assert store.get(1) == info(1)
+    store.save()
+    store = ItemStore(path, max_size=2)
+    store.load()
+    store.put(3, info(3))
+    assert list(store.items.keys()) == [1, 3]
+    store.save()
+    store = ItemStore(path, max_size=2)
+    store.load()
+    store.put(1, info(1))
+    assert store.dirty is True
+    assert list(store.items.keys()) == [3, 1]
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for journal module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import pytest
+
+from autosimulationcraft.journal import RunJournal, JournalEntry
+
+
+def test_record(tmpdir):
+    j = RunJournal(str(tmpdir.join('journal.pkl')))
+    assert j.entries() == []
+    j.record('a@r', 'simulated', {'html_path': '/a.html'})
+    j.record('a@r', 'mailed')
+    assert RunJournal(j.path).entries() == [
+        JournalEntry('a@r', 'simulated', {'html_path': '/a.html'}),
+        JournalEntry('a@r', 'mailed', None)]
+    for stage in ['emailed', 'fetched']:
+        with pytest.raises(ValueError):
+            j.record('a@r', stage)
+    j.clear()
+    assert not tmpdir.join('journal.pkl').exists()
+    j.clear()
+
+
+def test_partial_entry(tmpdir):
+    """ a partially-written last entry is ignored """
+    j = RunJournal(str(tmpdir.join('journal.pkl')))
+    j.record('a@r', 'simulated', {'output': 'x' * 1000})
+    j.record('b@r', 'simulated', {'output': 'y' * 1000})
+    data = tmpdir.join('journal.pkl').read('rb')
+    tmpdir.join('journal.pkl').write(data[:-500], 'wb')
+    assert j.entries() == [JournalEntry('a@r', 'simulated', {'output': 'x' * 1000})]
+
+
+def test_unfinished(tmpdir):
+    j = RunJournal(str(tmpdir.join('journal.pkl')))
+    for c, stage, data in [('a@r', 'simulated', 'a1'),
+                           ('b@r', 'cached', None),
+                           ('c@r', 'simulated', 'c1'),
+                           ('a@r', 'mailed', None),
+                           ('c@r', 'mailed', None),
+                           ('c@r', 'cached', None),
+                           ('d@r', 'simulated', 'd1'),
+                           ('d@r', 'mailed', None),
+                           ('d@r', 'cached', None),
+                           # simulated again; starts over
+                           ('d@r', 'simulated', 'd2')]:
+        j.record(c, stage, data)
+    res = j.unfinished()
+    assert list(res.keys()) == ['a@r', 'd@r']
+    assert res['a@r'] == (set(['simulated', 'mailed']), 'a1')
+    assert res['d@r'] == (set(['simulated']), 'd2')
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for lock module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+
+from autosimulationcraft.lock import FileLock, Claims
+
+
+def test_file_lock(tmpdir):
+    path = str(tmpdir.join('x.lock'))
+    a = FileLock(path)
+    b = FileLock(path)
+    assert a.acquire(blocking=False) is True
+    assert a.locked is True
+    assert b.acquire(blocking=False) is False
+    assert b.locked is False
+    a.release()
+    assert a.locked is False
+    a.release()
+    with b:
+        assert b.locked is True
+        assert a.acquire(blocking=False) is False
+    assert b.locked is False
+    assert a.acquire(blocking=False) is True
+    a.release()
+
+
+def test_claims(tmpdir):
+    path = str(tmpdir.join('claims'))
+    a = Claims(path)
+    b = Claims(path)
+    assert a.claim('one@realm name') is True
+    assert a.claim('one@realm name') is True
+    assert os.listdir(path) == ['one@realm%20name.lock']
+    assert b.claim('one@realm name') is False
+    assert b.claim('two@r') is True
+    assert a.claim('two@r') is False
+    a.release_all()
+    assert a.locks == {}
+    assert b.claim('one@realm name') is True
+    b.release_all()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for mimestream module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+import smtplib
+from StringIO import StringIO
+from email import message_from_string
+from email.header import decode_header
+
+import pytest
+from mock import Mock, call
+
+from autosimulationcraft.mimestream import (StreamingMessage, DataWriter, send_message,
+                                            write_message, CHUNK_SIZE)
+
+
+class CountingFile(object):
+
+    """ file wrapper recording the size of each read """
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return self.fh.read(size)
+
+    def seek(self, pos):
+        self.fh.seek(pos)
+
+
+def test_message(tmpdir):
+    data = os.urandom(3 * CHUNK_SIZE + 5)
+    tmpdir.join('big.bin').write(data, mode='wb')
+    msg = StreamingMessage([('Subject', u'Report for J\xe4ntman'), ('To', 'a@example.com')])
+    msg.attach_text(u'caf\xe9\n')
+    msg.attach_text('plain')
+    msg.attach_file(str(tmpdir.join('big.bin')), 'big.bin')
+    msg.attach_data('.leading dot\n', 'out.txt')
+    msg.attach_file(StringIO('zipdata'), 'x.zip', subtype='zip')
+    assert msg['to'] == 'a@example.com'
+    assert msg['cc'] is None
+    parsed = message_from_string(msg.as_string())
+    assert decode_header(parsed['Subject']) == [('Report for J\xc3\xa4ntman', 'utf-8')]
+    assert parsed.get_content_type() == 'multipart/mixed'
+    parts = parsed.get_payload()
+    assert [p.get_content_type() for p in parts] == [
+        'text/plain', 'text/plain', 'application/octet-stream', 'application/octet-stream',
+        'application/zip']
+    assert parts[0].get_payload(decode=True).decode('utf-8') == u'caf\xe9\n'
+    assert parts[0].get_content_charset() == 'utf-8'
+    assert parts[1].get_payload(decode=True) == 'plain'
+    assert parts[1].get_content_charset() == 'us-ascii'
+    assert parts[2].get_payload(decode=True) == data
+    assert parts[2].get_filename() == 'big.bin'
+    assert parts[3].get_payload(decode=True) == '.leading dot\n'
+    assert parts[4].get_payload(decode=True) == 'zipdata'
+    # base64 bodies are in 76-character lines
+    assert max(len(l) for l in msg.as_string().split('\n') if ':' not in l) <= 76
+
+
+def test_message_reads_in_chunks():
+    src = CountingFile(StringIO('x' * (2 * CHUNK_SIZE + 1)))
+    msg = StreamingMessage([])
+    msg.attach_file(src, 'f')
+    out = StringIO()
+    msg.write_to(out)
+    assert src.reads == [CHUNK_SIZE] * 4
+    # the same message can be written again
+    msg.write_to(StringIO())
+    assert len(src.reads) == 8
+
+
+def test_message_non_ascii_filename():
+    msg = StreamingMessage([])
+    msg.attach_data('a', u'J\xe4ntman@Area52.html')
+    msg.attach_data('b', 'J\xc3\xa4ntman@Area52.txt')
+    out = StringIO()
+    msg.write_to(out)
+    assert "filename*=utf-8''J%C3%A4ntman%40Area52.html" in out.getvalue()
+    parts = message_from_string(out.getvalue()).get_payload()
+    assert [p.get_filename() for p in parts] == [u'J\xe4ntman@Area52.html', u'J\xe4ntman@Area52.txt']
+
+
+def test_write_message():
+    out = StringIO()
+    write_message('abc', out)
+    write_message(StringIO('def'), out)
+    msg = StreamingMessage([('Subject', 's')])
+    write_message(msg, out)
+    assert out.getvalue().startswith('abcdefSubject: s\n')
+
+
+def test_data_writer():
+    sock = Mock()
+    w = DataWriter(sock)
+    for chunk in ['Subject: x\n\n', '.starts with dot\nmid', '.dle\r\n', '', '.', 'a\n..b']:
+        w.write(chunk)
+    w.close()
+    sent = ''.join(c[0][0] for c in sock.sendall.call_args_list)
+    assert sent == ('Subject: x\r\n\r\n..starts with dot\r\nmid.dle\r\n..a\r\n...b\r\n.\r\n')
+
+
+def test_send_message():
+    smtp = Mock()
+    smtp.mail.return_value = (250, 'ok')
+    smtp.rcpt.return_value = (250, 'ok')
+    smtp.getreply.side_effect = [(354, 'go ahead'), (250, 'queued')]
+    send_message(smtp, 'from', 'to', 'Subject: x\n\nbody\n')
+    assert smtp.mail.call_args_list == [call('from')]
+    assert smtp.rcpt.call_args_list == [call('to')]
+    assert smtp.putcmd.call_args_list == [call('data')]
+    sent = ''.join(c[0][0] for c in smtp.sock.sendall.call_args_list)
+    assert sent == 'Subject: x\r\n\r\nbody\r\n.\r\n'
+
+
+def test_send_message_errors():
+    smtp = Mock()
+    smtp.mail.return_value = (550, 'no')
+    with pytest.raises(smtplib.SMTPSenderRefused):
+        send_message(smtp, 'from', 'to', 'x')
+    smtp.mail.return_value = (250, 'ok')
+    smtp.rcpt.return_value = (550, 'no such user')
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        send_message(smtp, 'from', 'to', 'x')
+    assert smtp.rset.call_count == 2
+    smtp.rcpt.return_value = (250, 'ok')
+    smtp.getreply.side_effect = [(451, 'try later')]
+    with pytest.raises(smtplib.SMTPDataError):
+        send_message(smtp, 'from', 'to', 'x')
+    smtp.getreply.side_effect = [(354, 'go ahead'), (552, 'too big')]
+    with pytest.raises(smtplib.SMTPDataError):
+        send_message(smtp, 'from', 'to', 'x')
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for record module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import pickle
+from copy import deepcopy
+
+from autosimulationcraft.record import CharacterRecord, Item, item_from_bnet
+from data_fixtures import bnet_data, char_data
+
+
+def make_flakes_happy():
+    """
+    hack to make flakes think fixtures are used.
+    this function never gets executed.
+    """
+    print(bnet_data, char_data)
+
+
+def test_item_from_bnet():
+    data = {'id': 123,
+            'name': 'Foo',
+            'bonusLists': [2, 1],
+            'tooltipParams': {'gem0': 5, 'gem1': 6, 'enchant': 7,
+                              'upgrade': {'current': 2, 'total': 2},
+                              'transmogItem': 99}}
+    assert item_from_bnet('head', data) == Item('head', 123, (2, 1), 7, (5, 6), 2)
+    assert item_from_bnet('neck', {'id': 1}) == Item('neck', 1, (), None, (), None)
+
+
+def test_from_bnet(char_data):
+    rec = CharacterRecord.from_bnet(char_data)
+    assert rec.name == 'Jantman'
+    assert rec.realm == 'Area 52'
+    assert rec.level == 100
+    assert rec.class_id == 9
+    assert rec.race_id == 5
+    assert rec.gender == 0
+    assert rec.spec == 'Destruction'
+    assert rec.talents == '110200.'
+    assert rec.glyphs == ('Glyph of Conflagrate', 'Glyph of Demon Training',
+                          'Glyph of Healthstone', 'Glyph of Nightmares')
+    assert rec.professions == (('Tailoring', 627), ('Enchanting', 622))
+    assert rec.item_level == 623
+    assert len(rec.items) == 15
+    assert [i.slot for i in rec.items] == sorted([i.slot for i in rec.items])
+    assert Item('waist', 114816, (213, 525, 537), None, (), None) in rec.items
+    assert dict(rec.stats)['critRating'] == 825
+
+
+def test_from_bnet_empty():
+    rec = CharacterRecord.from_bnet({'name': 'foo', 'realm': 'bar'})
+    assert rec.talents == ''
+    assert rec.spec is None
+    assert rec.glyphs == ()
+    assert rec.items == ()
+    assert rec.professions == ()
+
+
+def test_as_dict(char_data):
+    d = CharacterRecord.from_bnet(char_data).as_dict()
+    assert d['name'] == 'Jantman'
+    assert d['class'] == 9
+    assert d['professions'] == {'Tailoring': 627, 'Enchanting': 622}
+    assert d['items']['shoulder'] == {'id': 115997, 'bonusLists': [], 'enchant': None,
+                                      'gems': [], 'upgrade': None}
+    assert d['stats'] == char_data['stats']
+    assert d['appearance'] == char_data['appearance']
+
+
+def test_pickle(char_data):
+    rec = CharacterRecord.from_bnet(char_data)
+    for proto in [0, pickle.HIGHEST_PROTOCOL]:
+        res = pickle.loads(pickle.dumps(rec, proto))
+        assert res == rec
+        assert res.items == rec.items
+    assert len(pickle.dumps(rec, pickle.HIGHEST_PROTOCOL)) < len(
+        pickle.dumps(char_data, pickle.HIGHEST_PROTOCOL)) / 2
+
+
+def test_merge_fields(char_data):
+    rec = CharacterRecord.from_bnet({'name': 'Jantman', 'level': 101})
+    rec.fetched = {'items': 1}
+    other = CharacterRecord.from_bnet(char_data)
+    other.fetched = {'talents': 2, 'items': 3}
+    rec.merge_fields(other, ['talents', 'professions'])
+    assert rec.level == 101
+    assert rec.items == ()
+    assert rec.talents == '110200.'
+    assert rec.spec == 'Destruction'
+    assert rec.glyphs == other.glyphs
+    assert rec.professions == other.professions
+    assert rec.fetched == {'items': 1, 'talents': 2}
+
+
+def test_setstate_legacy(char_data):
+    rec = CharacterRecord.from_bnet(char_data)
+    res = CharacterRecord.__new__(CharacterRecord)
+    res.__setstate__(rec.__getstate__()[:-1])
+    assert res == rec
+    assert res.fetched == {}
+
+
+def test_eq(char_data):
+    rec = CharacterRecord.from_bnet(char_data)
+    other = deepcopy(char_data)
+    assert CharacterRecord.from_bnet(other) == rec
+    other['items']['shoulder']['name'] = 'Something Else'
+    other['items']['shoulder']['tooltipParams']['transmogItem'] = 1
+    assert CharacterRecord.from_bnet(other) == rec
+    other['items']['shoulder']['id'] = 1
+    assert CharacterRecord.from_bnet(other) != rec
+    assert rec != 'foo'
+    other = CharacterRecord.from_bnet(char_data)
+    other.fetched = {'items': 1}
+    assert other == rec
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for regions module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+from mock import patch, call, Mock
+import battlenet
+
+from autosimulationcraft.regions import RateLimiter, RegionPool
+
+
+class Test_RateLimiter:
+
+    def test_unlimited(self):
+        """ test RateLimiter with no limit """
+        r = RateLimiter()
+        with patch('autosimulationcraft.regions.time.sleep') as mock_sleep:
+            r.wait()
+            r.wait()
+        assert mock_sleep.call_args_list == []
+
+    def test_limited(self):
+        """ test RateLimiter spacing calls """
+        r = RateLimiter(per_second=4)
+        with patch('autosimulationcraft.regions.time.sleep') as mock_sleep, \
+                patch('autosimulationcraft.regions.time.time') as mock_time:
+            mock_time.side_effect = [100.0, 100.0, 100.25, 101.0]
+            r.wait()
+            r.wait()
+            r.wait()
+            r.wait()
+        assert mock_sleep.call_args_list == [call(0.25), call(0.25)]
+
+
+class Test_RegionPool:
+
+    def test_init(self):
+        """ test RegionPool() """
+        conn = Mock()
+        p = RegionPool('eu', conn, per_second=2)
+        assert p.region == 'eu'
+        assert p.bnet_region == battlenet.EUROPE
+        assert p.connection == conn
+        assert p.limiter.interval == 0.5
+
+    def test_throttle(self):
+        """ test RegionPool.throttle() """
+        p = RegionPool('us', Mock())
+        with patch.object(p, 'limiter') as mock_limiter:
+            p.throttle()
+        assert mock_limiter.mock_calls == [call.wait()]
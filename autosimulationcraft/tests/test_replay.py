@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for replay module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import gzip
+import json
+import urllib2
+
+import pytest
+import battlenet
+from battlenet.exceptions import APIError
+from mock import Mock, call
+
+from autosimulationcraft.httpcache import CachingConnection
+from autosimulationcraft.replay import Recorder, ReplayTransport, request_key
+from fixtures import api
+
+
+def make_flakes_happy():
+    """
+    hack to make flakes think fixtures are used.
+    this function never gets executed.
+    """
+    print(api)
+
+
+URL_FORMAT = 'http://127.0.0.1:{p}/%(region)s/%(game)s%(path)s?%(params)s'
+
+
+def connection(port, transport):
+    conn = CachingConnection(transport=transport)
+    conn.url_format = URL_FORMAT.format(p=port)
+    return conn
+
+
+@pytest.fixture
+def archive(api, tmpdir):
+    """ record a character, an item and a 404 from the ``api`` fixture """
+    api.responses['/us/wow/character/area%2052/jantman?fields=items'] = (
+        '"abc"', json.dumps({'name': 'Jantman', 'realm': 'Area 52'}))
+    api.responses['/us/wow/item/1?'] = (None, json.dumps({'name': u'épée'}))
+    path = str(tmpdir.join('archive.gz'))
+    rec = Recorder(path)
+    conn = connection(api.server_port, rec)
+    conn.get_character(battlenet.UNITED_STATES, 'Area 52', 'Jantman', fields=['items'], raw=True)
+    assert conn.make_request('us', '/item/1')['name'] == u'épée'
+    with pytest.raises(battlenet.CharacterNotFound):
+        conn.get_character(battlenet.UNITED_STATES, 'Area 52', 'Nobody', raw=True)
+    rec.close()
+    assert rec.count == 3
+    return (api.server_port, path)
+
+
+def test_record(archive):
+    with gzip.open(archive[1], 'rb') as fh:
+        entries = [json.loads(l) for l in fh]
+    assert [(e['url'].split('/', 3)[3], e['code']) for e in entries] == [
+        ('us/wow/character/area%2052/jantman?fields=items', 200),
+        ('us/wow/item/1?', 200),
+        ('us/wow/character/area%2052/nobody?', 404),
+    ]
+    assert entries[0]['headers'] == {'ETag': '"abc"',
+                                     'Last-Modified': 'Wed, 01 Jan 2014 00:00:00 GMT',
+                                     'Content-Type': 'application/json'}
+    assert entries[2]['body'] == ''
+
+
+def test_replay(archive):
+    sleep = Mock()
+    rt = ReplayTransport(archive[1], sleep=sleep)
+    conn = connection(archive[0], rt)
+    res = conn.get_character(battlenet.UNITED_STATES, 'Area 52', 'Jantman', fields=['items'],
+                             raw=True)
+    assert res['name'] == 'Jantman'
+    assert conn.make_request('us', '/item/1')['name'] == u'épée'
+    with pytest.raises(battlenet.CharacterNotFound):
+        conn.get_character(battlenet.UNITED_STATES, 'Area 52', 'Nobody', raw=True)
+    # not recorded
+    with pytest.raises(battlenet.CharacterNotFound):
+        conn.get_character(battlenet.UNITED_STATES, 'Area 52', 'Other', fields=['items'],
+                           raw=True)
+    assert sleep.mock_calls == []
+
+
+def test_request_key():
+    assert request_key('http://x/us/wow/character/r/c?fields=talents,items&locale=en_US') == (
+        'http://x/us/wow/character/r/c?locale=en_US', frozenset(['items', 'talents']))
+    assert request_key('http://x/us/wow/character/r/c?locale=en_US&fields=items%2Ctalents') == (
+        'http://x/us/wow/character/r/c?locale=en_US', frozenset(['items', 'talents']))
+    assert request_key('http://x/us/wow/item/1?') == ('http://x/us/wow/item/1?', frozenset())
+
+
+def test_replay_other_fields(api, tmpdir):
+    """ replay requests for other (stale) fields than were recorded """
+    api.responses['/us/wow/character/area%2052/jantman?fields=items,talents'] = (
+        None, json.dumps({'name': 'Jantman', 'items': {'head': 1}, 'talents': [1]}))
+    path = str(tmpdir.join('archive.gz'))
+    rec = Recorder(path)
+    conn = connection(api.server_port, rec)
+    conn.get_character(battlenet.UNITED_STATES, 'Area 52', 'Jantman', fields=['items', 'talents'],
+                       raw=True)
+    rec.close()
+    rt = ReplayTransport(path)
+    conn = connection(api.server_port, rt)
+    res = conn.get_character(battlenet.UNITED_STATES, 'Area 52', 'Jantman',
+                             fields=['talents', 'items'], raw=True)
+    assert res == {'name': 'Jantman', 'items': {'head': 1}, 'talents': [1]}
+    res = conn.get_character(battlenet.UNITED_STATES, 'Area 52', 'Jantman', fields=['talents'],
+                             raw=True)
+    assert res == {'name': 'Jantman', 'talents': [1]}
+    res = conn.get_character(battlenet.UNITED_STATES, 'Area 52', 'Jantman', raw=True)
+    assert res == {'name': 'Jantman'}
+    # not recorded
+    with pytest.raises(battlenet.CharacterNotFound):
+        conn.get_character(battlenet.UNITED_STATES, 'Area 52', 'Jantman', fields=['stats'],
+                           raw=True)
+
+
+def test_replay_latency(archive):
+    sleep = Mock()
+    rt = ReplayTransport(archive[1], latency=0.5, jitter=0.25, seed=1, sleep=sleep)
+    conn = connection(archive[0], rt)
+    for i in range(10):
+        conn.make_request('us', '/item/1')
+    assert len(sleep.mock_calls) == 10
+    delays = [c[1][0] for c in sleep.mock_calls]
+    assert min(delays) >= 0.5
+    assert max(delays) <= 0.75
+    assert len(set(delays)) > 1
+
+
+def test_replay_errors(archive):
+    rt = ReplayTransport(archive[1], error_rate=0.5, seed=1, sleep=Mock())
+    conn = connection(archive[0], rt)
+    failed = 0
+    for i in range(100):
+        try:
+            conn.make_request('us', '/item/1')
+        except APIError:
+            failed += 1
+    assert 30 < failed < 70
+
+
+def test_replay_substitute(archive):
+    rt = ReplayTransport(archive[1], substitute=True)
+    conn = connection(archive[0], rt)
+    for name in ['Other', 'Another']:
+        res = conn.get_character(battlenet.UNITED_STATES, 'Area 52', name, fields=['items'],
+                                 raw=True)
+        assert res['name'] == 'Jantman'
+    # only characters are substituted
+    with pytest.raises(APIError):
+        conn.make_request('us', '/item/2')
+    assert rt.lookup('http://x/us/wow/item/2?') is None
+
+
+def test_replay_seed_repeatable(archive):
+    sleeps = []
+    for i in range(2):
+        sleep = Mock()
+        rt = ReplayTransport(archive[1], jitter=1.0, seed=42, sleep=sleep)
+        with pytest.raises(urllib2.HTTPError):
+            rt(Mock(get_full_url=Mock(return_value='http://x/us/wow/item/1?')))
+        sleeps.append(sleep.mock_calls)
+    assert sleeps[0] == sleeps[1]
+    assert sleeps[0] != [call(0.0)]
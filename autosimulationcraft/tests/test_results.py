@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for results module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import json
+import datetime
+
+import pytest
+from mock import patch, Mock
+
+from autosimulationcraft.results import (parse_results, read_results, ResultStore, SimResult,
+                                         ScenarioResult, PARSE_ERRORS, _events, BASELINE)
+
+# trimmed-down simc json2 report
+REPORT = {
+    'version': '620-02',
+    'sim': {
+        'options': {'iterations': 10000, 'fight_style': 'Patchwerk', 'max_time': 450},
+        'statistics': {'elapsed_cpu_seconds': 11.2, 'elapsed_time_seconds': 3.5},
+        'players': [
+            {
+                'name': 'Jantman',
+                'specialization': 'Arms Warrior',
+                'buffs': [{'name': 'bloodlust', 'start_count': 1.0}],
+                'collected_data': {
+                    'dps': {'mean': 25000.5, 'min': 21000.0, 'max': 29000.0,
+                            'std_dev': 1200.25, 'count': 10000},
+                    'dtps': {'mean': 10.0},
+                },
+            },
+        ],
+        'profilesets': {
+            'metric': 'dps',
+            'results': [
+                {'name': 'trinket_a', 'mean': 25500, 'min': 21100, 'max': 29900,
+                 'stddev': 1100.0},
+            ],
+        },
+    },
+}
+
+EXPECTED = SimResult('620-02', 10000, 'Patchwerk', 3.5, [
+    ScenarioResult(BASELINE, 'Jantman', 25000.5, 21000.0, 29000.0, 1200.25),
+    ScenarioResult('trinket_a', 'Jantman', 25500.0, 21100.0, 29900.0, 1100.0),
+])
+
+
+def test_parse_results():
+    assert parse_results(_events(REPORT)) == EXPECTED
+
+
+def test_parse_results_empty():
+    assert parse_results(_events({})) == SimResult(None, None, None, None, [])
+
+
+def test_read_results(tmpdir):
+    p = tmpdir.join('x.json')
+    p.write(json.dumps(REPORT))
+    with patch('autosimulationcraft.results.ijson', None):
+        assert read_results(str(p)) == EXPECTED
+
+
+def test_read_results_ijson(tmpdir):
+    p = tmpdir.join('x.json')
+    p.write(json.dumps(REPORT))
+    mock_ijson = Mock()
+    mock_ijson.parse.side_effect = lambda fh: _events(json.load(fh))
+    with patch('autosimulationcraft.results.ijson', mock_ijson):
+        assert read_results(str(p)) == EXPECTED
+    assert mock_ijson.parse.call_count == 1
+
+
+def test_read_results_errors(tmpdir):
+    p = tmpdir.join('x.json')
+    p.write('{"version": ')
+    with patch('autosimulationcraft.results.ijson', None):
+        with pytest.raises(PARSE_ERRORS):
+            read_results(str(p))
+        with pytest.raises(PARSE_ERRORS):
+            read_results(str(tmpdir.join('missing.json')))
+
+
+def test_result_store(tmpdir):
+    path = str(tmpdir.join('results.db'))
+    store = ResultStore(path)
+    d1 = datetime.datetime(2015, 1, 1, 10, 0, 0)
+    d2 = datetime.datetime(2015, 1, 2, 10, 0, 0)
+    d3 = datetime.datetime(2015, 1, 3, 10, 0, 0)
+    store.add_run('a@r', d2, 60.0, result=EXPECTED)
+    store.add_run('a@r', d1, 50.0, result=EXPECTED._replace(scenarios=[
+        EXPECTED.scenarios[0]._replace(dps=20000.0)]))
+    store.add_run('a@r', d3, 5.0, error='simc exited 1')
+    store.add_run('b@r', d3, 70.0, result=EXPECTED)
+    store.close()
+    # re-open
+    store = ResultStore(path)
+    assert store.history('a@r') == [(d1, 20000.0), (d2, 25000.5)]
+    assert store.history('a@r', limit=1) == [(d2, 25000.5)]
+    assert store.history('a@r', scenario='trinket_a') == [(d2, 25500.0)]
+    assert store.history('c@r') == []
+    assert [(r[1], r[2], r[3]) for r in store.runs('a@r')] == [
+        (d1, 50.0, None), (d2, 60.0, None), (d3, 5.0, 'simc exited 1')]
+
+
+def test_result_store_rename(tmpdir):
+    store = ResultStore(str(tmpdir.join('results.db')))
+    d1 = datetime.datetime(2015, 1, 1, 10, 0, 0)
+    store.add_run('a@r', d1, 60.0, result=EXPECTED)
+    assert store.rename_character('a@r', 'a@r.eu') is True
+    assert store.history('a@r') == []
+    assert store.history('a@r.eu') == [(d1, 25000.5)]
+    assert store.rename_character('a@r', 'a@r.eu') is False
+
+
+def test_result_store_indexes(tmpdir):
+    store = ResultStore(str(tmpdir.join('results.db')))
+    names = [r[0] for r in store.conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'")]
+    assert sorted(names) == ['results_run', 'results_scenario', 'runs_character']
+    plan = store.conn.execute(
+        'EXPLAIN QUERY PLAN SELECT * FROM runs WHERE character = ?', ('a@r', )).fetchall()
+    assert 'runs_character' in str(plan)
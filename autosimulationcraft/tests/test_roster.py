@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for roster module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import pytest
+from mock import patch
+
+from autosimulationcraft import roster
+from autosimulationcraft.roster import iter_roster, has_email, RosterError
+
+
+def test_iter_roster_csv(tmpdir):
+    """ test iter_roster() with a CSV file """
+    p = tmpdir.join('roster.csv')
+    p.write("realm,name,email,options.fight_style,options.threads\n"
+            "Area 52,Jantman,a@example.com; b@example.com,LightMovement,\n"
+            "Area 52,Other,,,2\n"
+            "Area 52,TooLong,c@example.com,,,extra\n")
+    res = list(iter_roster(str(p)))
+    assert res == [
+        (2, {'realm': 'Area 52',
+             'name': 'Jantman',
+             'email': ['a@example.com', 'b@example.com'],
+             'options': {'fight_style': 'LightMovement'}}, None),
+        (3, {'realm': 'Area 52', 'name': 'Other', 'options': {'threads': '2'}}, None),
+        (4, None, 'more fields than header columns'),
+    ]
+
+
+def test_iter_roster_csv_bom(tmpdir):
+    """ test iter_roster() with a CSV file starting with a byte order mark (i.e. from Excel) """
+    p = tmpdir.join('roster.csv')
+    p.write('\xef\xbb\xbfname,realm,email\nJ\xc3\xa4ntman,Area 52,a@example.com\n', 'wb')
+    assert list(iter_roster(str(p))) == [
+        (2, {'realm': 'Area 52', 'name': 'J\xc3\xa4ntman', 'email': ['a@example.com']}, None)]
+
+
+def test_iter_roster_jsonl_bom(tmpdir):
+    """ test iter_roster() with a JSON-lines file starting with a byte order mark """
+    p = tmpdir.join('roster.jsonl')
+    p.write('\xef\xbb\xbf{"realm": "r", "name": "J\xc3\xa4ntman"}\n', 'wb')
+    assert list(iter_roster(str(p))) == [(1, {'realm': u'r', 'name': u'J\xe4ntman'}, None)]
+
+
+def test_iter_roster_jsonl(tmpdir):
+    """ test iter_roster() with a JSON-lines file """
+    p = tmpdir.join('roster.jsonl')
+    p.write('{"realm": "r", "name": "one"}\n'
+            '\n'
+            '{"realm": "r", "name": \n'
+            '{"realm": "r", "name": "three"}\n')
+    res = list(iter_roster(str(p)))
+    assert res[0] == (1, {'realm': 'r', 'name': 'one'}, None)
+    assert res[1][0] == 3
+    assert res[1][1] is None
+    assert res[1][2].startswith('invalid JSON: ')
+    assert res[2] == (4, {'realm': 'r', 'name': 'three'}, None)
+
+
+def test_iter_roster_json(tmpdir):
+    """ test iter_roster() with a JSON file """
+    p = tmpdir.join('roster.json')
+    p.write('[{"realm": "r", "name": "one"}, "bad"]')
+    assert list(iter_roster(str(p))) == [
+        (1, {'realm': 'r', 'name': 'one'}, None),
+        (2, 'bad', None),
+    ]
+
+
+def test_iter_roster_json_not_list(tmpdir):
+    """ test iter_roster() with a JSON file that isn't a list """
+    p = tmpdir.join('roster.json')
+    p.write('{"realm": "r", "name": "one"}')
+    with pytest.raises(RosterError):
+        list(iter_roster(str(p)))
+
+
+def test_iter_roster_json_invalid(tmpdir):
+    """ test iter_roster() with an unparseable JSON file """
+    p = tmpdir.join('roster.json')
+    p.write('[{"realm": ')
+    with pytest.raises(RosterError):
+        list(iter_roster(str(p)))
+
+
+def test_iter_roster_yaml_missing(tmpdir):
+    """ test iter_roster() with a YAML file and no PyYAML """
+    p = tmpdir.join('roster.yml')
+    p.write('- realm: r\n  name: one\n')
+    with patch.object(roster, 'yaml', None):
+        with pytest.raises(RosterError) as excinfo:
+            iter_roster(str(p))
+    assert 'PyYAML' in str(excinfo.value)
+
+
+def test_iter_roster_unknown(tmpdir):
+    """ test iter_roster() with an unknown file type """
+    with pytest.raises(RosterError):
+        iter_roster(str(tmpdir.join('roster.txt')))
+
+
+def test_has_email():
+    assert has_email({'email': 'a@b'}) is True
+    assert has_email({'email': ['', 'a@b']}) is True
+    assert has_email({'email': ('a@b',)}) is True
+    assert has_email({}) is False
+    assert has_email({'email': ''}) is False
+    assert has_email({'email': '  '}) is False
+    assert has_email({'email': []}) is False
+    assert has_email({'email': [None, ' ']}) is False
@@ -38,11 +38,14 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 
 """
 
+import datetime
+
 from mock import patch, call
 import pytest
 
 import autosimulationcraft.runner
 from autosimulationcraft.version import VERSION
+from autosimulationcraft.config import DEFAULT_CONFDIR
 from fixtures import Container
 
 
@@ -56,6 +59,18 @@ def test_parse_argv():
     assert args.genconfig is True
     assert args.version is False
     assert args.no_stat is False
+    assert args.offline is False
+    assert args.characters is None
+    assert args.record is None
+    assert args.replay is None
+
+
+def test_parse_argv_offline():
+    """ test parse_argv() with --offline and --character """
+    args = autosimulationcraft.runner.parse_args(['--offline', '--character', 'a@r',
+                                                  '--character', 'b@r'])
+    assert args.offline is True
+    assert args.characters == ['a@r', 'b@r']
 
 
 def test_console_entry_genconfig():
@@ -98,6 +113,12 @@ def test_console_entry():
         setattr(args, 'verbose', 1)
         setattr(args, 'version', False)
         setattr(args, 'no_stat', False)
+        setattr(args, 'offline', False)
+        setattr(args, 'characters', None)
+        setattr(args, 'record', None)
+        setattr(args, 'replay', None)
+        setattr(args, 'history', False)
+        setattr(args, 'lock_policy', None)
         mock_parse_args.return_value = args
         autosimulationcraft.runner.console_entry_point()
     assert mock_parse_args.call_count == 1
@@ -105,12 +126,15 @@ def test_console_entry():
         call(
             dry_run=False,
             verbose=1,
-            confdir='/foo/bar'),
-        call().run(no_stat=False)]
+            confdir='/foo/bar',
+            offline=False,
+            transport=None,
+            lock_policy=None),
+        call().run(no_stat=False, only=None)]
 
 
 def test_console_entry_no_stat():
-    """ test console_entry_point() """
+    """ test console_entry_point() with --no-stat, --offline and --character """
     with patch('autosimulationcraft.runner.parse_args') as mock_parse_args, \
             patch('autosimulationcraft.runner.AutoSimulationCraft', autospec=True) as mock_AS:
         args = Container()
@@ -120,6 +144,12 @@ def test_console_entry_no_stat():
         setattr(args, 'verbose', 1)
         setattr(args, 'version', False)
         setattr(args, 'no_stat', True)
+        setattr(args, 'offline', True)
+        setattr(args, 'characters', ['a@r'])
+        setattr(args, 'record', None)
+        setattr(args, 'replay', None)
+        setattr(args, 'history', False)
+        setattr(args, 'lock_policy', None)
         mock_parse_args.return_value = args
         autosimulationcraft.runner.console_entry_point()
     assert mock_parse_args.call_count == 1
@@ -127,5 +157,109 @@ def test_console_entry_no_stat():
         call(
             dry_run=False,
             verbose=1,
-            confdir='/foo/bar'),
-        call().run(no_stat=True)]
+            confdir='/foo/bar',
+            offline=True,
+            transport=None,
+            lock_policy=None),
+        call().run(no_stat=True, only=['a@r'])]
+
+
+def test_parse_argv_replay():
+    """ test parse_argv() with replay options """
+    args = autosimulationcraft.runner.parse_args(['--replay', 'foo.gz', '--replay-latency', '0.2',
+                                                  '--replay-jitter', '0.1',
+                                                  '--replay-error-rate', '0.05',
+                                                  '--replay-substitute'])
+    assert args.replay == 'foo.gz'
+    assert args.replay_latency == 0.2
+    assert args.replay_jitter == 0.1
+    assert args.replay_error_rate == 0.05
+    assert args.replay_substitute is True
+
+
+def test_console_entry_record():
+    """ test console_entry_point() with --record """
+    args = autosimulationcraft.runner.parse_args(['--record', 'out.gz'])
+    with patch('autosimulationcraft.runner.parse_args') as mock_parse_args, \
+            patch('autosimulationcraft.runner.Recorder', autospec=True) as mock_rec, \
+            patch('autosimulationcraft.runner.AutoSimulationCraft', autospec=True) as mock_AS:
+        mock_parse_args.return_value = args
+        mock_AS.return_value.run.side_effect = RuntimeError()
+        with pytest.raises(RuntimeError):
+            autosimulationcraft.runner.console_entry_point()
+    assert mock_rec.mock_calls == [call('out.gz'), call().close()]
+    assert mock_AS.mock_calls[0] == call(dry_run=False, verbose=0, confdir=DEFAULT_CONFDIR,
+                                         offline=False, transport=mock_rec.return_value,
+                                         lock_policy=None)
+
+
+def test_console_entry_replay():
+    """ test console_entry_point() with --replay """
+    args = autosimulationcraft.runner.parse_args(['--replay', 'in.gz', '--replay-latency', '0.5'])
+    with patch('autosimulationcraft.runner.parse_args') as mock_parse_args, \
+            patch('autosimulationcraft.runner.ReplayTransport', autospec=True) as mock_rep, \
+            patch('autosimulationcraft.runner.AutoSimulationCraft', autospec=True) as mock_AS:
+        mock_parse_args.return_value = args
+        autosimulationcraft.runner.console_entry_point()
+    assert mock_rep.mock_calls == [call('in.gz', latency=0.5, jitter=0.0, error_rate=0.0,
+                                        substitute=False)]
+    assert mock_AS.mock_calls == [
+        call(dry_run=False, verbose=0, confdir=DEFAULT_CONFDIR, offline=False,
+             transport=mock_rep.return_value, lock_policy=None),
+        call().run(no_stat=False, only=None)]
+
+
+def test_parse_argv_lock_policy():
+    """ test parse_argv() with --lock-policy """
+    assert autosimulationcraft.runner.parse_args([]).lock_policy is None
+    args = autosimulationcraft.runner.parse_args(['--lock-policy', 'takeover'])
+    assert args.lock_policy == 'takeover'
+    with pytest.raises(SystemExit):
+        autosimulationcraft.runner.parse_args(['--lock-policy', 'foo'])
+
+
+def test_parse_argv_history():
+    """ test parse_argv() with history options """
+    args = autosimulationcraft.runner.parse_args(['--history', '--since', '2015-03-01',
+                                                  '--until', '2015-04-01', '--rolling', '5'])
+    assert args.history is True
+    assert args.since == datetime.datetime(2015, 3, 1)
+    assert args.until == datetime.datetime(2015, 4, 1)
+    assert args.rolling == 5
+
+
+def test_parse_argv_bad_date(capsys):
+    """ test parse_argv() with an invalid date """
+    with pytest.raises(SystemExit):
+        autosimulationcraft.runner.parse_args(['--history', '--since', '03/01/2015'])
+    out, err = capsys.readouterr()
+    assert "invalid date '03/01/2015' (expected YYYY-MM-DD)" in err
+
+
+def test_parse_argv_bad_rolling(capsys):
+    """ test parse_argv() with a --rolling value less than 1 """
+    for value in ['0', '-2', 'x']:
+        with pytest.raises(SystemExit):
+            autosimulationcraft.runner.parse_args(['--history', '--rolling', value])
+        out, err = capsys.readouterr()
+        assert "invalid value '{v}' (expected an integer >= 1)".format(v=value) in err
+
+
+def test_console_entry_history(capsys, tmpdir):
+    """ test console_entry_point() with --history """
+    args = autosimulationcraft.runner.parse_args(['--history', '-c', str(tmpdir),
+                                                  '--character', 'a@r', '--rolling', '3'])
+    with patch('autosimulationcraft.runner.parse_args') as mock_parse_args, \
+            patch('autosimulationcraft.runner.DPSHistory', autospec=True) as mock_hist, \
+            patch('autosimulationcraft.runner.AutoSimulationCraft', autospec=True) as mock_AS:
+        mock_parse_args.return_value = args
+        mock_hist.return_value.report.return_value = u'report'
+        with pytest.raises(SystemExit) as excinfo:
+            autosimulationcraft.runner.console_entry_point()
+    assert excinfo.value.code is None
+    assert mock_hist.mock_calls == [
+        call(str(tmpdir.join('history'))),
+        call().report(characters=['a@r'], start=None, end=None, window=3)]
+    assert mock_AS.mock_calls == []
+    out, err = capsys.readouterr()
+    assert out == 'report\n'
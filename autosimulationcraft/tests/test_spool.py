@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - tests for spool module
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+import os
+import socket
+import smtplib
+import threading
+
+from mock import Mock, call
+
+from autosimulationcraft.spool import MailSpool, MailSender, SpoolEntry
+from autosimulationcraft.mimestream import StreamingMessage
+
+
+class Clock(object):
+
+    """ controllable time source for MailSender """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_spool(tmpdir):
+    spool = MailSpool(str(tmpdir.join('spool')))
+    assert spool.entries() == []
+    e1 = spool.add('from', 'to1', 'msg1')
+    e2 = spool.add('from', 'to2', 'msg2')
+    assert e1 == SpoolEntry(e1.id, 'from', 'to1', 0, 0.0, None)
+    assert e1.id < e2.id
+    assert spool.entries() == [e1, e2]
+    assert open(spool.message_path(e2.id)).read() == 'msg2'
+    spool.update(e1._replace(attempts=1, next_attempt=5.0, last_error='x'))
+    assert [e.id for e in spool.entries()] == [e2.id, e1.id]
+    assert len(spool) == 2
+    # incomplete/foreign files are ignored
+    tmpdir.join('spool', 'junk.json').write('not json')
+    tmpdir.join('spool', 'partial.eml').write('no entry')
+    assert len(spool) == 2
+    spool.remove(e2)
+    assert not os.path.exists(spool.message_path(e2.id))
+    spool.fail(spool.entries()[0])
+    assert spool.entries() == []
+    assert sorted(os.listdir(str(tmpdir.join('spool', 'failed')))) == [
+        e1.id + '.eml', e1.id + '.json']
+
+
+def test_sender_backoff(tmpdir):
+    spool = MailSpool(str(tmpdir))
+    entry = spool.add('from', 'to', 'msg')
+    clock = Clock()
+    sent = []
+    error = [smtplib.SMTPServerDisconnected('gone')]
+
+    def deliver(from_addr, dest, fh):
+        sent.append((from_addr, dest, fh.read()))
+        if error[0] is not None:
+            raise error[0]
+
+    logger = Mock()
+    sender = MailSender(spool, deliver, logger, retry_delay=10, max_attempts=10, clock=clock)
+    assert [sender.backoff(n) for n in [1, 2, 3, 4]] == [10, 20, 40, 80]
+    assert sender.backoff(20) == MailSender.MAX_DELAY
+    sender.attempt(entry)
+    entry = spool.entries()[0]
+    assert (entry.attempts, entry.next_attempt, entry.last_error) == (1, 1010.0, 'gone')
+    clock.now = 1010.0
+    sender.attempt(entry)
+    entry = spool.entries()[0]
+    assert (entry.attempts, entry.next_attempt) == (2, 1030.0)
+    error[0] = None
+    sender.attempt(entry)
+    assert spool.entries() == []
+    assert sent == [('from', 'to', 'msg')] * 3
+    assert logger.warning.call_args_list == [
+        call("Unable to send email to to (gone); will retry in 10 seconds"),
+        call("Unable to send email to to (gone); will retry in 20 seconds")]
+
+
+def test_sender_max_attempts(tmpdir):
+    spool = MailSpool(str(tmpdir))
+    spool.add('from', 'to', 'msg')
+    logger = Mock()
+    sender = MailSender(spool, Mock(side_effect=socket.error('refused')), logger,
+                        retry_delay=0, max_attempts=3)
+    sender.start()
+    sender.stop(wait=5)
+    assert spool.entries() == []
+    assert len(os.listdir(str(tmpdir.join('failed')))) == 2
+    assert logger.warning.call_count == 2
+    assert logger.error.call_args_list == [
+        call("Unable to send email to to after 3 attempts (refused); giving up")]
+
+
+def test_sender_delivers_and_wakes(tmpdir):
+    spool = MailSpool(str(tmpdir))
+    delivered = threading.Event()
+
+    def deliver(from_addr, dest, msg_s):
+        delivered.set()
+
+    sender = MailSender(spool, deliver, Mock())
+    sender.start()
+    spool.add('from', 'to', 'msg')
+    sender.wake()
+    delivered.wait(5)
+    sender.stop()
+    assert not sender.is_alive()
+    assert spool.entries() == []
+
+
+def test_sender_stop_deadline(tmpdir):
+    """ retries due after the deadline are left in the spool """
+    spool = MailSpool(str(tmpdir))
+    spool.add('from', 'to', 'msg')
+    clock = Clock()
+    deliver = Mock(side_effect=socket.error('refused'))
+    sender = MailSender(spool, deliver, Mock(), retry_delay=60, clock=clock)
+    sender.start()
+    sender.stop(wait=30)
+    assert not sender.is_alive()
+    assert deliver.call_count == 1
+    assert [(e.attempts, e.next_attempt) for e in spool.entries()] == [(1, 1060.0)]
+    # a later run picks it up again once it is due
+    clock.now = 1060.0
+    deliver.side_effect = None
+    sender = MailSender(spool, deliver, Mock(), clock=clock)
+    sender.start()
+    sender.stop()
+    assert spool.entries() == []
+    assert deliver.call_count == 2
+
+
+def test_spool_streaming_message(tmpdir):
+    spool = MailSpool(str(tmpdir))
+    msg = StreamingMessage([('Subject', 'hi')])
+    msg.attach_data('x' * 100, 'x.txt')
+    entry = spool.add('from', 'to', msg)
+    with open(spool.message_path(entry.id)) as fh:
+        assert fh.read() == msg.as_string()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+AutoSimulationCraft - str/unicode helpers
+
+The latest version of this package is available at:
+<https://github.com/jantman/autosimulationcraft>
+
+##################################################################################
+Copyright 2015 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of autosimulationcraft.
+
+    autosimulationcraft is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    autosimulationcraft is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with autosimulationcraft.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/autosimulationcraft> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+"""
+
+
+def to_bytes(value):
+    """
+    Return ``value`` as a UTF-8 encoded str. Character names and realms are
+    kept as str everywhere (they're used in file names and cache keys), but
+    the Battlenet API, JSON and YAML give us unicode.
+
+    :param value: str or unicode
+    :rtype: str
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def to_text(value):
+    """
+    Return ``value`` as unicode, decoding UTF-8 str; for building email
+    text from character names.
+
+    :param value: str or unicode
+    :rtype: unicode
+    """
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
@@ -10,7 +10,6 @@ with open('README.rst') as file:
 
 requires = [
     'battlenet>=0.2.6',
-    'dictdiffer>=0.3.0',
 ]
 
 classifiers = [